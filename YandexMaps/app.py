@@ -1,13 +1,10 @@
+import asyncio
 import os
 import urllib.parse
-from typing import Dict, List, Optional, Tuple
+from contextlib import asynccontextmanager
+from typing import Awaitable, Callable, Dict, Hashable, List, Optional, Tuple
 
-import requests
-from flask import Flask, jsonify, request
-from flask_cors import CORS
-
-app = Flask(__name__)
-CORS(app)
+from aiohttp import ClientError, ClientSession, ClientTimeout, TCPConnector, web
 
 # Default keys baked into the stack so the map proxy still works when env vars
 # are not explicitly provided (e.g., local `docker compose up` without a `.env`).
@@ -24,12 +21,113 @@ STATIC_API_KEY = (
     or os.environ.get("YANDEX_MAPS_API_KEY")
     or DEFAULT_STATIC_KEY
 )
-GEOCODE_URL = "https://geocode-maps.yandex.ru/1.x/"
-OSRM_URL = "https://router.project-osrm.org/route/v1/driving"
-STATIC_MAP_URL = "https://static-maps.yandex.ru/1.x/"
+# Upstream endpoints; overridden to point at stand-ins in benchmarks (bench/upstreams.py).
+GEOCODE_URL = os.environ.get("GEOCODE_URL", "https://geocode-maps.yandex.ru/1.x/")
+OSRM_URL = os.environ.get("OSRM_URL", "https://router.project-osrm.org/route/v1/driving")
+OSRM_TABLE_URL = os.environ.get("OSRM_TABLE_URL", "https://router.project-osrm.org/table/v1/driving")
+STATIC_MAP_URL = os.environ.get("STATIC_MAP_URL", "https://static-maps.yandex.ru/1.x/")
+
+# Concurrency limits. The proxy answers 503 once MAX_IN_FLIGHT requests are
+# being handled and 429 when a request waited UPSTREAM_QUEUE_TIMEOUT seconds
+# for a free slot of an upstream; both carry Retry-After.
+MAX_IN_FLIGHT = int(os.environ.get("MAX_IN_FLIGHT", 512))
+GEOCODER_CONCURRENCY = int(os.environ.get("GEOCODER_CONCURRENCY", 16))
+OSRM_CONCURRENCY = int(os.environ.get("OSRM_CONCURRENCY", 8))
+UPSTREAM_QUEUE_TIMEOUT = float(os.environ.get("UPSTREAM_QUEUE_TIMEOUT", 2.0))
+RETRY_AFTER_SECONDS = int(os.environ.get("RETRY_AFTER_SECONDS", 1))
+SHUTDOWN_TIMEOUT = float(os.environ.get("SHUTDOWN_TIMEOUT", 15))
+
+# /distances: pairs accepted per request and coordinates per OSRM table call
+# (the public OSRM server rejects tables above 100 coordinates).
+MAX_BATCH_PAIRS = int(os.environ.get("MAX_BATCH_PAIRS", 500))
+OSRM_TABLE_MAX_COORDS = int(os.environ.get("OSRM_TABLE_MAX_COORDS", 100))
+# /matrix: sources and destinations accepted per request, and attempts per
+# OSRM table block before its cells are left null.
+MAX_MATRIX_POINTS = int(os.environ.get("MAX_MATRIX_POINTS", 1000))
+MATRIX_BLOCK_ATTEMPTS = int(os.environ.get("MATRIX_BLOCK_ATTEMPTS", 3))
+# /directions: intermediate stops per route, as the backend allows
+# (services/maps.py; static map markers cap it at 98), and coordinates per
+# OSRM route call; longer routes are requested in overlapping pieces and stitched.
+MAX_ROUTE_STOPS = min(int(os.environ.get("MAX_ROUTE_STOPS", 50)), 98)
+OSRM_ROUTE_MAX_COORDS = max(int(os.environ.get("OSRM_ROUTE_MAX_COORDS", 100)), 2)
+
+GEOCODE_TIMEOUT = ClientTimeout(total=10)
+OSRM_TIMEOUT = ClientTimeout(total=12)
+
+
+class UpstreamBusy(Exception):
+    """Raised when an upstream has no free slot within UPSTREAM_QUEUE_TIMEOUT."""
+
+
+class Upstream:
+    def __init__(self, name: str, limit: int):
+        self.name = name
+        self.semaphore = asyncio.Semaphore(limit)
+
+    @asynccontextmanager
+    async def slot(self):
+        try:
+            await asyncio.wait_for(self.semaphore.acquire(), UPSTREAM_QUEUE_TIMEOUT)
+        except asyncio.TimeoutError:
+            raise UpstreamBusy(self.name) from None
+        try:
+            yield
+        finally:
+            self.semaphore.release()
+
+
+GEOCODER = Upstream("geocoder", GEOCODER_CONCURRENCY)
+OSRM = Upstream("osrm", OSRM_CONCURRENCY)
+
+
+class SingleFlight:
+    """Collapse concurrent calls with the same key into one in-flight call.
+
+    The first caller starts the work, later callers with the same key await
+    the same task and get its result or its exception. The key is forgotten
+    as soon as the task finishes, so nothing is cached beyond that.
+    """
+
+    def __init__(self):
+        self._calls: Dict[Hashable, asyncio.Task] = {}
+
+    async def do(self, key: Hashable, func: Callable[[], Awaitable]):
+        task = self._calls.get(key)
+        if task is None:
+            task = asyncio.ensure_future(func())
+            self._calls[key] = task
+            task.add_done_callback(lambda done: self._forget(key, done))
+        # shield: a caller that disconnects must not cancel the shared call
+        return await asyncio.shield(task)
+
+    def _forget(self, key: Hashable, task: asyncio.Task) -> None:
+        if self._calls.get(key) is task:
+            del self._calls[key]
+        if not task.cancelled():
+            # mark the exception as retrieved even if every waiter went away
+            task.exception()
+
+    def __len__(self) -> int:
+        return len(self._calls)
+
+
+def normalize_address(address: str) -> str:
+    return " ".join(address.split()).casefold()
+
+
+# Drivers starting a shift open navigation for the same trip at the same time:
+# identical geocodes and whole directions requests share one upstream call.
+GEOCODE_CALLS = SingleFlight()
+DIRECTIONS_CALLS = SingleFlight()
+
+
+async def geocode(session: ClientSession, address: str) -> Optional[Tuple[float, float]]:
+    return await GEOCODE_CALLS.do(
+        normalize_address(address), lambda: _geocode(session, address)
+    )
 
 
-def geocode(address: str) -> Optional[Tuple[float, float]]:
+async def _geocode(session: ClientSession, address: str) -> Optional[Tuple[float, float]]:
     params = {
         "apikey": GEOCODER_API_KEY,
         "format": "json",
@@ -37,21 +135,18 @@ def geocode(address: str) -> Optional[Tuple[float, float]]:
         "geocode": address,
     }
     try:
-        response = requests.get(GEOCODE_URL, params=params, timeout=10)
-        response.raise_for_status()
-    except requests.RequestException:
-        return None
-
-    try:
-        members = (
-            response.json()
-            .get("response", {})
-            .get("GeoObjectCollection", {})
-            .get("featureMember", [])
-        )
-    except ValueError:
+        async with GEOCODER.slot():
+            async with session.get(GEOCODE_URL, params=params, timeout=GEOCODE_TIMEOUT) as response:
+                response.raise_for_status()
+                data = await response.json(content_type=None)
+    except (ClientError, asyncio.TimeoutError, ValueError):
         return None
 
+    members = (
+        data.get("response", {})
+        .get("GeoObjectCollection", {})
+        .get("featureMember", [])
+    )
     if not members:
         return None
 
@@ -75,21 +170,18 @@ def build_route_request(points: List[Tuple[float, float]]) -> Dict:
     return {"coords": coords, "params": params}
 
 
-def fetch_osrm_route(points: List[Tuple[float, float]]) -> Optional[Dict]:
+async def fetch_osrm_route(session: ClientSession, points: List[Tuple[float, float]]) -> Optional[Dict]:
     payload = build_route_request(points)
     try:
-        response = requests.get(
-            f"{OSRM_URL}/{payload['coords']}",
-            params=payload["params"],
-            timeout=12,
-        )
-        response.raise_for_status()
-    except requests.RequestException:
-        return None
-
-    try:
-        data = response.json()
-    except ValueError:
+        async with OSRM.slot():
+            async with session.get(
+                f"{OSRM_URL}/{payload['coords']}",
+                params=payload["params"],
+                timeout=OSRM_TIMEOUT,
+            ) as response:
+                response.raise_for_status()
+                data = await response.json(content_type=None)
+    except (ClientError, asyncio.TimeoutError, ValueError):
         return None
 
     if not data.get("routes"):
@@ -99,10 +191,93 @@ def fetch_osrm_route(points: List[Tuple[float, float]]) -> Optional[Dict]:
     return {
         "distance": route.get("distance"),
         "duration": route.get("duration"),
+        "legs": [
+            {"distance": leg.get("distance"), "duration": leg.get("duration")}
+            for leg in route.get("legs") or []
+        ],
         "geometry": (route.get("geometry") or {}).get("coordinates", []),
     }
 
 
+async def fetch_route_chunked(
+    session: ClientSession, points: List[Tuple[float, float]], max_coords: int = OSRM_ROUTE_MAX_COORDS
+) -> Optional[Dict]:
+    """fetch_osrm_route() for any number of points.
+
+    The points are split into pieces of at most `max_coords` that share their
+    boundary point, the pieces are requested concurrently and joined back:
+    distances, durations and legs add up, geometries are concatenated without
+    the repeated join point.
+    """
+
+    step = max_coords - 1
+    pieces = [points[i:i + max_coords] for i in range(0, max(len(points) - 1, 1), step)]
+    results = await asyncio.gather(*(fetch_osrm_route(session, piece) for piece in pieces))
+    if not all(results):
+        return None
+    if len(results) == 1:
+        return results[0]
+
+    geometry: List = []
+    for result in results:
+        part = result["geometry"] or []
+        if geometry and part and list(part[0]) == list(geometry[-1]):
+            part = part[1:]
+        geometry.extend(part)
+    return {
+        "distance": sum(result["distance"] or 0 for result in results),
+        "duration": sum(result["duration"] or 0 for result in results),
+        "legs": [leg for result in results for leg in result["legs"]],
+        "geometry": geometry,
+    }
+
+
+async def fetch_osrm_table(
+    session: ClientSession,
+    coords: List[Tuple[float, float]],
+    sources: List[int],
+    destinations: List[int],
+) -> Optional[Dict]:
+    params = {
+        "sources": ";".join(map(str, sources)),
+        "destinations": ";".join(map(str, destinations)),
+        "annotations": "distance,duration",
+    }
+    path = ";".join(f"{lon},{lat}" for lon, lat in coords)
+    try:
+        async with OSRM.slot():
+            async with session.get(
+                f"{OSRM_TABLE_URL}/{path}", params=params, timeout=OSRM_TIMEOUT
+            ) as response:
+                response.raise_for_status()
+                data = await response.json(content_type=None)
+    except (ClientError, asyncio.TimeoutError, ValueError):
+        return None
+
+    if data.get("code") != "Ok":
+        return None
+    return {"distances": data.get("distances"), "durations": data.get("durations")}
+
+
+def chunk_pairs(
+    pairs: List[Tuple[Tuple[float, float], Tuple[float, float]]], max_coords: int
+) -> List[List[int]]:
+    """Split pair indexes so that each chunk needs at most `max_coords` distinct points."""
+
+    chunks, current, seen = [], [], set()
+    for index, (start, end) in enumerate(pairs):
+        added = {start, end} - seen
+        if current and len(seen) + len(added) > max_coords:
+            chunks.append(current)
+            current, seen = [], set()
+            added = {start, end}
+        current.append(index)
+        seen |= added
+    if current:
+        chunks.append(current)
+    return chunks
+
+
 def normalize_polyline(points: List[Dict]) -> List[Dict[str, float]]:
     normalized = []
     for p in points:
@@ -132,9 +307,9 @@ def build_map_url(points: List[Tuple[float, float]], poly_points: List[Dict]) ->
     if points:
         lon, lat = points[0]
         markers.append(f"{lon},{lat},pm2gnl")
-    if len(points) == 3:
-        lon, lat = points[1]
-        markers.append(f"{lon},{lat},pm2blm")
+    # stops are numbered in travel order
+    for number, (lon, lat) in enumerate(points[1:-1], start=1):
+        markers.append(f"{lon},{lat},pm2blm{number}")
     if len(points) >= 2:
         lon, lat = points[-1]
         markers.append(f"{lon},{lat},pm2rdm")
@@ -155,6 +330,90 @@ def build_map_url(points: List[Tuple[float, float]], poly_points: List[Dict]) ->
     return f"{STATIC_MAP_URL}?{urllib.parse.urlencode(params, safe=':,')}"
 
 
+# cost of a leg OSRM could not route, so that stop ordering avoids it
+UNREACHABLE = 1e9
+
+
+def order_stops(cost: List[List[Optional[float]]]) -> List[int]:
+    """Visiting order of intermediate stops that keeps the path short.
+
+    `cost` is the square matrix over [start, stop 0, ..., stop n-1, end];
+    start and end stay where they are. The path is built by nearest
+    neighbour from the start and improved by 2-opt (segment reversal) and
+    moving single stops until no move shortens it. Road costs are not
+    symmetric, so a reversed segment is costed in its new direction.
+    """
+
+    c = [[UNREACHABLE if value is None else value for value in row] for row in cost]
+    end = len(c) - 1
+    remaining = set(range(1, end))
+    path = [0]
+    while remaining:
+        last = path[-1]
+        nearest = min(remaining, key=lambda j: (c[last][j], j))
+        path.append(nearest)
+        remaining.remove(nearest)
+    path.append(end)
+
+    improved = True
+    while improved:
+        improved = False
+
+        forward, backward = [0.0], [0.0]
+        for a, b in zip(path, path[1:]):
+            forward.append(forward[-1] + c[a][b])
+            backward.append(backward[-1] + c[b][a])
+        for i in range(1, len(path) - 2):
+            for j in range(i + 1, len(path) - 1):
+                delta = (
+                    c[path[i - 1]][path[j]] + c[path[i]][path[j + 1]]
+                    - c[path[i - 1]][path[i]] - c[path[j]][path[j + 1]]
+                    + (backward[j] - backward[i]) - (forward[j] - forward[i])
+                )
+                if delta < -1e-9:
+                    path[i:j + 1] = path[i:j + 1][::-1]
+                    improved = True
+                    break
+            if improved:
+                break
+        if improved:
+            continue
+
+        for i in range(1, len(path) - 1):
+            stop, before, after = path[i], path[i - 1], path[i + 1]
+            saved = c[before][stop] + c[stop][after] - c[before][after]
+            rest = path[:i] + path[i + 1:]
+            for k in range(len(rest) - 1):
+                u, v = rest[k], rest[k + 1]
+                if c[u][stop] + c[stop][v] - c[u][v] < saved - 1e-9:
+                    path = rest[:k + 1] + [stop] + rest[k + 1:]
+                    improved = True
+                    break
+            if improved:
+                break
+
+    return [index - 1 for index in path[1:-1]]
+
+
+def encode_polyline(points: List[Dict[str, float]], precision: int = 5) -> str:
+    """Google encoded polyline of {"lon", "lat"} points (same as services/geo.py)."""
+
+    factor = 10 ** precision
+    output = []
+    prev_lat = prev_lon = 0
+    for point in points:
+        lat_i = int(round(point["lat"] * factor))
+        lon_i = int(round(point["lon"] * factor))
+        for delta in (lat_i - prev_lat, lon_i - prev_lon):
+            value = ~(delta << 1) if delta < 0 else delta << 1
+            while value >= 0x20:
+                output.append(chr((0x20 | (value & 0x1F)) + 63))
+                value >>= 5
+            output.append(chr(value + 63))
+        prev_lat, prev_lon = lat_i, lon_i
+    return "".join(output)
+
+
 def format_distance(distance_meters: Optional[float]) -> Optional[str]:
     if distance_meters is None:
         return None
@@ -171,59 +430,168 @@ def format_duration(seconds: Optional[float]) -> Optional[str]:
     return f"{mins} мин"
 
 
-@app.route("/health", methods=["GET"])
-def health() -> tuple:
-    return jsonify({"status": "ok"}), 200
+def _busy_response(status: int, message: str) -> web.Response:
+    return web.json_response(
+        {"message": message},
+        status=status,
+        headers={"Retry-After": str(RETRY_AFTER_SECONDS)},
+    )
+
 
+@web.middleware
+async def cors(request: web.Request, handler) -> web.StreamResponse:
+    # The navigation page calls /directions straight from the browser.
+    if request.method == "OPTIONS":
+        response = web.Response(status=204)
+        response.headers["Access-Control-Allow-Methods"] = "GET, POST, OPTIONS"
+        response.headers["Access-Control-Allow-Headers"] = request.headers.get(
+            "Access-Control-Request-Headers", "Content-Type"
+        )
+    else:
+        try:
+            response = await handler(request)
+        except web.HTTPException as exc:
+            exc.headers["Access-Control-Allow-Origin"] = "*"
+            raise
+    response.headers["Access-Control-Allow-Origin"] = "*"
+    return response
+
+
+@web.middleware
+async def limit_in_flight(request: web.Request, handler) -> web.StreamResponse:
+    if request.path == "/health":
+        return await handler(request)
+
+    state = request.app["state"]
+    if state["draining"]:
+        return _busy_response(503, "Сервис карт перезапускается, повторите запрос.")
+    if state["in_flight"] >= MAX_IN_FLIGHT:
+        return _busy_response(503, "Сервис карт перегружен, повторите запрос позже.")
+
+    state["in_flight"] += 1
+    try:
+        return await handler(request)
+    except UpstreamBusy as exc:
+        return _busy_response(429, f"Превышен лимит запросов к внешнему сервису ({exc}).")
+    finally:
+        state["in_flight"] -= 1
+
+
+async def health(request: web.Request) -> web.Response:
+    state = request.app["state"]
+    return web.json_response(
+        {
+            "status": "draining" if state["draining"] else "ok",
+            "in_flight": state["in_flight"],
+            "coalescing": {"geocode": len(GEOCODE_CALLS), "directions": len(DIRECTIONS_CALLS)},
+        },
+        status=503 if state["draining"] else 200,
+    )
 
-@app.route("/directions", methods=["POST"])
-def directions() -> tuple:
+
+async def geocode_handler(request: web.Request) -> web.Response:
     if not GEOCODER_API_KEY:
-        return (
-            jsonify(
-                {
-                    "message": "YANDEX_GEOCODER_API_KEY не задан. Установите ключ в переменной окружения и перезапустите сервис.",
-                }
-            ),
-            503,
+        return web.json_response(
+            {
+                "message": "YANDEX_GEOCODER_API_KEY не задан. Установите ключ в переменной окружения и перезапустите сервис.",
+            },
+            status=503,
         )
 
-    payload = request.get_json() or {}
+    try:
+        payload = await request.json()
+    except ValueError:
+        payload = None
+    payload = payload if isinstance(payload, dict) else {}
+
+    address = (payload.get("address") or "").strip()
+    if not address:
+        return web.json_response({"message": "Необходимо указать адрес."}, status=400)
+
+    coords = await geocode(request.app["client"], address)
+    if not coords:
+        return web.json_response({"message": "Не удалось определить координаты по адресу."}, status=404)
+
+    lon, lat = coords
+    return web.json_response({"address": address, "lon": lon, "lat": lat})
+
+
+async def directions(request: web.Request) -> web.Response:
+    if not GEOCODER_API_KEY:
+        return web.json_response(
+            {
+                "message": "YANDEX_GEOCODER_API_KEY не задан. Установите ключ в переменной окружения и перезапустите сервис.",
+            },
+            status=503,
+        )
+
+    try:
+        payload = await request.json()
+    except ValueError:
+        payload = None
+    payload = payload if isinstance(payload, dict) else {}
+
     origin = (payload.get("start") or "").strip()
     destination = (payload.get("end") or "").strip()
-    waypoint = (payload.get("waypoint") or "").strip()
+    # `waypoint` is the older single-stop form of `stops`
+    raw_stops = payload.get("stops")
+    if raw_stops is None:
+        raw_stops = [payload.get("waypoint")]
 
     if not origin or not destination:
-        return (
-            jsonify({"message": "Необходимо указать точку старта и пункт назначения."}),
-            400,
+        return web.json_response(
+            {"message": "Необходимо указать точку старта и пункт назначения."},
+            status=400,
         )
+    if not isinstance(raw_stops, list) or not all(stop is None or isinstance(stop, str) for stop in raw_stops):
+        return web.json_response({"message": "stops должен быть списком адресов."}, status=400)
+    stops = [stop.strip() for stop in raw_stops if stop and stop.strip()]
+    if len(stops) > MAX_ROUTE_STOPS:
+        return web.json_response(
+            {"message": f"Не больше {MAX_ROUTE_STOPS} промежуточных остановок."}, status=400
+        )
+    optimize = bool(payload.get("optimize")) and len(stops) > 1
 
-    origin_coords = geocode(origin)
-    destination_coords = geocode(destination)
-    waypoint_coords = geocode(waypoint) if waypoint else None
+    key = (
+        normalize_address(origin),
+        normalize_address(destination),
+        tuple(normalize_address(stop) for stop in stops),
+        optimize,
+    )
+    status, body = await DIRECTIONS_CALLS.do(
+        key, lambda: _build_directions(request.app["client"], origin, destination, stops, optimize)
+    )
+    if status == 200:
+        body = dict(body, start_address=origin, end_address=destination)
+    return web.json_response(body, status=status)
 
-    if not origin_coords or not destination_coords:
-        return (
-            jsonify({"message": "Не удалось определить координаты старта или финиша по адресу."}),
-            400,
-        )
 
-    points = [origin_coords]
-    if waypoint_coords:
-        points.append(waypoint_coords)
-    points.append(destination_coords)
+async def _build_directions(
+    session: ClientSession, origin: str, destination: str, stops: List[str], optimize: bool
+) -> Tuple[int, Dict]:
+    coords = await asyncio.gather(
+        *(geocode(session, address) for address in [origin, *stops, destination])
+    )
+
+    if not coords[0] or not coords[-1]:
+        return 400, {"message": "Не удалось определить координаты старта или финиша по адресу."}
+    for address, point in zip(stops, coords[1:-1]):
+        if not point:
+            return 400, {"message": f"Не удалось определить координаты остановки: {address}."}
 
-    route_data = fetch_osrm_route(points)
+    order = list(range(len(stops)))
+    optimized = False
+    if optimize:
+        distance_matrix, _ = await fetch_matrix(session, coords, coords)
+        if any(value is not None for i, row in enumerate(distance_matrix) for j, value in enumerate(row) if i != j):
+            order = order_stops(distance_matrix)
+            optimized = True
+
+    points = [coords[0], *(coords[1 + index] for index in order), coords[-1]]
+
+    route_data = await fetch_route_chunked(session, points)
     if not route_data:
-        return (
-            jsonify(
-                {
-                    "message": "Маршрут не найден или сервис построения временно недоступен.",
-                }
-            ),
-            404,
-        )
+        return 404, {"message": "Маршрут не найден или сервис построения временно недоступен."}
 
     distance_value = route_data.get("distance")
     duration_value = route_data.get("duration")
@@ -231,22 +599,214 @@ def directions() -> tuple:
 
     map_url = build_map_url(points, geometry_points)
 
-    return (
-        jsonify(
-            {
-                "distance_text": format_distance(distance_value),
+    return 200, {
+        "distance_text": format_distance(distance_value),
+        "distance_value": distance_value,
+        "duration_text": format_duration(duration_value),
+        "duration_value": duration_value,
+        "map_url": map_url,
+        "points": [[lon, lat] for lon, lat in points],
+        "stops": [stops[index] for index in order],
+        "stop_order": order,
+        "optimized": optimized,
+        "legs": route_data.get("legs") or [],
+        "geometry": encode_polyline(normalize_polyline(geometry_points)),
+    }
+
+
+async def distances(request: web.Request) -> web.Response:
+    """Driving distance and duration for many start/end address pairs at once.
+
+    Addresses are geocoded once each, pairs are answered from OSRM table
+    calls. `results[i]` matches `pairs[i]` and is null when unresolved.
+    """
+
+    try:
+        payload = await request.json()
+    except ValueError:
+        payload = None
+    pairs = payload.get("pairs") if isinstance(payload, dict) else None
+    if not isinstance(pairs, list) or not pairs:
+        return web.json_response({"message": "Передайте непустой список pairs."}, status=400)
+    if len(pairs) > MAX_BATCH_PAIRS:
+        return web.json_response(
+            {"message": f"Не больше {MAX_BATCH_PAIRS} пар за запрос."}, status=400
+        )
+
+    cleaned = []
+    for pair in pairs:
+        pair = pair if isinstance(pair, dict) else {}
+        cleaned.append(((pair.get("start") or "").strip(), (pair.get("end") or "").strip()))
+
+    session = request.app["client"]
+    addresses = sorted({address for pair in cleaned for address in pair if address})
+    coords = dict(zip(addresses, await asyncio.gather(*(geocode(session, a) for a in addresses))))
+
+    results: List[Optional[Dict]] = [None] * len(cleaned)
+    resolvable = [
+        (index, coords[start], coords[end])
+        for index, (start, end) in enumerate(cleaned)
+        if coords.get(start) and coords.get(end)
+    ]
+
+    async def run_chunk(chunk: List[int]) -> None:
+        points: List[Tuple[float, float]] = []
+        position: Dict[Tuple[float, float], int] = {}
+        for i in chunk:
+            for point in resolvable[i][1:]:
+                if point not in position:
+                    position[point] = len(points)
+                    points.append(point)
+        sources = sorted({position[resolvable[i][1]] for i in chunk})
+        destinations = sorted({position[resolvable[i][2]] for i in chunk})
+        table = await fetch_osrm_table(session, points, sources, destinations)
+        if not table or not table["distances"]:
+            return
+
+        durations = table["durations"]
+        for i in chunk:
+            index, start, end = resolvable[i]
+            row = sources.index(position[start])
+            col = destinations.index(position[end])
+            distance_value = table["distances"][row][col]
+            if distance_value is None:
+                continue
+            results[index] = {
                 "distance_value": distance_value,
-                "duration_text": format_duration(duration_value),
-                "duration_value": duration_value,
-                "map_url": map_url,
-                "start_address": origin,
-                "end_address": destination,
+                "duration_value": durations[row][col] if durations else None,
+                "start_point": list(start),
+                "end_point": list(end),
             }
-        ),
-        200,
+
+    chunks = chunk_pairs([(start, end) for _, start, end in resolvable], OSRM_TABLE_MAX_COORDS)
+    await asyncio.gather(*(run_chunk(chunk) for chunk in chunks))
+    return web.json_response({"results": results})
+
+
+def _parse_points(value) -> Optional[List[Tuple[float, float]]]:
+    if not isinstance(value, list) or not value or len(value) > MAX_MATRIX_POINTS:
+        return None
+    points = []
+    for point in value:
+        try:
+            lon, lat = float(point[0]), float(point[1])
+        except (TypeError, ValueError, IndexError):
+            return None
+        if not (-180.0 <= lon <= 180.0 and -90.0 <= lat <= 90.0):
+            return None
+        points.append((lon, lat))
+    return points
+
+
+async def fetch_matrix(
+    session: ClientSession,
+    sources: List[Tuple[float, float]],
+    destinations: List[Tuple[float, float]],
+) -> Tuple[List[List[Optional[float]]], List[List[Optional[float]]]]:
+    """(distances, durations) between points, None where OSRM had no answer.
+
+    Split into OSRM table calls of at most OSRM_TABLE_MAX_COORDS coordinates
+    (half sources, half destinations). At most OSRM_CONCURRENCY of them run
+    at once, so a large matrix queues behind its own blocks instead of timing
+    out on the OSRM slots; a block that still finds OSRM busy or failing is
+    retried and, after MATRIX_BLOCK_ATTEMPTS, left null for the caller to
+    estimate.
+    """
+
+    distances_out: List[List[Optional[float]]] = [[None] * len(destinations) for _ in sources]
+    durations_out: List[List[Optional[float]]] = [[None] * len(destinations) for _ in sources]
+    block = max(OSRM_TABLE_MAX_COORDS // 2, 1)
+    in_flight = asyncio.Semaphore(OSRM_CONCURRENCY)
+
+    async def fetch_block(coords, block_sources, block_destinations) -> Optional[Dict]:
+        for attempt in range(MATRIX_BLOCK_ATTEMPTS):
+            if attempt:
+                await asyncio.sleep(RETRY_AFTER_SECONDS * attempt)
+            try:
+                table = await fetch_osrm_table(session, coords, block_sources, block_destinations)
+            except UpstreamBusy:
+                continue
+            if table and table["distances"]:
+                return table
+        return None
+
+    async def run_block(row: int, col: int) -> None:
+        block_sources = sources[row:row + block]
+        block_destinations = destinations[col:col + block]
+        async with in_flight:
+            table = await fetch_block(
+                block_sources + block_destinations,
+                list(range(len(block_sources))),
+                list(range(len(block_sources), len(block_sources) + len(block_destinations))),
+            )
+        if table is None:
+            return
+        for i, values in enumerate(table["distances"]):
+            distances_out[row + i][col:col + len(values)] = values
+        for i, values in enumerate(table["durations"] or []):
+            durations_out[row + i][col:col + len(values)] = values
+
+    await asyncio.gather(*(
+        run_block(row, col)
+        for row in range(0, len(sources), block)
+        for col in range(0, len(destinations), block)
+    ))
+    return distances_out, durations_out
+
+
+async def matrix(request: web.Request) -> web.Response:
+    """Driving distance/duration matrix between [lon, lat] sources and destinations.
+
+    Cells that OSRM could not answer are null.
+    """
+
+    try:
+        payload = await request.json()
+    except ValueError:
+        payload = None
+    payload = payload if isinstance(payload, dict) else {}
+    sources = _parse_points(payload.get("sources"))
+    destinations = _parse_points(payload.get("destinations"))
+    if sources is None or destinations is None:
+        return web.json_response(
+            {"message": f"Передайте sources и destinations: от 1 до {MAX_MATRIX_POINTS} точек [lon, lat]."},
+            status=400,
+        )
+
+    distances_out, durations_out = await fetch_matrix(request.app["client"], sources, destinations)
+    return web.json_response({"distances": distances_out, "durations": durations_out})
+
+
+async def _start_client(app: web.Application) -> None:
+    app["client"] = ClientSession(
+        connector=TCPConnector(limit=GEOCODER_CONCURRENCY + OSRM_CONCURRENCY, ttl_dns_cache=300),
     )
 
 
+async def _start_draining(app: web.Application) -> None:
+    # Runs on SIGTERM before in-flight handlers are awaited: new requests get
+    # 503 + Retry-After while the ones already running are allowed to finish.
+    app["state"]["draining"] = True
+
+
+async def _close_client(app: web.Application) -> None:
+    await app["client"].close()
+
+
+def create_app() -> web.Application:
+    app = web.Application(middlewares=[cors, limit_in_flight])
+    app["state"] = {"in_flight": 0, "draining": False}
+    app.router.add_get("/health", health)
+    app.router.add_post("/geocode", geocode_handler)
+    app.router.add_post("/directions", directions)
+    app.router.add_post("/distances", distances)
+    app.router.add_post("/matrix", matrix)
+    app.on_startup.append(_start_client)
+    app.on_shutdown.append(_start_draining)
+    app.on_cleanup.append(_close_client)
+    return app
+
+
 if __name__ == "__main__":
     port = int(os.environ.get("PORT", 8081))
-    app.run(host="0.0.0.0", port=port)
+    web.run_app(create_app(), host="0.0.0.0", port=port, shutdown_timeout=SHUTDOWN_TIMEOUT)
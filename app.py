@@ -1,41 +1,113 @@
 import os
-from flask import Flask, redirect, send_from_directory
+import time
+from flask import Flask, redirect
 from flask_sqlalchemy import SQLAlchemy
 from flask_migrate import Migrate
 from flask_jwt_extended import JWTManager
 from datetime import timedelta
 
+from services.database import RoutingSession
 
-db = SQLAlchemy()
+
+db = SQLAlchemy(session_options={'class_': RoutingSession})
 jwt = JWTManager()
 
 
 def create_app():
+    started = time.monotonic()
     app = Flask(__name__, static_folder='static', static_url_path='/static')
     app.config['SQLALCHEMY_DATABASE_URI'] = os.getenv(
         'DATABASE_URL', 'postgresql://postgres:postgres@db:5432/fleettracker'
     )
     app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    app.config['DB_POOL_SIZE'] = int(os.getenv('DB_POOL_SIZE', 5))
+    app.config['DB_MAX_OVERFLOW'] = int(os.getenv('DB_MAX_OVERFLOW', 10))
+    app.config['DB_POOL_TIMEOUT'] = float(os.getenv('DB_POOL_TIMEOUT', 30))
+    app.config['DB_POOL_RECYCLE'] = int(os.getenv('DB_POOL_RECYCLE', 1800))
+    app.config['DB_POOL_PRE_PING'] = os.getenv('DB_POOL_PRE_PING', '1') == '1'
+    app.config['DB_STATEMENT_TIMEOUT_MS'] = int(os.getenv('DB_STATEMENT_TIMEOUT_MS', 0))
+    app.config['DB_PGBOUNCER'] = os.getenv('DB_PGBOUNCER', '0') == '1'
+    app.config['DATABASE_DIRECT_URL'] = os.getenv('DATABASE_DIRECT_URL')
+    app.config['DATABASE_REPLICA_URLS'] = [
+        url.strip() for url in os.getenv('DATABASE_REPLICA_URLS', '').split(',') if url.strip()
+    ]
+    app.config['DB_REPLICA_MAX_LAG'] = float(os.getenv('DB_REPLICA_MAX_LAG', 5))
+    app.config['DB_REPLICA_CHECK_INTERVAL'] = float(os.getenv('DB_REPLICA_CHECK_INTERVAL', 5))
     app.config['SECRET_KEY'] = os.getenv('SECRET_KEY', 'dev-secret-key')
     app.config['JWT_SECRET_KEY'] = os.getenv('JWT_SECRET_KEY', 'jwt-dev-secret')
     app.config['JWT_ACCESS_TOKEN_EXPIRES'] = timedelta(minutes=15)
+    app.config['TELEMETRY_INGEST_TOKEN'] = os.getenv('TELEMETRY_INGEST_TOKEN')
+    app.config['TELEMETRY_MAX_FIXES_PER_REQUEST'] = int(
+        os.getenv('TELEMETRY_MAX_FIXES_PER_REQUEST', 50000)
+    )
+    # route dates are the fleet's local calendar days; fixes arrive in UTC
+    app.config['FLEET_TIMEZONE'] = os.getenv('FLEET_TIMEZONE', 'Europe/Moscow')
+    app.config['TELEMETRY_MAX_BODY_BYTES'] = int(
+        os.getenv('TELEMETRY_MAX_BODY_BYTES', 16 * 1024 * 1024)
+    )
+    app.config['LIVE_FLUSH_INTERVAL'] = float(os.getenv('LIVE_FLUSH_INTERVAL', 1.0))
+    app.config['LIVE_HEARTBEAT_SECONDS'] = float(os.getenv('LIVE_HEARTBEAT_SECONDS', 15))
+    app.config['LIVE_STREAM_MAX_SECONDS'] = float(os.getenv('LIVE_STREAM_MAX_SECONDS', 300))
+    app.config['LIVE_TICKET_SECONDS'] = int(os.getenv('LIVE_TICKET_SECONDS', 30))
+
+    from services.database import engine_options, init_database
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options(app.config)
 
     db.init_app(app)
+    init_database(app)
     Migrate(app, db)
     jwt.init_app(app)
 
-    from models import Vehicle, Driver, User, Route, Maintenance  # noqa: F401
+    from assets import init_assets, serve_page
+    init_assets(app)
+
+    from services.jobs import init_jobs
+    init_jobs(app)
+
+    from models import (  # noqa: F401
+        Vehicle, Driver, User, Route, Maintenance, Job, AppState,
+        TelemetryFix, TelemetryRollup, VehiclePosition, VehicleDailyDistance, Trip, TripState,
+        Geofence, GeofenceEvent, VehicleGeofenceState, DistanceCache, TravelTimeStat, FuelAnomaly,
+    )
     from routes.auth import auth_bp
     from routes.admin import admin_bp
     from routes.driver import driver_bp
+    from routes.telemetry import telemetry_bp
+    from routes.live import live_bp
 
     app.register_blueprint(auth_bp, url_prefix="/auth")
     app.register_blueprint(admin_bp, url_prefix="/admin")
     app.register_blueprint(driver_bp, url_prefix="/driver/api")
+    app.register_blueprint(telemetry_bp, url_prefix="/telemetry")
+    app.register_blueprint(live_bp, url_prefix="/live")
+
+    from services.backfill import init_backfill
+    init_backfill(app)
+
+    from services.partitions import init_partitions
+    init_partitions(app)
+
+    from services.mileage import init_mileage
+    init_mileage(app)
+
+    from services.trips import init_trips
+    init_trips(app)
+
+    from services.eta import init_eta
+    init_eta(app)
+
+    from services.fuel import init_fuel
+    init_fuel(app)
+
+    from services.synthetic import init_synthetic
+    init_synthetic(app)
+
+    from services.startup import init_startup
+    init_startup(app)
 
     @app.route('/')
     def index():
-        return send_from_directory(app.static_folder, 'index.html')
+        return serve_page('index.html')
 
     @app.route('/index.html')
     def index_html():
@@ -43,28 +115,29 @@ def create_app():
 
     @app.route('/admin')
     def admin_dashboard():
-        return send_from_directory(app.static_folder, 'admin.html')
+        return serve_page('admin.html')
 
     @app.route('/manager')
     def manager_dashboard():
-        return send_from_directory(app.static_folder, 'manager.html')
+        return serve_page('manager.html')
 
     @app.route('/driver')
     def driver_dashboard():
-        return send_from_directory(app.static_folder, 'driver.html')
+        return serve_page('driver.html')
 
     @app.route('/driver/vehicle')
     def driver_vehicle():
-        return send_from_directory(app.static_folder, 'driver-vehicle.html')
+        return serve_page('driver-vehicle.html')
 
     @app.route('/driver/maintenance')
     def driver_maintenance():
-        return send_from_directory(app.static_folder, 'driver-maintenance.html')
+        return serve_page('driver-maintenance.html')
 
     @app.route('/driver/navigation')
     def driver_navigation():
-        return send_from_directory(app.static_folder, 'driver-navigation.html')
+        return serve_page('driver-navigation.html')
 
+    app.extensions['startup_timings'] = {'create_app': time.monotonic() - started}
     return app
 
 
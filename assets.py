@@ -0,0 +1,224 @@
+"""Build-time pipeline and serving helpers for the dashboard static files.
+
+`flask assets build` copies everything from `static/` into `static/dist/`:
+stylesheets and other assets get content-hashed file names, HTML pages are
+rewritten to reference those names, and every text file gets precompressed
+`.gz` (and `.br` when the `brotli` package is installed) siblings.  The
+resulting `manifest.json` is what the page routes in `app.py` read; it also
+records a digest of the sources, so startup can skip an up-to-date build.
+"""
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import re
+import shutil
+
+import click
+from flask import abort, current_app, request, send_from_directory
+from flask.cli import AppGroup
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover - brotli is optional, .gz is always built
+    brotli = None
+
+
+MANIFEST_NAME = 'manifest.json'
+DIST_DIR_NAME = 'dist'
+
+# Fingerprinted files never change under the same name.
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+# HTML keeps its public URL, so browsers revalidate it by ETag after a minute.
+HTML_MAX_AGE = 60
+
+COMPRESSIBLE_EXTENSIONS = {'.html', '.css', '.js', '.svg', '.json', '.txt'}
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+
+STATIC_REF_RE = re.compile(r'/static/([\w.\-/]+)')
+
+assets_cli = AppGroup('assets', help='Сборка статических ресурсов.')
+
+
+def _digest(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()[:12]
+
+
+def _write_variants(path: str, data: bytes):
+    with open(path, 'wb') as fh:
+        fh.write(data)
+
+    if os.path.splitext(path)[1] not in COMPRESSIBLE_EXTENSIONS:
+        return
+
+    # mtime=0 keeps the .gz output byte-identical between builds
+    gz_data = gzip.compress(data, compresslevel=9, mtime=0)
+    if len(gz_data) < len(data):
+        with open(path + '.gz', 'wb') as fh:
+            fh.write(gz_data)
+
+    if brotli is not None:
+        br_data = brotli.compress(data, quality=11)
+        if len(br_data) < len(data):
+            with open(path + '.br', 'wb') as fh:
+                fh.write(br_data)
+
+
+def _sources(static_dir: str, out_dir: str) -> list:
+    sources = []
+    for root, dirs, files in os.walk(static_dir):
+        dirs[:] = sorted(d for d in dirs if os.path.join(root, d) != out_dir)
+        for name in sorted(files):
+            full_path = os.path.join(root, name)
+            sources.append((os.path.relpath(full_path, static_dir).replace(os.sep, '/'), full_path))
+    return sources
+
+
+def source_digest(static_dir: str, out_dir: str) -> str:
+    """Digest of the files a build would read (and of whether .br is built)."""
+
+    digest = hashlib.sha256(b'br' if brotli is not None else b'gz')
+    for rel_path, full_path in _sources(static_dir, out_dir):
+        digest.update(rel_path.encode('utf-8') + b'\0')
+        with open(full_path, 'rb') as fh:
+            digest.update(hashlib.sha256(fh.read()).digest())
+    return digest.hexdigest()
+
+
+def is_built(static_dir: str, out_dir: str) -> bool:
+    """Whether `out_dir` holds a build of the current `static_dir`."""
+
+    manifest = _load_manifest(out_dir)
+    return bool(manifest) and manifest.get('source_digest') == source_digest(static_dir, out_dir)
+
+
+def build(static_dir: str, out_dir: str) -> dict:
+    """Fingerprint and precompress `static_dir` into `out_dir`, return the manifest."""
+
+    if os.path.isdir(out_dir):
+        shutil.rmtree(out_dir)
+    os.makedirs(out_dir)
+
+    manifest = {'assets': {}, 'pages': {}, 'source_digest': source_digest(static_dir, out_dir)}
+    sources = _sources(static_dir, out_dir)
+
+    pages = []
+    for rel_path, full_path in sources:
+        if rel_path.endswith('.html'):
+            pages.append((rel_path, full_path))
+            continue
+
+        with open(full_path, 'rb') as fh:
+            data = fh.read()
+        stem, ext = os.path.splitext(rel_path)
+        hashed = f'{stem}.{_digest(data)}{ext}'
+        target = os.path.join(out_dir, hashed)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        _write_variants(target, data)
+        manifest['assets'][rel_path] = hashed
+
+    def _rewrite(match):
+        hashed = manifest['assets'].get(match.group(1))
+        return f'/assets/{hashed}' if hashed else match.group(0)
+
+    for rel_path, full_path in pages:
+        with open(full_path, 'r', encoding='utf-8') as fh:
+            html = fh.read()
+        data = STATIC_REF_RE.sub(_rewrite, html).encode('utf-8')
+        target = os.path.join(out_dir, rel_path)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        _write_variants(target, data)
+        manifest['pages'][rel_path] = {'file': rel_path, 'etag': _digest(data)}
+
+    with open(os.path.join(out_dir, MANIFEST_NAME), 'w', encoding='utf-8') as fh:
+        json.dump(manifest, fh, ensure_ascii=False, indent=2, sort_keys=True)
+
+    return manifest
+
+
+def _load_manifest(dist_dir: str):
+    try:
+        with open(os.path.join(dist_dir, MANIFEST_NAME), encoding='utf-8') as fh:
+            return json.load(fh)
+    except (OSError, ValueError):
+        return None
+
+
+def _send_negotiated(directory: str, filename: str, etag: str, max_age: int):
+    """Send the best precompressed variant of `filename` the client accepts."""
+
+    served, encoding = filename, None
+    for candidate, suffix in ENCODINGS:
+        if request.accept_encodings[candidate] and os.path.isfile(
+            os.path.join(directory, filename + suffix)
+        ):
+            served, encoding = filename + suffix, candidate
+            break
+
+    response = send_from_directory(
+        directory,
+        served,
+        mimetype=mimetypes.guess_type(filename)[0] or 'application/octet-stream',
+        etag=f'{etag}-{encoding}' if encoding else etag,
+        max_age=max_age,
+        conditional=True,
+    )
+    # the stored file name (e.g. `admin.html.br`) is an implementation detail
+    response.headers.pop('Content-Disposition', None)
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    response.vary.add('Accept-Encoding')
+    return response
+
+
+def serve_page(name: str):
+    """Serve an HTML page from the build output, falling back to `static/`."""
+
+    manifest = current_app.extensions.get('assets_manifest')
+    page = manifest['pages'].get(name) if manifest else None
+    if not page:
+        return send_from_directory(current_app.static_folder, name)
+
+    response = _send_negotiated(
+        current_app.config['ASSETS_DIST_DIR'], page['file'], page['etag'], HTML_MAX_AGE
+    )
+    response.cache_control.must_revalidate = True
+    return response
+
+
+def serve_asset(filename: str):
+    """Serve a fingerprinted file; anything else in the build (pages, the
+    manifest) keeps its name across builds and must not be cached for a year."""
+
+    manifest = current_app.extensions.get('assets_manifest')
+    if not manifest or filename not in manifest['assets'].values():
+        abort(404)
+
+    dist_dir = current_app.config['ASSETS_DIST_DIR']
+    # the content hash is part of the name, so it doubles as the ETag
+    etag = os.path.splitext(os.path.splitext(filename)[0])[1].lstrip('.')
+    response = _send_negotiated(dist_dir, filename, etag, IMMUTABLE_MAX_AGE)
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    return response
+
+
+@assets_cli.command('build')
+def build_command():
+    """Собрать static/dist и manifest.json."""
+
+    manifest = build(current_app.static_folder, current_app.config['ASSETS_DIST_DIR'])
+    current_app.extensions['assets_manifest'] = manifest
+    click.echo(
+        f"Собрано ресурсов: {len(manifest['assets'])}, страниц: {len(manifest['pages'])}."
+    )
+
+
+def init_assets(app):
+    app.config.setdefault(
+        'ASSETS_DIST_DIR', os.path.join(app.static_folder, DIST_DIR_NAME)
+    )
+    app.extensions['assets_manifest'] = _load_manifest(app.config['ASSETS_DIST_DIR'])
+    app.add_url_rule('/assets/<path:filename>', 'assets', serve_asset)
+    app.cli.add_command(assets_cli)
@@ -0,0 +1,475 @@
+"""End-to-end load test of the backend and the maps proxy.
+
+Replays a weighted mix of driver and manager traffic (login, today's route,
+navigation, the driver page's direct `/directions` call, admin searches,
+telemetry bulk imports, route optimization) from `--clients` concurrent
+virtual users for `--duration` seconds and reports throughput and
+p50/p95/p99 per scenario. Requests of the first `--warmup` seconds are not
+counted.
+
+Drivers are the accounts made by `flask synthetic generate`
+(`<prefix>-driver-NNNNNN`, password `driver`); managers and admins come from
+db_seed.sql. The run writes routes and telemetry, so point it at a
+benchmark database, never at production.
+
+With `--spawn` the harness starts everything itself against the database in
+DATABASE_URL: the upstream stand-ins (bench/upstreams.py, with injected
+latency and errors), the maps proxy, gunicorn with the backend and a job
+worker. Without it, it targets `--base-url` and `--proxy-url` as they are.
+
+    flask synthetic generate --vehicles 2000 --routes 1000000 --maintenance 500000
+    python bench/load.py --spawn
+    python bench/load.py --spawn --save-baseline   # after an accepted change
+
+The run fails (exit status 1) when a scenario's p50, p95 or error rate, or
+the total throughput, is worse than in `--baseline` by more than
+`--tolerance`. Latencies are only compared for scenarios with enough samples
+in both runs; the baseline is only meaningful on the machine and dataset it
+was recorded with (`settings` in the file).
+"""
+import argparse
+from datetime import date, datetime, timezone
+import json
+import os
+import random
+import subprocess
+import sys
+import threading
+import time
+
+import requests
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import upstreams  # noqa: E402
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baseline.json')
+
+# scenario -> relative weight in the traffic mix
+DEFAULT_MIX = {
+    'login': 3,
+    'driver_today': 30,
+    'driver_navigation': 15,
+    'driver_vehicle': 8,
+    'driver_maintenance': 4,
+    'maps_directions': 10,
+    'driver_create_route': 2,
+    'admin_routes_search': 8,
+    'admin_users_search': 4,
+    'admin_vehicles_search': 4,
+    'admin_service_due': 3,
+    'telemetry_import': 6,
+    'routes_optimize': 2,
+}
+SEARCH_TERMS = ('Ленина', 'Мира', 'Садовая', 'Петров', 'Transit', 'Sprinter', 'SYN00', 'Москва')
+ADDRESSES = tuple(
+    f'Москва, {street}, {house}'
+    for street in ('ул. Ленина', 'ул. Мира', 'ул. Садовая', 'пр. Победы', 'ул. Заводская', 'Складской пр.')
+    for house in range(1, 40)
+)
+TELEMETRY_VEHICLES = 50
+TELEMETRY_FIXES = 20
+OPTIMIZE_REQUESTS = 20
+OPTIMIZE_DRIVERS = 10
+# absolute latency slack on top of the relative tolerance, so sub-10 ms
+# endpoints do not fail on scheduler noise
+LATENCY_SLACK = 0.005
+ERROR_RATE_SLACK = 0.01
+# samples a scenario needs in both runs before its median, and its p95
+# (which is mostly the maximum of a small sample), are compared
+MIN_SAMPLES_P50 = 30
+MIN_SAMPLES_P95 = 100
+
+
+class Context:
+    """Shared, read-only state of a run: URLs, tokens and ids to pick from."""
+
+    def __init__(self, base_url, proxy_url, credentials, driver_tokens, manager_token, admin_token,
+                 driver_ids, vehicle_ids):
+        self.base_url = base_url
+        self.proxy_url = proxy_url
+        self.credentials = credentials
+        self.driver_tokens = driver_tokens
+        self.manager_token = manager_token
+        self.admin_token = admin_token
+        self.driver_ids = driver_ids
+        self.vehicle_ids = vehicle_ids
+
+
+def _auth(token):
+    return {'Authorization': f'Bearer {token}'}
+
+
+def login(session, base_url, username, password):
+    return session.post(f'{base_url}/auth/login', json={'username': username, 'password': password}, timeout=30)
+
+
+def scenario_login(ctx, session, rng):
+    return login(session, ctx.base_url, *rng.choice(ctx.credentials))
+
+
+def scenario_driver_today(ctx, session, rng):
+    return session.get(f'{ctx.base_url}/driver/api/today', headers=_auth(rng.choice(ctx.driver_tokens)), timeout=30)
+
+
+def scenario_driver_navigation(ctx, session, rng):
+    return session.get(
+        f'{ctx.base_url}/driver/api/navigation', headers=_auth(rng.choice(ctx.driver_tokens)), timeout=30
+    )
+
+
+def scenario_driver_vehicle(ctx, session, rng):
+    return session.get(f'{ctx.base_url}/driver/api/vehicle', headers=_auth(rng.choice(ctx.driver_tokens)), timeout=30)
+
+
+def scenario_driver_maintenance(ctx, session, rng):
+    return session.get(
+        f'{ctx.base_url}/driver/api/maintenance', headers=_auth(rng.choice(ctx.driver_tokens)), timeout=30
+    )
+
+
+def scenario_maps_directions(ctx, session, rng):
+    start, end = rng.sample(ADDRESSES, 2)
+    return session.post(f'{ctx.proxy_url}/directions', json={'start': start, 'end': end}, timeout=30)
+
+
+def scenario_driver_create_route(ctx, session, rng):
+    start, end = rng.sample(ADDRESSES, 2)
+    return session.post(
+        f'{ctx.base_url}/driver/api/navigation',
+        headers=_auth(rng.choice(ctx.driver_tokens)),
+        json={'start_location': start, 'end_location': end, 'date': date.today().isoformat()},
+        timeout=30,
+    )
+
+
+def scenario_admin_routes_search(ctx, session, rng):
+    return session.get(
+        f'{ctx.base_url}/admin/routes', params={'query': rng.choice(SEARCH_TERMS)},
+        headers=_auth(ctx.manager_token), timeout=30,
+    )
+
+
+def scenario_admin_users_search(ctx, session, rng):
+    return session.get(
+        f'{ctx.base_url}/admin/users', params={'query': rng.choice(SEARCH_TERMS)},
+        headers=_auth(ctx.admin_token), timeout=30,
+    )
+
+
+def scenario_admin_vehicles_search(ctx, session, rng):
+    return session.get(
+        f'{ctx.base_url}/admin/vehicles', params={'query': rng.choice(SEARCH_TERMS)},
+        headers=_auth(ctx.admin_token), timeout=30,
+    )
+
+
+def scenario_admin_service_due(ctx, session, rng):
+    return session.get(
+        f'{ctx.base_url}/admin/service-due', params={'limit': 50}, headers=_auth(ctx.manager_token), timeout=30
+    )
+
+
+def scenario_telemetry_import(ctx, session, rng):
+    now = time.time()
+    lines = []
+    for vehicle_id in rng.sample(ctx.vehicle_ids, min(TELEMETRY_VEHICLES, len(ctx.vehicle_ids))):
+        lon, lat = upstreams.address_point(str(vehicle_id))
+        fixes = [
+            [now - (TELEMETRY_FIXES - index) * 10, lat + index * 1e-4, lon + index * 1e-4, 40.0]
+            for index in range(TELEMETRY_FIXES)
+        ]
+        lines.append(json.dumps({'vehicle_id': vehicle_id, 'fixes': fixes}))
+    return session.post(
+        f'{ctx.base_url}/telemetry', data='\n'.join(lines).encode(),
+        headers={**_auth(ctx.manager_token), 'Content-Type': 'application/x-ndjson'}, timeout=30,
+    )
+
+
+def scenario_routes_optimize(ctx, session, rng):
+    items = [dict(zip(('start_location', 'end_location'), rng.sample(ADDRESSES, 2))) for _ in range(OPTIMIZE_REQUESTS)]
+    return session.post(
+        f'{ctx.base_url}/admin/routes/optimize',
+        headers=_auth(ctx.manager_token),
+        json={
+            'date': date.today().isoformat(),
+            'requests': items,
+            'driver_ids': rng.sample(ctx.driver_ids, min(OPTIMIZE_DRIVERS, len(ctx.driver_ids))),
+            'time_budget': 0.2,
+        },
+        timeout=30,
+    )
+
+
+SCENARIOS = {name[len('scenario_'):]: fn for name, fn in globals().items() if name.startswith('scenario_')}
+
+
+def percentile(ordered, pct):
+    if not ordered:
+        return None
+    index = min(len(ordered) - 1, max(0, int(round(pct / 100 * len(ordered))) - 1))
+    return ordered[index]
+
+
+def parse_mix(value: str) -> dict:
+    mix = dict(DEFAULT_MIX)
+    for item in filter(None, (part.strip() for part in (value or '').split(','))):
+        name, _, weight = item.partition('=')
+        if name not in SCENARIOS:
+            raise argparse.ArgumentTypeError(f'unknown scenario {name!r}, known: {", ".join(sorted(SCENARIOS))}')
+        mix[name] = float(weight)
+    return {name: weight for name, weight in mix.items() if weight > 0}
+
+
+def run(ctx, mix: dict, clients: int, duration: float, warmup: float, seed: int) -> dict:
+    """Drive the mix from `clients` threads; returns {scenario: [(latency, ok), ...]}."""
+
+    names = list(mix)
+    weights = [mix[name] for name in names]
+    started = time.monotonic()
+    measure_from = started + warmup
+    deadline = measure_from + duration
+    results = [dict() for _ in range(clients)]
+
+    def client(index):
+        rng = random.Random(seed * 1000 + index)
+        session = requests.Session()
+        samples = results[index]
+        while True:
+            name = rng.choices(names, weights)[0]
+            began = time.monotonic()
+            if began >= deadline:
+                return
+            try:
+                ok = SCENARIOS[name](ctx, session, rng).status_code < 400
+            except requests.RequestException:
+                ok = False
+            if began >= measure_from:
+                samples.setdefault(name, []).append((time.monotonic() - began, ok))
+
+    threads = [threading.Thread(target=client, args=(index,), daemon=True) for index in range(clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    merged = {}
+    for samples in results:
+        for name, values in samples.items():
+            merged.setdefault(name, []).extend(values)
+    return merged
+
+
+def summarize(samples: dict, duration: float) -> dict:
+    scenarios = {}
+    for name, values in sorted(samples.items()):
+        latencies = sorted(latency for latency, _ in values)
+        errors = sum(1 for _, ok in values if not ok)
+        scenarios[name] = {
+            'requests': len(values),
+            'errors': errors,
+            'error_rate': round(errors / len(values), 4),
+            'rps': round(len(values) / duration, 2),
+            'p50': round(percentile(latencies, 50), 4),
+            'p95': round(percentile(latencies, 95), 4),
+            'p99': round(percentile(latencies, 99), 4),
+        }
+    total = sum(item['requests'] for item in scenarios.values())
+    return {'rps': round(total / duration, 2), 'requests': total, 'scenarios': scenarios}
+
+
+def print_report(report: dict):
+    print(f"{'scenario':<24}{'n':>8}{'err':>7}{'rps':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}")
+    for name, item in report['scenarios'].items():
+        print(
+            f"{name:<24}{item['requests']:>8}{item['errors']:>7}{item['rps']:>9.1f}"
+            f"{item['p50'] * 1000:>9.1f}{item['p95'] * 1000:>9.1f}{item['p99'] * 1000:>9.1f}"
+        )
+    print(f"total: {report['requests']} requests, {report['rps']:.1f} req/s")
+
+
+def compare(report: dict, baseline: dict, tolerance: float) -> list:
+    """Regressions of `report` against `baseline`, as messages."""
+
+    problems = []
+    if report['rps'] < baseline['rps'] * (1 - tolerance):
+        problems.append(f"throughput {report['rps']:.1f} req/s < baseline {baseline['rps']:.1f}")
+    for name, base in baseline['scenarios'].items():
+        item = report['scenarios'].get(name)
+        samples = min(item['requests'], base['requests']) if item else 0
+        if samples < MIN_SAMPLES_P50:
+            continue
+        for key, needed in (('p50', MIN_SAMPLES_P50), ('p95', MIN_SAMPLES_P95)):
+            limit = base[key] * (1 + tolerance) + LATENCY_SLACK
+            if samples >= needed and item[key] > limit:
+                problems.append(f"{name}: {key} {item[key] * 1000:.1f} ms > {limit * 1000:.1f} ms")
+        if item['error_rate'] > base['error_rate'] + ERROR_RATE_SLACK:
+            problems.append(f"{name}: error rate {item['error_rate']:.2%} > baseline {base['error_rate']:.2%}")
+    return problems
+
+
+def wait_ready(url: str, process, timeout: float = 60.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f'{" ".join(process.args)} exited with {process.returncode}')
+        try:
+            requests.get(url, timeout=1)
+            return
+        except requests.RequestException:
+            time.sleep(0.2)
+    raise RuntimeError(f'{url} did not come up in {timeout:.0f} s')
+
+
+def spawn(args) -> list:
+    """Start stand-ins, proxy, backend and worker; returns the processes."""
+
+    stub_url = f'http://127.0.0.1:{args.stub_port}'
+    proxy_port = args.proxy_url.rsplit(':', 1)[1]
+    backend_port = args.base_url.rsplit(':', 1)[1]
+    env = {
+        **os.environ,
+        **upstreams.env_urls(stub_url),
+        'FLASK_APP': 'app.py',
+        'MAPS_PROXY_URL': f'{args.proxy_url}/directions',
+        'WEB_CONCURRENCY': str(args.workers),
+    }
+    quiet = {'stdout': subprocess.DEVNULL, 'stderr': None if args.verbose else subprocess.DEVNULL}
+    processes = []
+    try:
+        processes.append(subprocess.Popen([
+            sys.executable, os.path.join(ROOT, 'bench', 'upstreams.py'), '--port', str(args.stub_port),
+            '--latency', str(args.latency), '--jitter', str(args.jitter),
+            '--error-rate', str(args.error_rate), '--seed', str(args.seed),
+        ], cwd=ROOT, env=env, **quiet))
+        wait_ready(f'{stub_url}/static', processes[-1])
+
+        processes.append(subprocess.Popen(
+            [sys.executable, os.path.join(ROOT, 'YandexMaps', 'app.py')], cwd=ROOT,
+            env={**env, 'PORT': proxy_port}, **quiet,
+        ))
+        wait_ready(f'{args.proxy_url}/health', processes[-1])
+
+        processes.append(subprocess.Popen(
+            [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', 'app:app'], cwd=ROOT,
+            env={**env, 'PORT': backend_port}, **quiet,
+        ))
+        wait_ready(f'{args.base_url}/', processes[-1])
+
+        processes.append(subprocess.Popen([sys.executable, '-m', 'flask', 'worker'], cwd=ROOT, env=env, **quiet))
+    except BaseException:
+        stop(processes)
+        raise
+    return processes
+
+
+def stop(processes):
+    for process in reversed(processes):
+        process.terminate()
+    for process in reversed(processes):
+        try:
+            process.wait(timeout=20)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+
+def prepare(args) -> Context:
+    """Log the virtual users in and collect ids the scenarios pick from."""
+
+    session = requests.Session()
+
+    def token(username, password):
+        response = login(session, args.base_url, username, password)
+        response.raise_for_status()
+        return response.json()['access_token']
+
+    credentials = [(f'{args.driver_prefix}-driver-{index:06d}', 'driver') for index in range(args.drivers)]
+    driver_tokens = []
+    for username, password in credentials:
+        try:
+            driver_tokens.append(token(username, password))
+        except requests.HTTPError:
+            break
+    if not driver_tokens:
+        raise RuntimeError(
+            f'no {args.driver_prefix}-driver-NNNNNN accounts, generate data first: flask synthetic generate'
+        )
+    manager_token = token(*args.manager.split(':', 1))
+    admin_token = token(*args.admin.split(':', 1))
+
+    drivers = session.get(f'{args.base_url}/admin/drivers', headers=_auth(manager_token), timeout=120).json()['items']
+    crews = [item for item in drivers if item['vehicle']]
+    return Context(
+        args.base_url, args.proxy_url, credentials[:len(driver_tokens)], driver_tokens, manager_token, admin_token,
+        [item['id'] for item in crews], [item['vehicle']['id'] for item in crews],
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--base-url', default='http://127.0.0.1:5055')
+    parser.add_argument('--proxy-url', default='http://127.0.0.1:8091')
+    parser.add_argument('--spawn', action='store_true', help='start stand-ins, proxy, backend and worker')
+    parser.add_argument('--stub-port', type=int, default=8095)
+    parser.add_argument('--workers', type=int, default=4, help='gunicorn workers with --spawn')
+    parser.add_argument('--latency', type=float, default=0.05, help='upstream latency, seconds (--spawn)')
+    parser.add_argument('--jitter', type=float, default=0.02, help='upstream extra random delay (--spawn)')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='share of failing upstream calls (--spawn)')
+    parser.add_argument('--clients', type=int, default=8)
+    parser.add_argument('--duration', type=float, default=120.0)
+    parser.add_argument('--warmup', type=float, default=10.0)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--mix', type=parse_mix, default=dict(DEFAULT_MIX), help='e.g. login=0,driver_today=50')
+    parser.add_argument('--drivers', type=int, default=100, help='driver accounts to log in')
+    parser.add_argument('--driver-prefix', default='syn')
+    parser.add_argument('--manager', default='manager:admin', help='username:password')
+    parser.add_argument('--admin', default='admin:admin', help='username:password')
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE)
+    parser.add_argument('--save-baseline', action='store_true', help='store this run as the baseline')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='allowed relative regression')
+    parser.add_argument('--json', help='write the report to this file')
+    parser.add_argument('--verbose', action='store_true', help='show the spawned services\' logs')
+    args = parser.parse_args()
+
+    processes = spawn(args) if args.spawn else []
+    try:
+        ctx = prepare(args)
+        samples = run(ctx, args.mix, args.clients, args.duration, args.warmup, args.seed)
+    finally:
+        stop(processes)
+
+    report = summarize(samples, args.duration)
+    report['settings'] = {
+        'clients': args.clients, 'duration': args.duration, 'mix': args.mix, 'drivers': len(ctx.driver_tokens),
+        'vehicles': len(ctx.vehicle_ids), 'cpus': os.cpu_count(),
+        **({'workers': args.workers, 'latency': args.latency, 'jitter': args.jitter, 'error_rate': args.error_rate}
+           if args.spawn else {}),
+    }
+    report['recorded_at'] = datetime.now(timezone.utc).isoformat(timespec='seconds')
+    print_report(report)
+    if args.json:
+        with open(args.json, 'w') as file:
+            json.dump(report, file, ensure_ascii=False, indent=2)
+
+    if args.save_baseline:
+        with open(args.baseline, 'w') as file:
+            json.dump(report, file, ensure_ascii=False, indent=2)
+        print(f'baseline saved to {args.baseline}')
+        return 0
+    if not os.path.exists(args.baseline):
+        print(f'no baseline at {args.baseline}, run with --save-baseline to store one')
+        return 0
+
+    with open(args.baseline) as file:
+        baseline = json.load(file)
+    if baseline.get('settings') != report['settings']:
+        print('warning: baseline was recorded with different settings:', json.dumps(baseline.get('settings')))
+    problems = compare(report, baseline, args.tolerance)
+    for problem in problems:
+        print(f'REGRESSION {problem}')
+    return 1 if problems else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,152 @@
+"""Check that slow map-proxy calls do not starve `/driver/api/today`.
+
+Starts a stand-in for the maps proxy that answers after `--upstream-delay`
+seconds, keeps `--nav-clients` managers hammering `/admin/vehicles/nearby`
+with an address (geocoded through the proxy on every request; the driver's
+navigation screen only reads precomputed previews) and measures the latency
+of `/driver/api/today` meanwhile. The run fails when the stub saw no
+requests, since then nothing was actually slow.
+
+The backend has to be started with `MAPS_PROXY_URL` pointing at the stub, e.g.
+
+    MAPS_PROXY_URL=http://host.docker.internal:8090/directions docker compose up backend
+    python bench/nav_starvation.py --base-url http://localhost:5000
+
+Exits with status 1 when the p95 of `/driver/api/today` exceeds `--max-p95`.
+"""
+import argparse
+import json
+import statistics
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+
+def start_slow_proxy(port: int, delay: float, counts: dict) -> ThreadingHTTPServer:
+    lock = threading.Lock()
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            self.rfile.read(int(self.headers.get('Content-Length') or 0))
+            path = self.path.rstrip('/').rsplit('/', 1)[-1]
+            with lock:
+                counts[path] = counts.get(path, 0) + 1
+            time.sleep(delay)
+            if path == 'geocode':
+                body = json.dumps({'lon': 37.6173, 'lat': 55.7558}).encode()
+            else:
+                body = json.dumps({
+                    'distance_text': '12.3 км',
+                    'distance_value': 12300,
+                    'duration_text': '25 мин',
+                    'duration_value': 1500,
+                    'map_url': 'https://example.invalid/map.png',
+                }).encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(('0.0.0.0', port), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def login(base_url: str, username: str, password: str) -> str:
+    response = requests.post(
+        f'{base_url}/auth/login', json={'username': username, 'password': password}, timeout=10
+    )
+    response.raise_for_status()
+    return response.json()['access_token']
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(pct / 100 * len(ordered))) - 1))
+    return ordered[index]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--base-url', default='http://localhost:5000')
+    parser.add_argument('--username', default='driver1')
+    parser.add_argument('--password', default='admin')
+    parser.add_argument('--manager-username', default='manager')
+    parser.add_argument('--manager-password', default='admin')
+    parser.add_argument('--stub-port', type=int, default=8090)
+    parser.add_argument('--upstream-delay', type=float, default=10.0)
+    parser.add_argument('--nav-clients', type=int, default=32)
+    parser.add_argument('--duration', type=float, default=30.0)
+    parser.add_argument('--max-p95', type=float, default=0.5, help='seconds')
+    args = parser.parse_args()
+
+    stub_counts = {}
+    stub = start_slow_proxy(args.stub_port, args.upstream_delay, stub_counts)
+    token = login(args.base_url, args.username, args.password)
+    headers = {'Authorization': f'Bearer {token}'}
+    manager_token = login(args.base_url, args.manager_username, args.manager_password)
+    manager_headers = {'Authorization': f'Bearer {manager_token}'}
+    deadline = time.monotonic() + args.duration
+    stop = threading.Event()
+
+    def hammer_proxy():
+        session = requests.Session()
+        while not stop.is_set():
+            try:
+                session.get(
+                    f'{args.base_url}/admin/vehicles/nearby',
+                    params={'address': 'Москва, Тверская улица, 1'},
+                    headers=manager_headers,
+                    timeout=60,
+                )
+            except requests.RequestException:
+                pass
+
+    latencies, failures = [], 0
+    with ThreadPoolExecutor(max_workers=args.nav_clients) as pool:
+        for _ in range(args.nav_clients):
+            pool.submit(hammer_proxy)
+
+        # let the proxy-bound requests pile up on the slow stub first
+        time.sleep(min(2.0, args.upstream_delay / 2))
+        session = requests.Session()
+        while time.monotonic() < deadline:
+            started = time.monotonic()
+            try:
+                response = session.get(f'{args.base_url}/driver/api/today', headers=headers, timeout=30)
+                response.raise_for_status()
+                latencies.append(time.monotonic() - started)
+            except requests.RequestException:
+                failures += 1
+            time.sleep(0.1)
+        stop.set()
+
+    stub.shutdown()
+
+    if not stub_counts:
+        print('maps proxy stub received no requests: is MAPS_PROXY_URL pointing at it?')
+        return 1
+    if not latencies:
+        print('/driver/api/today: no successful requests')
+        return 1
+
+    p50 = statistics.median(latencies)
+    p95 = percentile(latencies, 95)
+    print(
+        f'/driver/api/today under {args.nav_clients} slow proxy clients: '
+        f'n={len(latencies)} failures={failures} p50={p50 * 1000:.0f}ms p95={p95 * 1000:.0f}ms '
+        f'stub={stub_counts}'
+    )
+    return 0 if p95 <= args.max_p95 and not failures else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,198 @@
+"""Local stand-ins for the maps proxy's upstreams: Yandex geocoder, OSRM and static maps.
+
+Every response is delayed by `--latency` seconds (plus up to `--jitter`) and
+a `--error-rate` share of requests fails with 503, so the proxy and backend
+can be measured against slow or flaky upstreams without touching the real
+services. Coordinates are derived from the address text, so answers are
+stable between runs.
+
+Run standalone and point the proxy at it:
+
+    python bench/upstreams.py --port 8095 --latency 0.05 --error-rate 0.01
+    GEOCODE_URL=http://localhost:8095/geocode OSRM_URL=http://localhost:8095/route \
+        OSRM_TABLE_URL=http://localhost:8095/table STATIC_MAP_URL=http://localhost:8095/static \
+        python YandexMaps/app.py
+
+`bench/load.py --spawn` starts it together with the proxy and the backend.
+"""
+import argparse
+import base64
+import json
+import math
+import random
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote, urlsplit
+
+
+# 1x1 transparent PNG
+STATIC_MAP_PNG = base64.b64decode(
+    'iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAQAAAC1HAwCAAAAC0lEQVR42mNkYAAAAAYAAjCB0C8AAAAASUVORK5CYII='
+)
+CITY_CENTRE = (37.6173, 55.7558)
+CITY_RADIUS = 0.15
+# road distance relative to the straight line, and average speed
+DETOUR = 1.3
+SPEED_MPS = 10.0
+
+
+def env_urls(base_url: str) -> dict:
+    """Proxy environment that points it at the stand-ins under `base_url`."""
+
+    return {
+        'GEOCODE_URL': f'{base_url}/geocode',
+        'OSRM_URL': f'{base_url}/route',
+        'OSRM_TABLE_URL': f'{base_url}/table',
+        'STATIC_MAP_URL': f'{base_url}/static',
+    }
+
+
+def address_point(address: str):
+    """Stable (lon, lat) of an address within CITY_RADIUS of CITY_CENTRE."""
+
+    digest = zlib.crc32(address.strip().lower().encode())
+    angle = (digest & 0xFFFF) / 0xFFFF * 2 * math.pi
+    distance = CITY_RADIUS * math.sqrt((digest >> 16) / 0xFFFF)
+    return CITY_CENTRE[0] + distance * math.cos(angle) * 1.8, CITY_CENTRE[1] + distance * math.sin(angle)
+
+
+def metres(a, b) -> float:
+    dx = (a[0] - b[0]) * 111_320 * math.cos(math.radians((a[1] + b[1]) / 2))
+    dy = (a[1] - b[1]) * 110_540
+    return math.hypot(dx, dy) * DETOUR
+
+
+def parse_coords(path: str):
+    return [tuple(map(float, pair.split(','))) for pair in unquote(path).split(';') if pair]
+
+
+def geocode_answer(query: dict) -> dict:
+    address = (query.get('geocode') or [''])[0]
+    members = []
+    if address.strip():
+        lon, lat = address_point(address)
+        members.append({'GeoObject': {'Point': {'pos': f'{lon:.6f} {lat:.6f}'}}})
+    return {'response': {'GeoObjectCollection': {'featureMember': members}}}
+
+
+def route_answer(points) -> dict:
+    legs = [{'distance': metres(a, b), 'duration': metres(a, b) / SPEED_MPS} for a, b in zip(points, points[1:])]
+    return {
+        'code': 'Ok',
+        'routes': [{
+            'distance': sum(leg['distance'] for leg in legs),
+            'duration': sum(leg['duration'] for leg in legs),
+            'legs': legs,
+            'geometry': {'type': 'LineString', 'coordinates': [list(point) for point in points]},
+        }],
+    }
+
+
+def table_answer(points, query: dict) -> dict:
+    def indexes(name):
+        value = (query.get(name) or [''])[0]
+        return [int(i) for i in value.split(';')] if value else list(range(len(points)))
+
+    sources, destinations = indexes('sources'), indexes('destinations')
+    distances = [[metres(points[i], points[j]) for j in destinations] for i in sources]
+    return {
+        'code': 'Ok',
+        'distances': distances,
+        'durations': [[value / SPEED_MPS for value in row] for row in distances],
+    }
+
+
+class _Server(ThreadingHTTPServer):
+    request_queue_size = 1024
+
+
+class Stats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.requests = {}
+        self.errors = {}
+
+    def count(self, name: str, failed: bool):
+        with self.lock:
+            self.requests[name] = self.requests.get(name, 0) + 1
+            if failed:
+                self.errors[name] = self.errors.get(name, 0) + 1
+
+
+def start(port: int, latency: float = 0.0, jitter: float = 0.0, error_rate: float = 0.0,
+          seed: int = None, host: str = '127.0.0.1'):
+    """Serve the stand-ins in a background thread; returns (server, stats)."""
+
+    rng = random.Random(seed)
+    rng_lock = threading.Lock()
+    stats = Stats()
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def do_GET(self):
+            url = urlsplit(self.path)
+            query = parse_qs(url.query)
+            name, _, rest = url.path.strip('/').partition('/')
+            with rng_lock:
+                delay = latency + rng.uniform(0, jitter)
+                failed = rng.random() < error_rate
+            time.sleep(delay)
+            stats.count(name, failed)
+
+            if failed:
+                return self.reply(503, b'{"message": "injected failure"}')
+            try:
+                if name == 'geocode':
+                    body = geocode_answer(query)
+                elif name == 'route':
+                    body = route_answer(parse_coords(rest))
+                elif name == 'table':
+                    body = table_answer(parse_coords(rest), query)
+                elif name == 'static':
+                    return self.reply(200, STATIC_MAP_PNG, 'image/png')
+                else:
+                    return self.reply(404, b'{"message": "not found"}')
+            except (ValueError, IndexError):
+                return self.reply(400, b'{"code": "InvalidQuery"}')
+            self.reply(200, json.dumps(body).encode())
+
+        def reply(self, status: int, body: bytes, content_type: str = 'application/json'):
+            self.send_response(status)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = _Server((host, port), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8095)
+    parser.add_argument('--latency', type=float, default=0.05, help='seconds added to every response')
+    parser.add_argument('--jitter', type=float, default=0.0, help='extra random delay, seconds')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='share of requests answered with 503')
+    parser.add_argument('--seed', type=int, default=None)
+    args = parser.parse_args()
+
+    server, stats = start(args.port, args.latency, args.jitter, args.error_rate, args.seed, args.host)
+    print(f'upstream stand-ins on http://{args.host}:{args.port}', flush=True)
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+        print(json.dumps({'requests': stats.requests, 'errors': stats.errors}))
+
+
+if __name__ == '__main__':
+    main()
@@ -87,13 +87,13 @@ BEGIN
     SELECT id INTO v2 FROM vehicle WHERE reg_number = 'B002BB';
 
     IF v1 IS NOT NULL AND NOT EXISTS (SELECT 1 FROM maintenance WHERE vehicle_id = v1) THEN
-        INSERT INTO maintenance (type_of_work, cost, vehicle_id, created_at, updated_at)
-        VALUES ('ТО-1', 15000, v1, NOW(), NOW());
+        INSERT INTO maintenance (operation_type, type_of_work, cost, event_date, vehicle_id, created_at, updated_at)
+        VALUES ('service', 'ТО-1', 15000, CURRENT_DATE, v1, NOW(), NOW());
     END IF;
 
     IF v2 IS NOT NULL AND NOT EXISTS (SELECT 1 FROM maintenance WHERE vehicle_id = v2) THEN
-        INSERT INTO maintenance (type_of_work, cost, vehicle_id, created_at, updated_at)
-        VALUES ('Замена масла', 5000, v2, NOW(), NOW());
+        INSERT INTO maintenance (operation_type, type_of_work, cost, event_date, vehicle_id, created_at, updated_at)
+        VALUES ('service', 'Замена масла', 5000, CURRENT_DATE, v2, NOW(), NOW());
     END IF;
 END $$;
 
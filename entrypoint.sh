@@ -14,11 +14,11 @@ until pg_isready -h "$DB_HOST" -p "$DB_PORT" -U "$DB_USER"; do
   sleep 2
 done
 
-echo "Applying database migrations..."
-flask db upgrade
-
-echo "Seeding initial data..."
-PGPASSWORD="$DB_PASSWORD" psql -v ON_ERROR_STOP=1 -h "$DB_HOST" -U "$DB_USER" -d "$DB_NAME" -f /app/db_seed.sql
+# Migrations, partitions, seed data and assets in one process; steps that are
+# already up to date are skipped (STARTUP_MODE=force runs them all, skip
+# leaves the database to another replica or a release job).
+echo "Preparing database and static assets..."
+flask startup --mode "${STARTUP_MODE:-auto}"
 
 echo "Starting application..."
-exec gunicorn -b 0.0.0.0:${PORT:-5000} app:app
+exec gunicorn -c /app/gunicorn.conf.py app:app
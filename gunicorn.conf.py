@@ -0,0 +1,62 @@
+"""Gunicorn settings for the backend.
+
+The default worker class is gevent: requests waiting on the maps proxy or on
+PostgreSQL yield to other requests instead of pinning a whole worker process.
+Set `GUNICORN_WORKER_CLASS=sync` to fall back to plain sync workers.
+
+`GUNICORN_PRELOAD=1` builds the app once in the master and forks workers
+from it; each worker then replaces the inherited connection pool, so no
+database connection is shared across processes.
+"""
+import multiprocessing
+import os
+import time
+
+
+_started = time.monotonic()
+
+
+worker_class = os.getenv('GUNICORN_WORKER_CLASS', 'gevent')
+
+if worker_class == 'gevent':
+    # Patch before anything imports socket/ssl (including the app under --preload).
+    from gevent import monkey
+
+    monkey.patch_all()
+
+    # psycopg2 is a C extension and blocks the whole process on network waits
+    # unless it is told to hand control back to the gevent hub.
+    from psycogreen.gevent import patch_psycopg
+
+    patch_psycopg()
+
+
+bind = f"0.0.0.0:{os.getenv('PORT', '5000')}"
+workers = int(os.getenv('WEB_CONCURRENCY', min(multiprocessing.cpu_count() * 2 + 1, 8)))
+# Concurrent requests per gevent worker. Each one that touches the DB still needs
+# a pooled connection, so keep the SQLAlchemy pool in mind when raising this.
+worker_connections = int(os.getenv('GUNICORN_WORKER_CONNECTIONS', '200'))
+timeout = int(os.getenv('GUNICORN_TIMEOUT', '30'))
+graceful_timeout = int(os.getenv('GUNICORN_GRACEFUL_TIMEOUT', '30'))
+keepalive = int(os.getenv('GUNICORN_KEEPALIVE', '5'))
+accesslog = '-'
+preload_app = os.getenv('GUNICORN_PRELOAD', '0') == '1'
+
+
+def when_ready(server):
+    server.log.info('Master ready in %.2f s', time.monotonic() - _started)
+
+
+def post_fork(server, worker):
+    worker.forked_at = time.monotonic()
+    if preload_app:
+        from app import app
+        from services.database import dispose_engines
+
+        # the pools were created in the master; start this worker with its own
+        with app.app_context():
+            dispose_engines(app)
+
+
+def post_worker_init(worker):
+    worker.log.info('Worker %s ready in %.2f s', worker.pid, time.monotonic() - worker.forked_at)
@@ -0,0 +1,43 @@
+"""telemetry fix
+
+Revision ID: 1a9c6d3e5f72
+Revises: e4a7b2c90f15
+Create Date: 2026-02-10 00:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '1a9c6d3e5f72'
+down_revision = 'e4a7b2c90f15'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'telemetry_fix',
+        sa.Column('id', sa.BigInteger(), nullable=False),
+        sa.Column('vehicle_id', sa.Integer(), nullable=False),
+        sa.Column('recorded_at', sa.DateTime(), nullable=False),
+        sa.Column('lat', sa.Float(), nullable=False),
+        sa.Column('lon', sa.Float(), nullable=False),
+        sa.Column('speed_kmh', sa.REAL(), nullable=True),
+        sa.Column('odometer_km', sa.Float(), nullable=True),
+        sa.Column(
+            'received_at', sa.DateTime(), nullable=False,
+            server_default=sa.text("(now() at time zone 'utc')"),
+        ),
+        sa.PrimaryKeyConstraint('id'),
+    )
+    op.create_index('ix_telemetry_fix_vehicle_time', 'telemetry_fix', ['vehicle_id', 'recorded_at'])
+    op.create_index(
+        'ix_telemetry_fix_recorded_brin', 'telemetry_fix', ['recorded_at'], postgresql_using='brin'
+    )
+
+
+def downgrade():
+    op.drop_index('ix_telemetry_fix_recorded_brin', table_name='telemetry_fix')
+    op.drop_index('ix_telemetry_fix_vehicle_time', table_name='telemetry_fix')
+    op.drop_table('telemetry_fix')
@@ -0,0 +1,34 @@
+"""vehicle position
+
+Revision ID: 3e6b8d2f0a47
+Revises: 7c3d91b5a2e8
+Create Date: 2026-02-24 00:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '3e6b8d2f0a47'
+down_revision = '7c3d91b5a2e8'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'vehicle_position',
+        sa.Column('vehicle_id', sa.Integer(), nullable=False),
+        sa.Column('recorded_at', sa.DateTime(), nullable=False),
+        sa.Column('lat', sa.Float(), nullable=False),
+        sa.Column('lon', sa.Float(), nullable=False),
+        sa.Column('speed_kmh', sa.REAL(), nullable=True),
+        sa.Column('updated_at', sa.DateTime(), nullable=False),
+        sa.ForeignKeyConstraint(['vehicle_id'], ['vehicle.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('vehicle_id'),
+        prefixes=['UNLOGGED'],
+    )
+
+
+def downgrade():
+    op.drop_table('vehicle_position')
@@ -0,0 +1,31 @@
+"""route precomputed preview
+
+Revision ID: 5d2e8a41c7b3
+Revises: 0f5c6f0c1c2a
+Create Date: 2026-01-12 00:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '5d2e8a41c7b3'
+down_revision = '0f5c6f0c1c2a'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('route', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('waypoint', sa.String(length=100), nullable=True))
+        batch_op.add_column(sa.Column('duration', sa.Float(), nullable=True))
+        batch_op.add_column(sa.Column('map_url', sa.Text(), nullable=True))
+        batch_op.add_column(sa.Column('resolved_at', sa.DateTime(), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('route', schema=None) as batch_op:
+        batch_op.drop_column('resolved_at')
+        batch_op.drop_column('map_url')
+        batch_op.drop_column('duration')
+        batch_op.drop_column('waypoint')
@@ -0,0 +1,133 @@
+"""monthly partitions
+
+Revision ID: 7c3d91b5a2e8
+Revises: 1a9c6d3e5f72
+Create Date: 2026-02-17 00:00:00.000000
+
+Rebuilds route, maintenance and telemetry_fix as tables range-partitioned
+by month. Existing rows are copied into per-month partitions; each table
+also gets a DEFAULT partition for rows outside the created months, which
+`flask partitions maintain` later moves into their own partitions.
+
+The primary keys become (id, partition key): PostgreSQL only enforces
+uniqueness on partitioned tables over the partition key, so a single id is
+no longer checked and no foreign key can reference these tables by id.
+
+"""
+from datetime import date
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '7c3d91b5a2e8'
+down_revision = '1a9c6d3e5f72'
+branch_labels = None
+depends_on = None
+
+
+MONTHS_AHEAD = 3
+
+# table, partition key, (name, definition) constraints, index statements
+TABLES = [
+    (
+        'route', 'date',
+        [
+            ('route_pkey', 'PRIMARY KEY (id, date)'),
+            ('route_vehicle_id_fkey', 'FOREIGN KEY (vehicle_id) REFERENCES vehicle (id)'),
+            ('route_driver_id_fkey', 'FOREIGN KEY (driver_id) REFERENCES driver (id)'),
+        ],
+        [
+            'CREATE INDEX ix_route_zero_distance ON route (id) WHERE distance = 0',
+            'CREATE INDEX ix_route_locations ON route (start_location, end_location)',
+        ],
+    ),
+    (
+        'maintenance', 'event_date',
+        [
+            ('maintenance_pkey', 'PRIMARY KEY (id, event_date)'),
+            ('maintenance_vehicle_id_fkey', 'FOREIGN KEY (vehicle_id) REFERENCES vehicle (id)'),
+        ],
+        [],
+    ),
+    (
+        'telemetry_fix', 'recorded_at',
+        [('telemetry_fix_pkey', 'PRIMARY KEY (id, recorded_at)')],
+        [
+            'CREATE INDEX ix_telemetry_fix_vehicle_time ON telemetry_fix (vehicle_id, recorded_at)',
+            'CREATE INDEX ix_telemetry_fix_recorded_brin ON telemetry_fix USING brin (recorded_at)',
+        ],
+    ),
+]
+
+
+def _add_months(month: date, count: int) -> date:
+    index = month.year * 12 + month.month - 1 + count
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def _months(table, key):
+    bind = op.get_bind()
+    first = bind.execute(sa.text(f'SELECT min({key})::date FROM {table}')).scalar()
+    current = date.today().replace(day=1)
+    month = first.replace(day=1) if first and first < current else current
+    last = _add_months(current, MONTHS_AHEAD)
+    while month <= last:
+        yield month
+        month = _add_months(month, 1)
+
+
+def _rebuild(table, key, constraints, indexes, partitioned):
+    old = f'{table}_old'
+    op.execute(f'ALTER TABLE {table} RENAME TO {old}')
+    partition_clause = f'PARTITION BY RANGE ({key})' if partitioned else ''
+    op.execute(
+        f'CREATE TABLE {table} (LIKE {old} INCLUDING DEFAULTS INCLUDING CONSTRAINTS) {partition_clause}'
+    )
+    if partitioned:
+        for month in _months(old, key):
+            op.execute(
+                f"CREATE TABLE {table}_p{month:%Y_%m} PARTITION OF {table} "
+                f"FOR VALUES FROM ('{month}') TO ('{_add_months(month, 1)}')"
+            )
+        op.execute(f'CREATE TABLE {table}_default PARTITION OF {table} DEFAULT')
+
+    op.execute(f'INSERT INTO {table} SELECT * FROM {old}')
+    # the id sequence belongs to the old table and would be dropped with it
+    op.execute(f"ALTER SEQUENCE {table}_id_seq OWNED BY {table}.id")
+    op.execute(f'DROP TABLE {old}')
+
+    for name, definition in constraints:
+        op.execute(f'ALTER TABLE {table} ADD CONSTRAINT {name} {definition}')
+    for statement in indexes:
+        op.execute(statement)
+
+
+def upgrade():
+    for table, key, constraints, indexes in TABLES:
+        _rebuild(table, key, constraints, indexes, partitioned=True)
+
+    op.create_table(
+        'telemetry_rollup',
+        sa.Column('vehicle_id', sa.Integer(), nullable=False),
+        sa.Column('bucket_start', sa.DateTime(), nullable=False),
+        sa.Column('fixes', sa.Integer(), nullable=False),
+        sa.Column('lat', sa.Float(), nullable=False),
+        sa.Column('lon', sa.Float(), nullable=False),
+        sa.Column('speed_avg', sa.REAL(), nullable=True),
+        sa.Column('speed_max', sa.REAL(), nullable=True),
+        sa.Column('odometer_min', sa.Float(), nullable=True),
+        sa.Column('odometer_max', sa.Float(), nullable=True),
+        sa.PrimaryKeyConstraint('vehicle_id', 'bucket_start'),
+    )
+
+
+def downgrade():
+    op.drop_table('telemetry_rollup')
+
+    for table, key, constraints, indexes in TABLES:
+        constraints = [
+            (name, 'PRIMARY KEY (id)' if definition.startswith('PRIMARY KEY') else definition)
+            for name, definition in constraints
+        ]
+        _rebuild(table, key, constraints, indexes, partitioned=False)
@@ -0,0 +1,33 @@
+"""vehicle daily distance
+
+Revision ID: 9d1f4c7e2b80
+Revises: 3e6b8d2f0a47
+Create Date: 2026-03-03 00:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '9d1f4c7e2b80'
+down_revision = '3e6b8d2f0a47'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'vehicle_daily_distance',
+        sa.Column('vehicle_id', sa.Integer(), nullable=False),
+        sa.Column('day', sa.Date(), nullable=False),
+        sa.Column('distance_km', sa.Float(), nullable=False),
+        sa.Column('fixes', sa.Integer(), nullable=False),
+        sa.Column('rejected_fixes', sa.Integer(), nullable=False),
+        sa.Column('updated_at', sa.DateTime(), nullable=False),
+        sa.ForeignKeyConstraint(['vehicle_id'], ['vehicle.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('vehicle_id', 'day'),
+    )
+
+
+def downgrade():
+    op.drop_table('vehicle_daily_distance')
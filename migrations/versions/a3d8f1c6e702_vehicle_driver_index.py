@@ -0,0 +1,25 @@
+"""vehicle driver index
+
+Revision ID: a3d8f1c6e702
+Revises: d6a2e9f4b138
+Create Date: 2026-05-06 00:00:00.000000
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = 'a3d8f1c6e702'
+down_revision = 'd6a2e9f4b138'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # a driver's last assigned vehicle and the reg numbers of a user's vehicles
+    # (services/schemas.py) are looked up per row by driver_id
+    op.create_index('ix_vehicle_driver_created', 'vehicle', ['driver_id', 'created_at'])
+
+
+def downgrade():
+    op.drop_index('ix_vehicle_driver_created', table_name='vehicle')
@@ -0,0 +1,32 @@
+"""route stops
+
+Revision ID: a4d6f2b8c371
+Revises: e9b3c5d7f124
+Create Date: 2026-03-31 00:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = 'a4d6f2b8c371'
+down_revision = 'e9b3c5d7f124'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('route', sa.Column('stops', sa.ARRAY(sa.String(length=100)), nullable=True))
+    op.add_column(
+        'route', sa.Column('optimize_stops', sa.Boolean(), nullable=False, server_default=sa.false())
+    )
+    op.execute('UPDATE route SET stops = ARRAY[waypoint] WHERE waypoint IS NOT NULL')
+    op.drop_column('route', 'waypoint')
+
+
+def downgrade():
+    op.add_column('route', sa.Column('waypoint', sa.String(length=100), nullable=True))
+    # only the first stop fits the old single waypoint
+    op.execute('UPDATE route SET waypoint = stops[1] WHERE stops IS NOT NULL')
+    op.drop_column('route', 'optimize_stops')
+    op.drop_column('route', 'stops')
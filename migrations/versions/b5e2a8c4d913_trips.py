@@ -0,0 +1,58 @@
+"""trips
+
+Revision ID: b5e2a8c4d913
+Revises: 9d1f4c7e2b80
+Create Date: 2026-03-10 00:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = 'b5e2a8c4d913'
+down_revision = '9d1f4c7e2b80'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'trip',
+        sa.Column('id', sa.BigInteger(), nullable=False),
+        sa.Column('vehicle_id', sa.Integer(), nullable=False),
+        sa.Column('route_id', sa.Integer(), nullable=True),
+        sa.Column('started_at', sa.DateTime(), nullable=False),
+        sa.Column('ended_at', sa.DateTime(), nullable=False),
+        sa.Column('start_lat', sa.Float(), nullable=False),
+        sa.Column('start_lon', sa.Float(), nullable=False),
+        sa.Column('end_lat', sa.Float(), nullable=False),
+        sa.Column('end_lon', sa.Float(), nullable=False),
+        sa.Column('distance_km', sa.Float(), nullable=False),
+        sa.Column('idle_seconds', sa.Integer(), nullable=False),
+        sa.Column('max_speed_kmh', sa.REAL(), nullable=True),
+        sa.Column('fixes', sa.Integer(), nullable=False),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.ForeignKeyConstraint(['vehicle_id'], ['vehicle.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('id'),
+    )
+    op.create_index('ix_trip_vehicle_started', 'trip', ['vehicle_id', 'started_at'])
+    op.create_index(
+        'ix_trip_route', 'trip', ['route_id'], postgresql_where=sa.text('route_id IS NOT NULL')
+    )
+
+    op.create_table(
+        'trip_state',
+        sa.Column('vehicle_id', sa.Integer(), nullable=False),
+        sa.Column('cursor', sa.DateTime(), nullable=False),
+        sa.Column('state', sa.JSON(), nullable=False),
+        sa.Column('updated_at', sa.DateTime(), nullable=False),
+        sa.ForeignKeyConstraint(['vehicle_id'], ['vehicle.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('vehicle_id'),
+    )
+
+
+def downgrade():
+    op.drop_table('trip_state')
+    op.drop_index('ix_trip_route', table_name='trip')
+    op.drop_index('ix_trip_vehicle_started', table_name='trip')
+    op.drop_table('trip')
@@ -0,0 +1,23 @@
+"""job dirty flag
+
+Revision ID: b7e2c4d9f013
+Revises: a3d8f1c6e702
+Create Date: 2026-05-12 00:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = 'b7e2c4d9f013'
+down_revision = 'a3d8f1c6e702'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('job', sa.Column('dirty', sa.Boolean(), nullable=False, server_default=sa.false()))
+
+
+def downgrade():
+    op.drop_column('job', 'dirty')
@@ -0,0 +1,35 @@
+"""travel time statistics
+
+Revision ID: b8e4c2f6a917
+Revises: a4d6f2b8c371
+Create Date: 2026-04-07 00:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = 'b8e4c2f6a917'
+down_revision = 'a4d6f2b8c371'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'travel_time_stat',
+        sa.Column('from_lat', sa.Integer(), nullable=False),
+        sa.Column('from_lon', sa.Integer(), nullable=False),
+        sa.Column('to_lat', sa.Integer(), nullable=False),
+        sa.Column('to_lon', sa.Integer(), nullable=False),
+        sa.Column('slot', sa.SmallInteger(), nullable=False),
+        sa.Column('weight', sa.REAL(), nullable=False),
+        sa.Column('mean_log', sa.REAL(), nullable=False),
+        sa.Column('m2_log', sa.REAL(), nullable=False),
+        sa.Column('updated_at', sa.DateTime(), nullable=False),
+        sa.PrimaryKeyConstraint('from_lat', 'from_lon', 'to_lat', 'to_lon', 'slot'),
+    )
+
+
+def downgrade():
+    op.drop_table('travel_time_stat')
@@ -0,0 +1,43 @@
+"""vehicle service intervals
+
+Revision ID: c1f7d3a9e520
+Revises: b8e4c2f6a917
+Create Date: 2026-04-14 00:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = 'c1f7d3a9e520'
+down_revision = 'b8e4c2f6a917'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column(
+        'vehicle', sa.Column('service_interval_km', sa.Integer(), nullable=False, server_default='10000')
+    )
+    op.add_column(
+        'vehicle', sa.Column('service_interval_days', sa.Integer(), nullable=False, server_default='120')
+    )
+    # last service and driven distance per vehicle for the service-due report
+    op.execute(
+        "CREATE INDEX ix_maintenance_vehicle_service ON maintenance (vehicle_id, event_date) "
+        "WHERE operation_type = 'service'"
+    )
+    op.execute('CREATE INDEX ix_route_vehicle_date ON route (vehicle_id, date)')
+    # km since a date without visiting the heap
+    op.create_index(
+        'ix_vehicle_daily_distance_km', 'vehicle_daily_distance', ['vehicle_id', 'day'],
+        postgresql_include=['distance_km'],
+    )
+
+
+def downgrade():
+    op.drop_index('ix_vehicle_daily_distance_km', table_name='vehicle_daily_distance')
+    op.execute('DROP INDEX IF EXISTS ix_route_vehicle_date')
+    op.execute('DROP INDEX IF EXISTS ix_maintenance_vehicle_service')
+    op.drop_column('vehicle', 'service_interval_days')
+    op.drop_column('vehicle', 'service_interval_km')
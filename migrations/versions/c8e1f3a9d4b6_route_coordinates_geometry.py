@@ -0,0 +1,38 @@
+"""route coordinates and geometry
+
+Revision ID: c8e1f3a9d4b6
+Revises: 8b4f0e6a2d19
+Create Date: 2026-01-27 00:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = 'c8e1f3a9d4b6'
+down_revision = '8b4f0e6a2d19'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('route', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('start_lat', sa.Float(), nullable=True))
+        batch_op.add_column(sa.Column('start_lon', sa.Float(), nullable=True))
+        batch_op.add_column(sa.Column('end_lat', sa.Float(), nullable=True))
+        batch_op.add_column(sa.Column('end_lon', sa.Float(), nullable=True))
+        batch_op.add_column(sa.Column('waypoint_coords', sa.JSON(), nullable=True))
+        batch_op.add_column(sa.Column('geometry', sa.Text(), nullable=True))
+    # resolved twins are looked up by their addresses (services/route_enrichment.py)
+    op.create_index('ix_route_locations', 'route', ['start_location', 'end_location'])
+
+
+def downgrade():
+    op.drop_index('ix_route_locations', table_name='route')
+    with op.batch_alter_table('route', schema=None) as batch_op:
+        batch_op.drop_column('geometry')
+        batch_op.drop_column('waypoint_coords')
+        batch_op.drop_column('end_lon')
+        batch_op.drop_column('end_lat')
+        batch_op.drop_column('start_lon')
+        batch_op.drop_column('start_lat')
@@ -0,0 +1,70 @@
+"""geofences and route status
+
+Revision ID: d2f7a1c6e058
+Revises: b5e2a8c4d913
+Create Date: 2026-03-17 00:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = 'd2f7a1c6e058'
+down_revision = 'b5e2a8c4d913'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'geofence',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('name', sa.String(length=100), nullable=False),
+        sa.Column('kind', sa.String(length=20), nullable=False),
+        sa.Column('polygon', sa.JSON(), nullable=False),
+        sa.Column('min_lat', sa.Float(), nullable=False),
+        sa.Column('min_lon', sa.Float(), nullable=False),
+        sa.Column('max_lat', sa.Float(), nullable=False),
+        sa.Column('max_lon', sa.Float(), nullable=False),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.Column('updated_at', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('id'),
+    )
+
+    op.create_table(
+        'geofence_event',
+        sa.Column('id', sa.BigInteger(), nullable=False),
+        sa.Column('vehicle_id', sa.Integer(), nullable=False),
+        sa.Column('geofence_id', sa.Integer(), nullable=False),
+        sa.Column('recorded_at', sa.DateTime(), nullable=False),
+        sa.Column('entered', sa.Boolean(), nullable=False),
+        sa.PrimaryKeyConstraint('id'),
+    )
+    op.create_index('ix_geofence_event_vehicle_time', 'geofence_event', ['vehicle_id', 'recorded_at'])
+    op.create_index(
+        'ix_geofence_event_recorded_brin', 'geofence_event', ['recorded_at'], postgresql_using='brin'
+    )
+
+    op.create_table(
+        'vehicle_geofence_state',
+        sa.Column('vehicle_id', sa.Integer(), nullable=False),
+        sa.Column('checked_at', sa.DateTime(), nullable=False),
+        sa.Column('inside', sa.ARRAY(sa.Integer()), nullable=False),
+        sa.ForeignKeyConstraint(['vehicle_id'], ['vehicle.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('vehicle_id'),
+    )
+
+    op.add_column('route', sa.Column('status', sa.String(length=20), nullable=False, server_default='planned'))
+    op.add_column('route', sa.Column('started_at', sa.DateTime(), nullable=True))
+    op.add_column('route', sa.Column('completed_at', sa.DateTime(), nullable=True))
+
+
+def downgrade():
+    op.drop_column('route', 'completed_at')
+    op.drop_column('route', 'started_at')
+    op.drop_column('route', 'status')
+    op.drop_table('vehicle_geofence_state')
+    op.drop_index('ix_geofence_event_recorded_brin', table_name='geofence_event')
+    op.drop_index('ix_geofence_event_vehicle_time', table_name='geofence_event')
+    op.drop_table('geofence_event')
+    op.drop_table('geofence')
@@ -0,0 +1,43 @@
+"""fuel anomalies
+
+Revision ID: d6a2e9f4b138
+Revises: c1f7d3a9e520
+Create Date: 2026-04-21 00:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = 'd6a2e9f4b138'
+down_revision = 'c1f7d3a9e520'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'fuel_anomaly',
+        sa.Column('id', sa.BigInteger(), nullable=False),
+        sa.Column('maintenance_id', sa.Integer(), nullable=False),
+        sa.Column('vehicle_id', sa.Integer(), nullable=False),
+        sa.Column('event_date', sa.Date(), nullable=False),
+        sa.Column('kind', sa.String(length=20), nullable=False),
+        sa.Column('consumption_l_100km', sa.REAL(), nullable=True),
+        sa.Column('expected_l_100km', sa.REAL(), nullable=True),
+        sa.Column('score', sa.REAL(), nullable=True),
+        sa.Column('distance_km', sa.REAL(), nullable=True),
+        sa.Column('fuel_volume_l', sa.REAL(), nullable=True),
+        sa.Column('detected_at', sa.DateTime(), nullable=False),
+        sa.ForeignKeyConstraint(['vehicle_id'], ['vehicle.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('maintenance_id', 'kind', name='uq_fuel_anomaly_fill_kind'),
+    )
+    op.create_index('ix_fuel_anomaly_date', 'fuel_anomaly', ['event_date'])
+    op.create_index('ix_fuel_anomaly_vehicle_date', 'fuel_anomaly', ['vehicle_id', 'event_date'])
+
+
+def downgrade():
+    op.drop_index('ix_fuel_anomaly_vehicle_date', table_name='fuel_anomaly')
+    op.drop_index('ix_fuel_anomaly_date', table_name='fuel_anomaly')
+    op.drop_table('fuel_anomaly')
@@ -0,0 +1,35 @@
+"""app state and zero distance index
+
+Revision ID: e4a7b2c90f15
+Revises: c8e1f3a9d4b6
+Create Date: 2026-02-03 00:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = 'e4a7b2c90f15'
+down_revision = 'c8e1f3a9d4b6'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'app_state',
+        sa.Column('key', sa.String(length=100), nullable=False),
+        sa.Column('value', sa.JSON(), nullable=False),
+        sa.Column('updated_at', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('key'),
+    )
+    # keyset walk of routes that still have no distance (flask backfill route-distance)
+    op.create_index(
+        'ix_route_zero_distance', 'route', ['id'],
+        postgresql_where=sa.text('distance = 0'),
+    )
+
+
+def downgrade():
+    op.drop_index('ix_route_zero_distance', table_name='route')
+    op.drop_table('app_state')
@@ -0,0 +1,25 @@
+"""job result, distance cache expiry index
+
+Revision ID: e5a1c7f3b902
+Revises: b7e2c4d9f013
+Create Date: 2026-05-20 00:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = 'e5a1c7f3b902'
+down_revision = 'b7e2c4d9f013'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('job', sa.Column('result', sa.JSON(), nullable=True))
+    op.create_index('ix_distance_cache_updated_at', 'distance_cache', ['updated_at'])
+
+
+def downgrade():
+    op.drop_index('ix_distance_cache_updated_at', table_name='distance_cache')
+    op.drop_column('job', 'result')
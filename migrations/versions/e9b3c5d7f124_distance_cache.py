@@ -0,0 +1,33 @@
+"""distance cache
+
+Revision ID: e9b3c5d7f124
+Revises: d2f7a1c6e058
+Create Date: 2026-03-24 00:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = 'e9b3c5d7f124'
+down_revision = 'd2f7a1c6e058'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'distance_cache',
+        sa.Column('from_lat', sa.Integer(), nullable=False),
+        sa.Column('from_lon', sa.Integer(), nullable=False),
+        sa.Column('to_lat', sa.Integer(), nullable=False),
+        sa.Column('to_lon', sa.Integer(), nullable=False),
+        sa.Column('distance_m', sa.REAL(), nullable=False),
+        sa.Column('duration_s', sa.REAL(), nullable=True),
+        sa.Column('updated_at', sa.DateTime(), nullable=False),
+        sa.PrimaryKeyConstraint('from_lat', 'from_lon', 'to_lat', 'to_lon'),
+    )
+
+
+def downgrade():
+    op.drop_table('distance_cache')
@@ -0,0 +1,23 @@
+"""route eta learned marker
+
+Revision ID: f3c9d2a7e415
+Revises: e5a1c7f3b902
+Create Date: 2026-05-26 00:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = 'f3c9d2a7e415'
+down_revision = 'e5a1c7f3b902'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('route', sa.Column('eta_learned_at', sa.DateTime(), nullable=True))
+
+
+def downgrade():
+    op.drop_column('route', 'eta_learned_at')
@@ -3,3 +3,13 @@ from .driver import Driver
 from .user import User
 from .route import Route
 from .maintenance import Maintenance
+from .job import Job
+from .app_state import AppState
+from .telemetry import TelemetryFix, TelemetryRollup
+from .vehicle_position import VehiclePosition
+from .vehicle_daily_distance import VehicleDailyDistance
+from .trip import Trip, TripState
+from .geofence import Geofence, GeofenceEvent, VehicleGeofenceState
+from .distance_cache import DistanceCache
+from .travel_time import TravelTimeStat
+from .fuel_anomaly import FuelAnomaly
@@ -0,0 +1,28 @@
+from datetime import datetime
+from app import db
+
+class AppState(db.Model):
+    """Small key/value store for checkpoints of maintenance commands."""
+
+    __tablename__ = 'app_state'
+
+    key = db.Column(db.String(100), primary_key=True)
+    value = db.Column(db.JSON, nullable=False)
+
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    @classmethod
+    def get_value(cls, key, default=None):
+        state = db.session.get(cls, key)
+        return state.value if state else default
+
+    @classmethod
+    def set_value(cls, key, value):
+        state = db.session.get(cls, key)
+        if state:
+            state.value = value
+        else:
+            db.session.add(cls(key=key, value=value))
+
+    def __repr__(self):
+        return f"<AppState {self.key}>"
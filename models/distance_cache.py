@@ -0,0 +1,26 @@
+from app import db
+
+class DistanceCache(db.Model):
+    """Driving distance between two points, keyed by coordinates on a ~10 m grid.
+
+    Coordinates are stored as integers in 1e-4 degree units
+    (services/distance_matrix.py).
+    """
+
+    __tablename__ = 'distance_cache'
+
+    from_lat = db.Column(db.Integer, primary_key=True)
+    from_lon = db.Column(db.Integer, primary_key=True)
+    to_lat = db.Column(db.Integer, primary_key=True)
+    to_lon = db.Column(db.Integer, primary_key=True)
+    distance_m = db.Column(db.REAL, nullable=False)
+    duration_s = db.Column(db.REAL, nullable=True)
+    updated_at = db.Column(db.DateTime, nullable=False)
+
+    __table_args__ = (
+        # expired rows are deleted by services/distance_matrix.py:prune_expired
+        db.Index('ix_distance_cache_updated_at', 'updated_at'),
+    )
+
+    def __repr__(self):
+        return f"<DistanceCache ({self.from_lat},{self.from_lon})->({self.to_lat},{self.to_lon})>"
@@ -0,0 +1,32 @@
+from datetime import datetime
+from app import db
+
+class FuelAnomaly(db.Model):
+    """Fuel fill whose consumption since the previous fill stands out (services/fuel.py)."""
+
+    __tablename__ = 'fuel_anomaly'
+
+    id = db.Column(db.BigInteger, primary_key=True)
+    # maintenance is partitioned with key (id, event_date); no FK, like trip.route_id
+    maintenance_id = db.Column(db.Integer, nullable=False)
+    vehicle_id = db.Column(db.Integer, db.ForeignKey('vehicle.id', ondelete='CASCADE'), nullable=False)
+    event_date = db.Column(db.Date, nullable=False)
+    # high_consumption | low_consumption | odometer
+    kind = db.Column(db.String(20), nullable=False)
+    consumption_l_100km = db.Column(db.REAL, nullable=True)
+    # the vehicle's median consumption
+    expected_l_100km = db.Column(db.REAL, nullable=True)
+    # robust z-score: 0.6745 * (x - median) / MAD
+    score = db.Column(db.REAL, nullable=True)
+    distance_km = db.Column(db.REAL, nullable=True)
+    fuel_volume_l = db.Column(db.REAL, nullable=True)
+    detected_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+    __table_args__ = (
+        db.UniqueConstraint('maintenance_id', 'kind', name='uq_fuel_anomaly_fill_kind'),
+        db.Index('ix_fuel_anomaly_date', 'event_date'),
+        db.Index('ix_fuel_anomaly_vehicle_date', 'vehicle_id', 'event_date'),
+    )
+
+    def __repr__(self):
+        return f"<FuelAnomaly {self.kind} vehicle={self.vehicle_id} {self.event_date}>"
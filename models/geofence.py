@@ -0,0 +1,56 @@
+from datetime import datetime
+from app import db
+
+class Geofence(db.Model):
+    """Depot or customer site outline, checked against incoming telemetry."""
+
+    __tablename__ = 'geofence'
+
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(100), nullable=False)
+    kind = db.Column(db.String(20), nullable=False, default='site')  # depot | site
+    # [[lon, lat], ...] ring, first point not repeated at the end
+    polygon = db.Column(db.JSON, nullable=False)
+    min_lat = db.Column(db.Float, nullable=False)
+    min_lon = db.Column(db.Float, nullable=False)
+    max_lat = db.Column(db.Float, nullable=False)
+    max_lon = db.Column(db.Float, nullable=False)
+
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    def __repr__(self):
+        return f"<Geofence {self.name}>"
+
+
+class GeofenceEvent(db.Model):
+    """Vehicle entered (entered=True) or left a geofence at `recorded_at`."""
+
+    __tablename__ = 'geofence_event'
+
+    id = db.Column(db.BigInteger, primary_key=True)
+    vehicle_id = db.Column(db.Integer, nullable=False)
+    geofence_id = db.Column(db.Integer, nullable=False)
+    recorded_at = db.Column(db.DateTime, nullable=False)
+    entered = db.Column(db.Boolean, nullable=False)
+
+    __table_args__ = (
+        db.Index('ix_geofence_event_vehicle_time', 'vehicle_id', 'recorded_at'),
+        db.Index('ix_geofence_event_recorded_brin', 'recorded_at', postgresql_using='brin'),
+    )
+
+    def __repr__(self):
+        return f"<GeofenceEvent vehicle={self.vehicle_id} fence={self.geofence_id} entered={self.entered}>"
+
+
+class VehicleGeofenceState(db.Model):
+    """Fences a vehicle is inside of as of its last checked fix."""
+
+    __tablename__ = 'vehicle_geofence_state'
+
+    vehicle_id = db.Column(db.Integer, db.ForeignKey('vehicle.id', ondelete='CASCADE'), primary_key=True)
+    checked_at = db.Column(db.DateTime, nullable=False)
+    inside = db.Column(db.ARRAY(db.Integer), nullable=False, default=list)
+
+    def __repr__(self):
+        return f"<VehicleGeofenceState vehicle={self.vehicle_id} inside={self.inside}>"
@@ -0,0 +1,50 @@
+from datetime import datetime
+from app import db
+
+class Job(db.Model):
+    __tablename__ = 'job'
+
+    id = db.Column(db.BigInteger, primary_key=True)
+    job_type = db.Column(db.String(100), nullable=False)
+    payload = db.Column(db.JSON, nullable=False, default=dict)
+    # What the handler returned, for callers that poll the job.
+    result = db.Column(db.JSON, nullable=True)
+    # Jobs with a higher priority are claimed first.
+    priority = db.Column(db.Integer, nullable=False, default=0)
+    # queued -> running -> done; failed attempts go back to queued until
+    # max_attempts is reached, then the job stays in 'dead'.
+    status = db.Column(db.String(20), nullable=False, default='queued')
+    # At most one queued/running job per key (see services/jobs.py:enqueue).
+    dedupe_key = db.Column(db.String(200), nullable=True)
+    # Enqueued again while running: queued anew when the current run finishes.
+    dirty = db.Column(db.Boolean, nullable=False, default=False, server_default=db.false())
+
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    max_attempts = db.Column(db.Integer, nullable=False, default=5)
+    run_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    locked_by = db.Column(db.String(100), nullable=True)
+    locked_at = db.Column(db.DateTime, nullable=True)
+    last_error = db.Column(db.Text, nullable=True)
+    duration_ms = db.Column(db.Integer, nullable=True)
+    finished_at = db.Column(db.DateTime, nullable=True)
+
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    __table_args__ = (
+        db.Index(
+            'ix_job_claim', db.text('priority DESC'), 'run_at',
+            postgresql_where=db.text("status = 'queued'"),
+        ),
+        db.Index(
+            'ix_job_running', 'job_type',
+            postgresql_where=db.text("status = 'running'"),
+        ),
+        db.Index(
+            'uq_job_dedupe_key', 'dedupe_key', unique=True,
+            postgresql_where=db.text("status IN ('queued', 'running')"),
+        ),
+    )
+
+    def __repr__(self):
+        return f"<Job {self.id} {self.job_type} {self.status}>"
@@ -4,12 +4,13 @@ from app import db
 class Maintenance(db.Model):
     __tablename__ = 'maintenance'
 
-    id = db.Column(db.Integer, primary_key=True)
+    # Range-partitioned by month on `event_date`, see models/route.py.
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
     operation_type = db.Column(db.String(20), nullable=False, default='service')
     type_of_work = db.Column(db.String(100), nullable=True)
     cost = db.Column(db.Float, nullable=False)
 
-    event_date = db.Column(db.Date, nullable=False, default=date.today)
+    event_date = db.Column(db.Date, primary_key=True, nullable=False, default=date.today)
     mileage_km = db.Column(db.Integer, nullable=True)
     fuel_volume_l = db.Column(db.Float, nullable=True)
 
@@ -18,6 +19,15 @@ class Maintenance(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
+    __table_args__ = (
+        db.Index(
+            'ix_maintenance_vehicle_service', 'vehicle_id', 'event_date',
+            postgresql_where=db.text("operation_type = 'service'"),
+        ),
+        {'postgresql_partition_by': 'RANGE (event_date)'},
+    )
+    __mapper_args__ = {'primary_key': [id]}
+
     vehicle = db.relationship('Vehicle', back_populates='maintenances')
 
     def __repr__(self):
@@ -4,18 +4,53 @@ from app import db
 class Route(db.Model):
     __tablename__ = 'route'
 
-    id = db.Column(db.Integer, primary_key=True)
+    # The table is range-partitioned by month on `date`, so the database key is
+    # (id, date); `id` alone is still unique and stays the ORM identity.
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
     start_location = db.Column(db.String(100), nullable=False)
     end_location = db.Column(db.String(100), nullable=False)
-    date = db.Column(db.Date, nullable=False)
+    # intermediate stop addresses in travel order; reordered by the maps proxy
+    # on resolution when `optimize_stops` is set
+    stops = db.Column(db.ARRAY(db.String(100)), nullable=True)
+    optimize_stops = db.Column(db.Boolean, nullable=False, default=False, server_default=db.false())
+    date = db.Column(db.Date, primary_key=True, nullable=False)
     distance = db.Column(db.Float, nullable=False)
 
+    # Filled in the background from the maps proxy (services/route_enrichment.py)
+    duration = db.Column(db.Float, nullable=True)
+    map_url = db.Column(db.Text, nullable=True)
+    resolved_at = db.Column(db.DateTime, nullable=True)
+
+    start_lat = db.Column(db.Float, nullable=True)
+    start_lon = db.Column(db.Float, nullable=True)
+    end_lat = db.Column(db.Float, nullable=True)
+    end_lon = db.Column(db.Float, nullable=True)
+    # [[lon, lat], ...] of intermediate points in travel order
+    waypoint_coords = db.Column(db.JSON, nullable=True)
+    # Google encoded polyline (precision 5) of the road geometry, see services/geo.py
+    geometry = db.Column(db.Text, nullable=True)
+
+    # planned -> in_progress -> completed, set from geofence events (services/geofences.py)
+    status = db.Column(db.String(20), nullable=False, default='planned', server_default='planned')
+    started_at = db.Column(db.DateTime, nullable=True)
+    completed_at = db.Column(db.DateTime, nullable=True)
+    # set once the trip is in travel_time_stat (services/eta.py), so it is counted once
+    eta_learned_at = db.Column(db.DateTime, nullable=True)
+
     vehicle_id = db.Column(db.Integer, db.ForeignKey('vehicle.id'), nullable=False)
     driver_id = db.Column(db.Integer, db.ForeignKey('driver.id'), nullable=False)
 
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
+    __table_args__ = (
+        db.Index('ix_route_zero_distance', 'id', postgresql_where=db.text('distance = 0')),
+        db.Index('ix_route_vehicle_date', 'vehicle_id', 'date'),
+        db.Index('ix_route_locations', 'start_location', 'end_location'),
+        {'postgresql_partition_by': 'RANGE (date)'},
+    )
+    __mapper_args__ = {'primary_key': [id]}
+
     vehicle = db.relationship('Vehicle', back_populates='routes')
     driver = db.relationship('Driver', back_populates='routes')
 
@@ -0,0 +1,52 @@
+from app import db
+
+class TelemetryFix(db.Model):
+    """Append-only GPS fixes, written in bulk by routes/telemetry.py via COPY.
+
+    vehicle_id is validated on ingest instead of by a foreign key, so bulk
+    writes do not pay for a lookup per row. The table is range-partitioned by
+    month on `recorded_at`; old months are downsampled into TelemetryRollup
+    and dropped by `flask partitions maintain`.
+    """
+
+    __tablename__ = 'telemetry_fix'
+
+    id = db.Column(db.BigInteger, primary_key=True, autoincrement=True)
+    vehicle_id = db.Column(db.Integer, nullable=False)
+    recorded_at = db.Column(db.DateTime, primary_key=True, nullable=False)
+    lat = db.Column(db.Float, nullable=False)
+    lon = db.Column(db.Float, nullable=False)
+    speed_kmh = db.Column(db.REAL, nullable=True)
+    odometer_km = db.Column(db.Float, nullable=True)
+    received_at = db.Column(
+        db.DateTime, nullable=False, server_default=db.text("(now() at time zone 'utc')")
+    )
+
+    __table_args__ = (
+        db.Index('ix_telemetry_fix_vehicle_time', 'vehicle_id', 'recorded_at'),
+        db.Index('ix_telemetry_fix_recorded_brin', 'recorded_at', postgresql_using='brin'),
+        {'postgresql_partition_by': 'RANGE (recorded_at)'},
+    )
+    __mapper_args__ = {'primary_key': [id]}
+
+    def __repr__(self):
+        return f"<TelemetryFix vehicle={self.vehicle_id} {self.recorded_at}>"
+
+
+class TelemetryRollup(db.Model):
+    """Telemetry downsampled to fixed buckets per vehicle, kept after raw fixes expire."""
+
+    __tablename__ = 'telemetry_rollup'
+
+    vehicle_id = db.Column(db.Integer, primary_key=True)
+    bucket_start = db.Column(db.DateTime, primary_key=True)
+    fixes = db.Column(db.Integer, nullable=False)
+    lat = db.Column(db.Float, nullable=False)
+    lon = db.Column(db.Float, nullable=False)
+    speed_avg = db.Column(db.REAL, nullable=True)
+    speed_max = db.Column(db.REAL, nullable=True)
+    odometer_min = db.Column(db.Float, nullable=True)
+    odometer_max = db.Column(db.Float, nullable=True)
+
+    def __repr__(self):
+        return f"<TelemetryRollup vehicle={self.vehicle_id} {self.bucket_start}>"
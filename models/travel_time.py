@@ -0,0 +1,25 @@
+from app import db
+
+class TravelTimeStat(db.Model):
+    """Running travel-time statistics of an origin/destination pair in a time slot.
+
+    Coordinates are integers in 1e-3 degree units (~100 m). `slot` is
+    weekday * 24 + hour (UTC) for observed trips, -1 for the router's answer.
+    Durations are kept as exponentially decayed weighted mean and sum of
+    squared deviations of log seconds (services/eta.py).
+    """
+
+    __tablename__ = 'travel_time_stat'
+
+    from_lat = db.Column(db.Integer, primary_key=True)
+    from_lon = db.Column(db.Integer, primary_key=True)
+    to_lat = db.Column(db.Integer, primary_key=True)
+    to_lon = db.Column(db.Integer, primary_key=True)
+    slot = db.Column(db.SmallInteger, primary_key=True)
+    weight = db.Column(db.REAL, nullable=False)
+    mean_log = db.Column(db.REAL, nullable=False)
+    m2_log = db.Column(db.REAL, nullable=False)
+    updated_at = db.Column(db.DateTime, nullable=False)
+
+    def __repr__(self):
+        return f"<TravelTimeStat ({self.from_lat},{self.from_lon})->({self.to_lat},{self.to_lon}) slot {self.slot}>"
@@ -0,0 +1,51 @@
+from datetime import datetime
+from app import db
+
+class Trip(db.Model):
+    """A driven trip detected in telemetry by services/trips.py."""
+
+    __tablename__ = 'trip'
+
+    id = db.Column(db.BigInteger, primary_key=True)
+    vehicle_id = db.Column(db.Integer, db.ForeignKey('vehicle.id', ondelete='CASCADE'), nullable=False)
+    # Planned route this trip fulfils. No foreign key: `route` is partitioned
+    # and its key is (id, date).
+    route_id = db.Column(db.Integer, nullable=True)
+
+    started_at = db.Column(db.DateTime, nullable=False)
+    ended_at = db.Column(db.DateTime, nullable=False)
+    start_lat = db.Column(db.Float, nullable=False)
+    start_lon = db.Column(db.Float, nullable=False)
+    end_lat = db.Column(db.Float, nullable=False)
+    end_lon = db.Column(db.Float, nullable=False)
+
+    distance_km = db.Column(db.Float, nullable=False)
+    # time spent below walking speed while on the trip (traffic, short stops)
+    idle_seconds = db.Column(db.Integer, nullable=False, default=0)
+    max_speed_kmh = db.Column(db.REAL, nullable=True)
+    fixes = db.Column(db.Integer, nullable=False)
+
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        db.Index('ix_trip_vehicle_started', 'vehicle_id', 'started_at'),
+        db.Index('ix_trip_route', 'route_id', postgresql_where=db.text('route_id IS NOT NULL')),
+    )
+
+    def __repr__(self):
+        return f"<Trip vehicle={self.vehicle_id} {self.started_at} {self.distance_km} km>"
+
+
+class TripState(db.Model):
+    """Per-vehicle position of the trip segmenter in the telemetry stream."""
+
+    __tablename__ = 'trip_state'
+
+    vehicle_id = db.Column(db.Integer, db.ForeignKey('vehicle.id', ondelete='CASCADE'), primary_key=True)
+    # fixes up to this time are processed
+    cursor = db.Column(db.DateTime, nullable=False)
+    state = db.Column(db.JSON, nullable=False)
+    updated_at = db.Column(db.DateTime, nullable=False)
+
+    def __repr__(self):
+        return f"<TripState vehicle={self.vehicle_id} {self.cursor}>"
@@ -11,6 +11,10 @@ class Vehicle(db.Model):
 
     driver_id = db.Column(db.Integer, db.ForeignKey('driver.id'), nullable=True)
 
+    # service is due after this many km or days since the last one (services/service_due.py)
+    service_interval_km = db.Column(db.Integer, nullable=False, default=10000, server_default='10000')
+    service_interval_days = db.Column(db.Integer, nullable=False, default=120, server_default='120')
+
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
@@ -19,5 +23,9 @@ class Vehicle(db.Model):
     maintenances = db.relationship('Maintenance', back_populates='vehicle')
     routes = db.relationship('Route', back_populates='vehicle')
 
+    __table_args__ = (
+        db.Index('ix_vehicle_driver_created', 'driver_id', 'created_at'),
+    )
+
     def __repr__(self):
         return f"<Vehicle {self.reg_number}>"
@@ -0,0 +1,27 @@
+from app import db
+
+class VehicleDailyDistance(db.Model):
+    """Kilometres actually driven per vehicle and fleet-local day (FLEET_TIMEZONE,
+    as route.date), from GPS tracks.
+
+    Written by `flask mileage compute` (services/mileage.py); outlives the raw
+    telemetry partitions.
+    """
+
+    __tablename__ = 'vehicle_daily_distance'
+
+    vehicle_id = db.Column(db.Integer, db.ForeignKey('vehicle.id', ondelete='CASCADE'), primary_key=True)
+    day = db.Column(db.Date, primary_key=True)
+    distance_km = db.Column(db.Float, nullable=False)
+    fixes = db.Column(db.Integer, nullable=False)
+    # fixes dropped as GPS jumps
+    rejected_fixes = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, nullable=False)
+
+    __table_args__ = (
+        # covering index for km-since-date sums (services/service_due.py)
+        db.Index('ix_vehicle_daily_distance_km', 'vehicle_id', 'day', postgresql_include=['distance_km']),
+    )
+
+    def __repr__(self):
+        return f"<VehicleDailyDistance vehicle={self.vehicle_id} {self.day} {self.distance_km} km>"
@@ -0,0 +1,22 @@
+from app import db
+
+class VehiclePosition(db.Model):
+    """Latest known position per vehicle, maintained by services/live.py.
+
+    UNLOGGED: the table is rebuilt from incoming telemetry anyway, so it skips
+    the WAL and is simply empty after a crash.
+    """
+
+    __tablename__ = 'vehicle_position'
+
+    vehicle_id = db.Column(db.Integer, db.ForeignKey('vehicle.id', ondelete='CASCADE'), primary_key=True)
+    recorded_at = db.Column(db.DateTime, nullable=False)
+    lat = db.Column(db.Float, nullable=False)
+    lon = db.Column(db.Float, nullable=False)
+    speed_kmh = db.Column(db.REAL, nullable=True)
+    updated_at = db.Column(db.DateTime, nullable=False)
+
+    __table_args__ = {'prefixes': ['UNLOGGED']}
+
+    def __repr__(self):
+        return f"<VehiclePosition vehicle={self.vehicle_id} {self.recorded_at}>"
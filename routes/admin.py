@@ -1,3 +1,5 @@
+import math
+
 from flask import Blueprint, jsonify, request
 from sqlalchemy import or_
 from app import db
@@ -6,51 +8,55 @@ from models.driver import Driver
 from models.vehicle import Vehicle
 from models.maintenance import Maintenance
 from models.route import Route
-from datetime import datetime, date
+from models.trip import Trip
+from models.geofence import Geofence, GeofenceEvent
+from models.fuel_anomaly import FuelAnomaly
+from models.job import Job
+from datetime import datetime, date, timedelta
 from routes.auth import role_required
+from services.database import read_only
+from services.geofences import bounding_box, circle_polygon, fences
+from services.live import publish_route_change
+from services.maps import clean_stops, geocode_address
+from services.nearby import locator
+from services.route_enrichment import enqueue_route_resolution, reset_preview
+from services.jobs import enqueue
+from services.route_planner import OPTIMIZE_JOB
+from services.schemas import DRIVERS, MAINTENANCE, ROUTES, USERS, VEHICLES, json_response
+from services.service_due import service_due
 
 
 admin_bp = Blueprint('admin', __name__)
 
+# Nearest-vehicle search gives up beyond this distance.
+NEARBY_MAX_RADIUS_KM = 200.0
+# Route requests accepted by /routes/optimize and its time budget bounds, s.
+OPTIMIZE_MAX_REQUESTS = 1000
+OPTIMIZE_DEFAULT_BUDGET = 2.0
+OPTIMIZE_MAX_BUDGET = 10.0
+# Page size bound of /service-due.
+SERVICE_DUE_MAX_LIMIT = 500
+# Default period and row bound of /fuel-anomalies.
+FUEL_ANOMALY_DEFAULT_DAYS = 30
+FUEL_ANOMALY_MAX_LIMIT = 500
+FUEL_ANOMALY_KINDS = {'high_consumption', 'low_consumption', 'odometer'}
+
+USER_ITEM = USERS.only('id', 'username', 'role', 'created_at', 'driver', 'vehicles')
+VEHICLE_ITEM = VEHICLES.only('id', 'brand', 'model', 'reg_number', 'driver')
+DRIVER_ITEM = DRIVERS.only('id', 'first_name', 'last_name', 'license_number', 'vehicle')
+MAINTENANCE_ITEM = MAINTENANCE.only('id', 'type_of_work', 'cost', 'created_at', 'vehicle')
+ROUTE_ITEM = ROUTES.only(
+    'id', 'start_location', 'end_location', 'stops', 'optimize_stops', 'date', 'distance', 'duration', 'status',
+    'started_at', 'completed_at', 'map_url', 'start_point', 'end_point', 'driver', 'vehicle',
+)
+
 
 def _validate_role(role: str) -> bool:
     return role in {'admin', 'manager', 'driver'}
 
 
-def _serialize_route(route: Route):
-    if not route:
-        return None
-
-    driver = route.driver
-    vehicle = route.vehicle
-
-    return {
-        'id': route.id,
-        'start_location': route.start_location,
-        'end_location': route.end_location,
-        'date': route.date.isoformat() if route.date else None,
-        'distance': route.distance,
-        'driver': (
-            {
-                'id': driver.id,
-                'first_name': driver.first_name,
-                'last_name': driver.last_name,
-                'license_number': driver.license_number,
-            }
-            if driver
-            else None
-        ),
-        'vehicle': (
-            {
-                'id': vehicle.id,
-                'brand': vehicle.brand,
-                'model': vehicle.model,
-                'reg_number': vehicle.reg_number,
-            }
-            if vehicle
-            else None
-        ),
-    }
+def _route_item(route: Route, driver: Driver, vehicle: Vehicle):
+    return ROUTE_ITEM.dump_objects(route, driver, vehicle)
 
 
 @admin_bp.route('/users', methods=['POST'])
@@ -152,6 +158,9 @@ def create_vehicle():
         return jsonify({'message': 'ТС с таким госномером уже существует.'}), 409
 
     vehicle = Vehicle(brand=brand, model=model, reg_number=reg_number)
+    error = _apply_service_intervals(vehicle, payload)
+    if error:
+        return jsonify({'message': error}), 400
 
     if driver_id:
         driver = Driver.query.get(driver_id)
@@ -172,12 +181,62 @@ def create_vehicle():
         'model': vehicle.model,
         'reg_number': vehicle.reg_number,
         'driver_id': vehicle.driver_id,
+        'service_interval_km': vehicle.service_interval_km,
+        'service_interval_days': vehicle.service_interval_days,
     }
     return jsonify(response), 201
 
 
+def _apply_service_intervals(vehicle: Vehicle, payload: dict):
+    """Set the intervals present in the payload; returns an error message or None."""
+
+    for field, label in (('service_interval_km', 'км'), ('service_interval_days', 'дней')):
+        if payload.get(field) is None:
+            continue
+        try:
+            value = int(payload[field])
+        except (TypeError, ValueError):
+            return f'Интервал ТО ({label}) должен быть целым числом.'
+        if value <= 0:
+            return f'Интервал ТО ({label}) должен быть больше нуля.'
+        setattr(vehicle, field, value)
+    return None
+
+
+@admin_bp.route('/vehicles/<int:vehicle_id>/service-interval', methods=['PUT'])
+@role_required('admin', 'manager')
+def update_service_interval(vehicle_id: int):
+    vehicle = Vehicle.query.get(vehicle_id)
+    if not vehicle:
+        return jsonify({'message': 'ТС не найдено.'}), 404
+
+    error = _apply_service_intervals(vehicle, request.get_json() or {})
+    if error:
+        return jsonify({'message': error}), 400
+    db.session.commit()
+
+    return jsonify({
+        'id': vehicle.id,
+        'service_interval_km': vehicle.service_interval_km,
+        'service_interval_days': vehicle.service_interval_days,
+    }), 200
+
+
+@admin_bp.route('/service-due', methods=['GET'])
+@role_required('admin', 'manager')
+@read_only
+def list_service_due():
+    limit = max(1, min(request.args.get('limit', 20, type=int), SERVICE_DUE_MAX_LIMIT))
+    try:
+        items, next_cursor = service_due(limit, request.args.get('cursor') or None)
+    except ValueError:
+        return jsonify({'message': 'Некорректный cursor.'}), 400
+    return jsonify({'items': items, 'limit': limit, 'next_cursor': next_cursor}), 200
+
+
 @admin_bp.route('/users', methods=['GET'])
 @role_required('admin')
+@read_only
 def list_users():
     search_query = (request.args.get('query') or '').strip()
     limit_param = request.args.get('limit', type=int)
@@ -186,11 +245,11 @@ def list_users():
     limit = limit_param if limit_param is not None else (20 if search_query else 5)
     limit = max(1, min(limit, 100))  # простая защита от слишком больших выборок
 
-    query = User.query.outerjoin(Driver).order_by(User.created_at.desc())
+    query = USER_ITEM.select().order_by(User.created_at.desc())
 
     if search_query:
         pattern = f"%{search_query}%"
-        query = query.filter(
+        query = query.where(
             or_(
                 User.username.ilike(pattern),
                 Driver.first_name.ilike(pattern),
@@ -199,36 +258,13 @@ def list_users():
             )
         )
 
-    users = query.limit(limit).all()
-
-    result = []
-    for user in users:
-        driver = user.driver
-        driver_vehicles = driver.vehicles if driver else []
-        result.append(
-            {
-                'id': user.id,
-                'username': user.username,
-                'role': user.role,
-                'created_at': user.created_at.isoformat() if user.created_at else None,
-                'driver': (
-                    {
-                        'first_name': driver.first_name,
-                        'last_name': driver.last_name,
-                        'license_number': driver.license_number,
-                    }
-                    if driver
-                    else None
-                ),
-                'vehicles': [vehicle.reg_number for vehicle in driver_vehicles],
-            }
-        )
-
-    return jsonify({'items': result, 'limit': limit, 'query': search_query}), 200
+    items = USER_ITEM.all(query.limit(limit))
+    return json_response({'items': items, 'limit': limit, 'query': search_query})
 
 
 @admin_bp.route('/vehicles', methods=['GET'])
 @role_required('admin')
+@read_only
 def list_vehicles():
     search_query = (request.args.get('query') or '').strip()
     limit_param = request.args.get('limit', type=int)
@@ -236,11 +272,11 @@ def list_vehicles():
     limit = limit_param if limit_param is not None else (20 if search_query else 5)
     limit = max(1, min(limit, 100))
 
-    query = Vehicle.query.outerjoin(Driver).order_by(Vehicle.created_at.desc())
+    query = VEHICLE_ITEM.select().order_by(Vehicle.created_at.desc())
 
     if search_query:
         pattern = f"%{search_query}%"
-        query = query.filter(
+        query = query.where(
             or_(
                 Vehicle.reg_number.ilike(pattern),
                 Vehicle.brand.ilike(pattern),
@@ -250,22 +286,82 @@ def list_vehicles():
             )
         )
 
-    vehicles = query.limit(limit).all()
+    items = VEHICLE_ITEM.all(query.limit(limit))
+    return json_response({'items': items, 'limit': limit, 'query': search_query})
 
-    result = []
-    for vehicle in vehicles:
+
+@admin_bp.route('/vehicles/nearby', methods=['GET'])
+@role_required('admin', 'manager')
+def nearby_vehicles():
+    """Vehicles nearest to an address or point, or all within `radius_km` of it."""
+
+    address = (request.args.get('address') or '').strip()
+    lat = request.args.get('lat', type=float)
+    lon = request.args.get('lon', type=float)
+    radius_km = request.args.get('radius_km', type=float)
+    limit = max(1, min(request.args.get('limit', 5, type=int), 100))
+    max_age_minutes = request.args.get('max_age_minutes', 30, type=int)
+    free_only = request.args.get('free_only', '0') in ('1', 'true')
+
+    if address:
+        coords = geocode_address(address)
+        if not coords:
+            return jsonify({'message': 'Не удалось определить координаты по адресу.'}), 404
+        lon, lat = coords
+    elif lat is None or lon is None:
+        return jsonify({'message': 'Укажите адрес или координаты lat и lon.'}), 400
+
+    if not (-90 <= lat <= 90 and -180 <= lon <= 180):
+        return jsonify({'message': 'Некорректные координаты.'}), 400
+    if radius_km is not None and not (0 < radius_km <= 500):
+        return jsonify({'message': 'Радиус должен быть от 0 до 500 км.'}), 400
+
+    max_age = timedelta(minutes=max_age_minutes) if max_age_minutes > 0 else None
+    busy = set()
+    if free_only:
+        busy = {
+            vehicle_id
+            for (vehicle_id,) in db.session.query(Route.vehicle_id).filter(Route.date == date.today()).distinct()
+        }
+
+    if radius_km is not None:
+        found = [
+            item for item in locator.within(lat, lon, radius_km, max_age=max_age)
+            if item[1] not in busy
+        ][:limit]
+    else:
+        found = locator.nearest(lat, lon, limit, NEARBY_MAX_RADIUS_KM, max_age=max_age, exclude=busy)
+
+    vehicles = {
+        vehicle.id: vehicle
+        for vehicle in Vehicle.query.filter(Vehicle.id.in_([item[1] for item in found])).all()
+    }
+
+    items = []
+    for distance, vehicle_id, vehicle_lat, vehicle_lon, recorded_at in found:
+        vehicle = vehicles.get(vehicle_id)
+        if not vehicle:
+            continue
         driver = vehicle.driver
-        result.append(
+        items.append(
             {
-                'id': vehicle.id,
-                'brand': vehicle.brand,
-                'model': vehicle.model,
-                'reg_number': vehicle.reg_number,
+                'distance_km': round(distance, 3),
+                'position': {
+                    'lat': vehicle_lat,
+                    'lon': vehicle_lon,
+                    'recorded_at': recorded_at.isoformat() + 'Z',
+                },
+                'vehicle': {
+                    'id': vehicle.id,
+                    'brand': vehicle.brand,
+                    'model': vehicle.model,
+                    'reg_number': vehicle.reg_number,
+                },
                 'driver': (
                     {
+                        'id': driver.id,
                         'first_name': driver.first_name,
                         'last_name': driver.last_name,
-                        'license_number': driver.license_number,
                     }
                     if driver
                     else None
@@ -273,7 +369,255 @@ def list_vehicles():
             }
         )
 
-    return jsonify({'items': result, 'limit': limit, 'query': search_query}), 200
+    return jsonify({
+        'origin': {'lat': lat, 'lon': lon, 'address': address or None},
+        'radius_km': radius_km,
+        'items': items,
+    }), 200
+
+
+@admin_bp.route('/trips', methods=['GET'])
+@role_required('admin', 'manager')
+@read_only
+def list_trips():
+    """Detected trips of a day with the stop before each and the planned route they fulfil."""
+
+    day_param = request.args.get('date')
+    vehicle_id = request.args.get('vehicle_id', type=int)
+    try:
+        day = datetime.strptime(day_param, '%Y-%m-%d').date() if day_param else date.today()
+    except ValueError:
+        return jsonify({'message': 'Некорректная дата, ожидается ГГГГ-ММ-ДД.'}), 400
+
+    start = datetime.combine(day, datetime.min.time())
+    query = Trip.query.filter(Trip.started_at >= start, Trip.started_at < start + timedelta(days=1))
+    if vehicle_id:
+        query = query.filter(Trip.vehicle_id == vehicle_id)
+    trips = query.order_by(Trip.vehicle_id, Trip.started_at).all()
+
+    route_ids = {trip.route_id for trip in trips if trip.route_id}
+    routes = {route.id: route for route in Route.query.filter(Route.id.in_(route_ids)).all()} if route_ids else {}
+
+    items = []
+    previous = None
+    for trip in trips:
+        stop_seconds = None
+        if previous is not None and previous.vehicle_id == trip.vehicle_id:
+            stop_seconds = int((trip.started_at - previous.ended_at).total_seconds())
+        previous = trip
+        route = routes.get(trip.route_id)
+        items.append(
+            {
+                'id': trip.id,
+                'vehicle_id': trip.vehicle_id,
+                'started_at': trip.started_at.isoformat() + 'Z',
+                'ended_at': trip.ended_at.isoformat() + 'Z',
+                'start': {'lat': trip.start_lat, 'lon': trip.start_lon},
+                'end': {'lat': trip.end_lat, 'lon': trip.end_lon},
+                'distance_km': trip.distance_km,
+                'duration_minutes': round((trip.ended_at - trip.started_at).total_seconds() / 60, 1),
+                'idle_minutes': round(trip.idle_seconds / 60, 1),
+                'max_speed_kmh': trip.max_speed_kmh,
+                'stop_before_minutes': round(stop_seconds / 60, 1) if stop_seconds is not None else None,
+                'route': (
+                    {
+                        'id': route.id,
+                        'start_location': route.start_location,
+                        'end_location': route.end_location,
+                        'planned_distance': route.distance,
+                        'planned_duration': route.duration,
+                    }
+                    if route
+                    else None
+                ),
+            }
+        )
+
+    return jsonify({'date': day.isoformat(), 'items': items}), 200
+
+
+def _serialize_geofence(fence: Geofence):
+    return {
+        'id': fence.id,
+        'name': fence.name,
+        'kind': fence.kind,
+        'polygon': fence.polygon,
+    }
+
+
+def _parse_polygon(data):
+    """[[lon, lat], ...] from `polygon` or a circle from `center` and `radius_m`; None if invalid."""
+
+    if data.get('center') is not None:
+        center = data.get('center') or {}
+        try:
+            lat, lon, radius_m = float(center['lat']), float(center['lon']), float(data.get('radius_m'))
+        except (KeyError, TypeError, ValueError):
+            return None
+        if not (-90 <= lat <= 90 and -180 <= lon <= 180 and 0 < radius_m <= 50000):
+            return None
+        return circle_polygon(lat, lon, radius_m)
+
+    polygon = data.get('polygon')
+    if not isinstance(polygon, list) or not 3 <= len(polygon) <= 1000:
+        return None
+    points = []
+    for point in polygon:
+        try:
+            lon, lat = float(point[0]), float(point[1])
+        except (IndexError, TypeError, ValueError):
+            return None
+        if not (-90 <= lat <= 90 and -180 <= lon <= 180):
+            return None
+        points.append([lon, lat])
+    if points[0] == points[-1]:
+        points.pop()
+    return points if len(points) >= 3 else None
+
+
+@admin_bp.route('/geofences', methods=['GET'])
+@role_required('admin', 'manager')
+@read_only
+def list_geofences():
+    items = Geofence.query.order_by(Geofence.kind, Geofence.name).all()
+    return jsonify({'items': [_serialize_geofence(fence) for fence in items]}), 200
+
+
+@admin_bp.route('/geofences', methods=['POST'])
+@role_required('admin', 'manager')
+def create_geofence():
+    data = request.get_json() or {}
+    name = (data.get('name') or '').strip()
+    kind = data.get('kind') or 'site'
+
+    if not name:
+        return jsonify({'message': 'Укажите название зоны.'}), 400
+    if kind not in ('depot', 'site'):
+        return jsonify({'message': 'Тип зоны: depot или site.'}), 400
+    polygon = _parse_polygon(data)
+    if polygon is None:
+        return jsonify({'message': 'Укажите polygon [[lon, lat], ...] не менее чем из 3 точек или center и radius_m.'}), 400
+
+    fence = Geofence(name=name[:100], kind=kind, polygon=polygon, **bounding_box(polygon))
+    try:
+        db.session.add(fence)
+        db.session.commit()
+    except Exception:  # pragma: no cover - простая обработка ошибок для demo
+        db.session.rollback()
+        return jsonify({'message': 'Не удалось сохранить зону.'}), 500
+
+    fences.invalidate()
+    return jsonify({'message': 'Зона создана.', 'geofence': _serialize_geofence(fence)}), 201
+
+
+@admin_bp.route('/geofences/<int:geofence_id>', methods=['DELETE'])
+@role_required('admin', 'manager')
+def delete_geofence(geofence_id: int):
+    fence = Geofence.query.get(geofence_id)
+    if not fence:
+        return jsonify({'message': 'Зона не найдена.'}), 404
+
+    try:
+        db.session.delete(fence)
+        db.session.commit()
+    except Exception:  # pragma: no cover - простая обработка ошибок для demo
+        db.session.rollback()
+        return jsonify({'message': 'Не удалось удалить зону.'}), 500
+
+    fences.invalidate()
+    return jsonify({'message': 'Зона удалена.'}), 200
+
+
+@admin_bp.route('/geofences/events', methods=['GET'])
+@role_required('admin', 'manager')
+@read_only
+def list_geofence_events():
+    day_param = request.args.get('date')
+    vehicle_id = request.args.get('vehicle_id', type=int)
+    geofence_id = request.args.get('geofence_id', type=int)
+    try:
+        day = datetime.strptime(day_param, '%Y-%m-%d').date() if day_param else date.today()
+    except ValueError:
+        return jsonify({'message': 'Некорректная дата, ожидается ГГГГ-ММ-ДД.'}), 400
+
+    start = datetime.combine(day, datetime.min.time())
+    query = (
+        db.session.query(GeofenceEvent, Geofence.name)
+        .outerjoin(Geofence, Geofence.id == GeofenceEvent.geofence_id)
+        .filter(GeofenceEvent.recorded_at >= start, GeofenceEvent.recorded_at < start + timedelta(days=1))
+    )
+    if vehicle_id:
+        query = query.filter(GeofenceEvent.vehicle_id == vehicle_id)
+    if geofence_id:
+        query = query.filter(GeofenceEvent.geofence_id == geofence_id)
+    rows = query.order_by(GeofenceEvent.recorded_at, GeofenceEvent.id).limit(5000).all()
+
+    return jsonify({
+        'date': day.isoformat(),
+        'items': [
+            {
+                'vehicle_id': event.vehicle_id,
+                'geofence_id': event.geofence_id,
+                'geofence_name': name,
+                'event': 'enter' if event.entered else 'exit',
+                'recorded_at': event.recorded_at.isoformat() + 'Z',
+            }
+            for event, name in rows
+        ],
+    }), 200
+
+
+@admin_bp.route('/fuel-anomalies', methods=['GET'])
+@role_required('admin', 'manager')
+@read_only
+def list_fuel_anomalies():
+    vehicle_id = request.args.get('vehicle_id', type=int)
+    kind = request.args.get('kind')
+    limit = max(1, min(request.args.get('limit', 100, type=int), FUEL_ANOMALY_MAX_LIMIT))
+    try:
+        date_to = datetime.strptime(request.args['to'], '%Y-%m-%d').date() if request.args.get('to') else date.today()
+        date_from = (
+            datetime.strptime(request.args['from'], '%Y-%m-%d').date()
+            if request.args.get('from')
+            else date_to - timedelta(days=FUEL_ANOMALY_DEFAULT_DAYS)
+        )
+    except ValueError:
+        return jsonify({'message': 'Некорректная дата, ожидается ГГГГ-ММ-ДД.'}), 400
+    if kind and kind not in FUEL_ANOMALY_KINDS:
+        return jsonify({'message': 'Некорректный тип аномалии.'}), 400
+
+    query = (
+        db.session.query(FuelAnomaly, Vehicle.reg_number)
+        .join(Vehicle, Vehicle.id == FuelAnomaly.vehicle_id)
+        .filter(FuelAnomaly.event_date >= date_from, FuelAnomaly.event_date <= date_to)
+    )
+    if vehicle_id:
+        query = query.filter(FuelAnomaly.vehicle_id == vehicle_id)
+    if kind:
+        query = query.filter(FuelAnomaly.kind == kind)
+    rows = query.order_by(FuelAnomaly.event_date.desc(), FuelAnomaly.id.desc()).limit(limit).all()
+
+    return jsonify({
+        'from': date_from.isoformat(),
+        'to': date_to.isoformat(),
+        'items': [
+            {
+                'id': anomaly.id,
+                'maintenance_id': anomaly.maintenance_id,
+                'vehicle_id': anomaly.vehicle_id,
+                'vehicle_reg_number': reg_number,
+                'date': anomaly.event_date.isoformat(),
+                'kind': anomaly.kind,
+                'consumption_l_100km': anomaly.consumption_l_100km,
+                'expected_l_100km': anomaly.expected_l_100km,
+                'score': anomaly.score,
+                'distance_km': anomaly.distance_km,
+                'fuel_volume_l': anomaly.fuel_volume_l,
+                'detected_at': anomaly.detected_at.isoformat() + 'Z',
+            }
+            for anomaly, reg_number in rows
+        ],
+    }), 200
 
 
 @admin_bp.route('/users/<int:user_id>', methods=['DELETE'])
@@ -389,6 +733,7 @@ def create_maintenance():
 
 @admin_bp.route('/maintenance', methods=['GET'])
 @role_required('admin')
+@read_only
 def list_maintenance():
     search_query = (request.args.get('query') or '').strip()
     limit_param = request.args.get('limit', type=int)
@@ -396,11 +741,11 @@ def list_maintenance():
     limit = limit_param if limit_param is not None else (20 if search_query else 5)
     limit = max(1, min(limit, 100))
 
-    query = Maintenance.query.join(Vehicle).order_by(Maintenance.created_at.desc())
+    query = MAINTENANCE_ITEM.select(inner=True).order_by(Maintenance.created_at.desc())
 
     if search_query:
         pattern = f"%{search_query}%"
-        query = query.filter(
+        query = query.where(
             or_(
                 Maintenance.type_of_work.ilike(pattern),
                 Vehicle.reg_number.ilike(pattern),
@@ -409,72 +754,21 @@ def list_maintenance():
             )
         )
 
-    items = query.limit(limit).all()
-
-    result = []
-    for record in items:
-        vehicle = record.vehicle
-        result.append(
-            {
-                'id': record.id,
-                'type_of_work': record.type_of_work,
-                'cost': record.cost,
-                'created_at': record.created_at.isoformat() if record.created_at else None,
-                'vehicle': (
-                    {
-                        'id': vehicle.id,
-                        'brand': vehicle.brand,
-                        'model': vehicle.model,
-                        'reg_number': vehicle.reg_number,
-                    }
-                    if vehicle
-                    else None
-                ),
-            }
-        )
-
-    return jsonify({'items': result, 'limit': limit, 'query': search_query}), 200
+    items = MAINTENANCE_ITEM.all(query.limit(limit))
+    return json_response({'items': items, 'limit': limit, 'query': search_query})
 
 
 @admin_bp.route('/drivers', methods=['GET'])
 @role_required('admin', 'manager')
+@read_only
 def list_drivers():
-    drivers = (
-        Driver.query.order_by(Driver.last_name.asc(), Driver.first_name.asc())
-        .all()
-    )
-
-    items = []
-    for driver in drivers:
-        vehicle = (
-            Vehicle.query.filter_by(driver_id=driver.id)
-            .order_by(Vehicle.created_at.desc())
-            .first()
-        )
-        items.append(
-            {
-                'id': driver.id,
-                'first_name': driver.first_name,
-                'last_name': driver.last_name,
-                'license_number': driver.license_number,
-                'vehicle': (
-                    {
-                        'id': vehicle.id,
-                        'brand': vehicle.brand,
-                        'model': vehicle.model,
-                        'reg_number': vehicle.reg_number,
-                    }
-                    if vehicle
-                    else None
-                ),
-            }
-        )
-
-    return jsonify({'items': items}), 200
+    items = DRIVER_ITEM.all(DRIVER_ITEM.select().order_by(Driver.last_name.asc(), Driver.first_name.asc()))
+    return json_response({'items': items})
 
 
 @admin_bp.route('/routes', methods=['GET'])
 @role_required('admin', 'manager')
+@read_only
 def list_routes():
     search_query = (request.args.get('query') or '').strip()
     limit_param = request.args.get('limit', type=int)
@@ -483,14 +777,14 @@ def list_routes():
 
     today_date = date.today()
     query = (
-        Route.query.join(Driver).join(Vehicle)
-        .filter(Route.date >= today_date)
+        ROUTE_ITEM.select(inner=True)
+        .where(Route.date >= today_date)
         .order_by(Route.date.asc(), Route.id.desc())
     )
 
     if search_query:
         pattern = f"%{search_query}%"
-        query = query.filter(
+        query = query.where(
             or_(
                 Route.start_location.ilike(pattern),
                 Route.end_location.ilike(pattern),
@@ -500,8 +794,7 @@ def list_routes():
             )
         )
 
-    routes = query.limit(limit).all()
-    return jsonify({'items': [_serialize_route(r) for r in routes], 'limit': limit}), 200
+    return json_response({'items': ROUTE_ITEM.all(query.limit(limit)), 'limit': limit})
 
 
 @admin_bp.route('/routes', methods=['POST'])
@@ -540,9 +833,16 @@ def create_route():
     if not vehicle:
         return jsonify({'message': 'За водителем не закреплено транспортное средство.'}), 400
 
+    try:
+        stops = clean_stops(payload.get('stops'))
+    except ValueError as exc:
+        return jsonify({'message': str(exc)}), 400
+
     new_route = Route(
         start_location=start_location,
         end_location=end_location,
+        stops=stops,
+        optimize_stops=bool(payload.get('optimize_stops')),
         date=route_date,
         distance=float(payload.get('distance') or 0) if payload.get('distance') is not None else 0,
         driver_id=driver.id,
@@ -550,9 +850,142 @@ def create_route():
     )
 
     db.session.add(new_route)
+    db.session.flush()
+    enqueue_route_resolution(new_route.id, priority=5)
+    publish_route_change(new_route, 'created')
+    item = _route_item(new_route, driver, vehicle)
     db.session.commit()
 
-    return jsonify({'route': _serialize_route(new_route), 'message': 'Маршрут создан.'}), 201
+    return json_response({'route': item, 'message': 'Маршрут создан.'}, 201)
+
+
+def _payload_point(value):
+    """(lat, lon) of an optional {lat, lon} point; ValueError when it is malformed."""
+
+    if value is None:
+        return None
+    if not isinstance(value, dict):
+        raise ValueError
+    try:
+        lat, lon = float(value['lat']), float(value['lon'])
+    except (KeyError, TypeError, ValueError):
+        raise ValueError from None
+    if not (-90 <= lat <= 90 and -180 <= lon <= 180):
+        raise ValueError
+    return lat, lon
+
+
+def _payload_distance(value) -> float:
+    """Planned km of an optional distance field; ValueError unless a number >= 0."""
+
+    if value is None or value == '':
+        return 0.0
+    if isinstance(value, bool):
+        raise ValueError
+    distance = float(value)
+    if not math.isfinite(distance) or distance < 0:
+        raise ValueError
+    return distance
+
+
+@admin_bp.route('/routes/optimize', methods=['POST'])
+@role_required('admin', 'manager')
+def optimize_routes():
+    """Queue the assignment of a day's route requests to drivers.
+
+    The plan is computed by a `routes.optimize` job (services/route_planner.py);
+    poll GET /routes/optimize/<job_id> for it. With `commit: true` the job also
+    creates the plan's routes.
+    """
+
+    payload = request.get_json(silent=True)
+    payload = payload if isinstance(payload, dict) else {}
+    try:
+        route_date = datetime.strptime(payload.get('date') or '', '%Y-%m-%d').date()
+    except (TypeError, ValueError):
+        return jsonify({'message': 'Укажите дату маршрутов в формате ГГГГ-ММ-ДД.'}), 400
+
+    items = payload.get('requests')
+    if not isinstance(items, list) or not items:
+        return jsonify({'message': 'Передайте непустой список requests.'}), 400
+    if len(items) > OPTIMIZE_MAX_REQUESTS:
+        return jsonify({'message': f'Не больше {OPTIMIZE_MAX_REQUESTS} заявок за запрос.'}), 400
+
+    route_requests = []
+    for index, item in enumerate(items):
+        item = item if isinstance(item, dict) else {}
+        start_location, end_location = item.get('start_location'), item.get('end_location')
+        if not isinstance(start_location, str) or not isinstance(end_location, str) \
+                or not start_location.strip() or not end_location.strip():
+            return jsonify({'message': f'Заявка {index}: укажите начальную и конечную точки.'}), 400
+        try:
+            start, end = _payload_point(item.get('start_point')), _payload_point(item.get('end_point'))
+        except ValueError:
+            return jsonify({'message': f'Заявка {index}: точка задаётся как {{lat, lon}} в градусах.'}), 400
+        try:
+            distance = _payload_distance(item.get('distance'))
+        except (TypeError, ValueError):
+            return jsonify({'message': f'Заявка {index}: distance должен быть неотрицательным числом.'}), 400
+        route_requests.append({
+            'index': index,
+            'start_location': start_location.strip()[:100],
+            'end_location': end_location.strip()[:100],
+            'start': start,
+            'end': end,
+            'distance': distance,
+        })
+
+    driver_ids = payload.get('driver_ids')
+    if driver_ids is not None and (
+        not isinstance(driver_ids, list)
+        or not all(isinstance(value, int) and not isinstance(value, bool) for value in driver_ids)
+    ):
+        return jsonify({'message': 'driver_ids должен быть списком идентификаторов.'}), 400
+
+    capacity = payload.get('max_routes_per_driver')
+    if capacity is not None and (not isinstance(capacity, int) or isinstance(capacity, bool) or capacity < 1):
+        return jsonify({'message': 'max_routes_per_driver должен быть положительным числом.'}), 400
+    try:
+        time_budget = float(payload.get('time_budget') or OPTIMIZE_DEFAULT_BUDGET)
+    except (TypeError, ValueError):
+        return jsonify({'message': 'Некорректный time_budget.'}), 400
+    if not math.isfinite(time_budget):
+        return jsonify({'message': 'Некорректный time_budget.'}), 400
+    time_budget = min(max(time_budget, 0.1), OPTIMIZE_MAX_BUDGET)
+
+    job_id = enqueue(
+        OPTIMIZE_JOB,
+        {
+            'date': route_date.isoformat(),
+            'requests': route_requests,
+            'driver_ids': driver_ids,
+            'max_routes_per_driver': capacity,
+            'time_budget': time_budget,
+            'commit': bool(payload.get('commit')),
+        },
+        priority=5,
+    )
+    db.session.commit()
+
+    response = jsonify({'job_id': job_id, 'status': 'queued'})
+    response.headers['Location'] = f'/admin/routes/optimize/{job_id}'
+    return response, 202
+
+
+@admin_bp.route('/routes/optimize/<int:job_id>', methods=['GET'])
+@role_required('admin', 'manager')
+def optimize_result(job_id: int):
+    """State of a `routes.optimize` job and, once done, its plan in `result`."""
+
+    job = db.session.get(Job, job_id)
+    if not job or job.job_type != OPTIMIZE_JOB:
+        return jsonify({'message': 'Задача не найдена.'}), 404
+    return jsonify({
+        'job_id': job.id,
+        'status': job.status,
+        'result': job.result if job.status == 'done' else None,
+        'error': job.last_error if job.status == 'dead' else None,
+    }), 200
 
 
 @admin_bp.route('/routes/<int:route_id>', methods=['PUT'])
@@ -595,8 +1028,21 @@ def update_route(route_id: int):
     if not vehicle:
         return jsonify({'message': 'За водителем не закреплено транспортное средство.'}), 400
 
+    try:
+        stops = clean_stops(payload['stops']) if 'stops' in payload else route.stops
+    except ValueError as exc:
+        return jsonify({'message': str(exc)}), 400
+    optimize_stops = bool(payload.get('optimize_stops', route.optimize_stops))
+
+    locations_changed = (
+        (route.start_location, route.end_location, route.stops, route.optimize_stops)
+        != (start_location, end_location, stops, optimize_stops)
+    )
+
     route.start_location = start_location
     route.end_location = end_location
+    route.stops = stops
+    route.optimize_stops = optimize_stops
     route.date = route_date
     route.driver_id = driver.id
     route.vehicle_id = vehicle.id
@@ -609,10 +1055,18 @@ def update_route(route_id: int):
         if distance_value < 0:
             return jsonify({'message': 'Длина маршрута не может быть отрицательной.'}), 400
         route.distance = distance_value
+    elif locations_changed:
+        route.distance = 0
+
+    if locations_changed:
+        reset_preview(route)
+        enqueue_route_resolution(route.id, priority=5)
 
+    publish_route_change(route, 'updated')
+    item = _route_item(route, driver, vehicle)
     db.session.commit()
 
-    return jsonify({'route': _serialize_route(route), 'message': 'Маршрут обновлён.'}), 200
+    return json_response({'route': item, 'message': 'Маршрут обновлён.'})
 
 
 @admin_bp.route('/routes/<int:route_id>', methods=['DELETE'])
@@ -623,6 +1077,8 @@ def delete_route(route_id: int):
         return jsonify({'message': 'Маршрут не найден.'}), 404
 
     try:
+        publish_route_change(route, 'deleted')
+        Trip.query.filter_by(route_id=route.id).update({'route_id': None}, synchronize_session=False)
         db.session.delete(route)
         db.session.commit()
     except Exception:  # pragma: no cover - простая обработка ошибок для demo
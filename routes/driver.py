@@ -1,50 +1,33 @@
 from datetime import date, datetime, timedelta
-import os
 
 from flask import Blueprint, jsonify, request
 from flask_jwt_extended import get_jwt_identity
-import requests
 
 from app import db
 from models.user import User
 from models.route import Route
 from models.vehicle import Vehicle
 from models.maintenance import Maintenance
+from models.vehicle_daily_distance import VehicleDailyDistance
 from routes.auth import role_required
+from services.database import read_only
+from services.eta import route_eta
+from services.fuel import enqueue_detection
+from services.maps import clean_stops, format_duration
+from services.route_enrichment import enqueue_route_resolution
+from services.schemas import ROUTES, json_response
+from services.service_due import vehicle_service_status
+from services.telemetry import fleet_today
 
 
 driver_bp = Blueprint('driver', __name__)
 
-
-MAP_PROXY_ENDPOINTS = [
-    os.environ.get('MAPS_PROXY_URL'),
-    'http://yandexmaps:8081/directions',
-    'http://localhost:8081/directions',
-]
-
-
-def _call_map_proxy(payload):
-    """Try contacting the maps proxy service with fallbacks."""
-
-    for endpoint in [ep for ep in MAP_PROXY_ENDPOINTS if ep]:
-        try:
-            response = requests.post(endpoint, json=payload, timeout=12)
-            response.raise_for_status()
-            return response.json()
-        except requests.RequestException:
-            continue
-    return None
-
-
-def _map_preview(start_location: str, end_location: str, waypoint: str = None, preference: str = None):
-    payload = {
-        'start': start_location,
-        'end': end_location,
-        'waypoint': waypoint,
-        'preference': preference,
-    }
-
-    return _call_map_proxy(payload)
+TODAY_ITEM = ROUTES.only('id', 'start_location', 'end_location', 'date', 'distance', 'vehicle_reg_number', 'status')
+ROUTE_ITEM = ROUTES.only(
+    'id', 'start_location', 'end_location', 'stops', 'optimize_stops', 'date', 'status', 'distance',
+    'vehicle_reg_number', 'map_url', 'distance_text', 'duration_text', 'start_point', 'end_point', 'waypoints',
+    'geometry',
+)
 
 
 def _get_current_driver():
@@ -60,6 +43,7 @@ def _get_current_driver():
 
 @driver_bp.route('/today', methods=['GET'])
 @role_required('driver')
+@read_only
 def today_routes():
     driver = _get_current_driver()
     if not driver:
@@ -67,29 +51,13 @@ def today_routes():
 
     today_date = date.today()
 
-    routes = (
-        Route.query.join(Vehicle, Route.vehicle_id == Vehicle.id)
-        .filter(Route.driver_id == driver.id, Route.date == today_date)
+    prepared_routes = TODAY_ITEM.all(
+        TODAY_ITEM.select(inner=True)
+        .where(Route.driver_id == driver.id, Route.date == today_date)
         .order_by(Route.date.asc(), Route.id.asc())
-        .all()
     )
 
-    prepared_routes = []
-    for idx, route in enumerate(routes):
-        vehicle = route.vehicle
-        prepared_routes.append(
-            {
-                'id': route.id,
-                'start_location': route.start_location,
-                'end_location': route.end_location,
-                'date': route.date.isoformat(),
-                'distance': route.distance,
-                'vehicle_reg_number': vehicle.reg_number if vehicle else None,
-                'status': 'in_progress' if idx == 0 else 'planned',
-            }
-        )
-
-    planned_distance = round(sum(r.distance or 0 for r in routes), 1)
+    planned_distance = round(sum(r['distance'] or 0 for r in prepared_routes), 1)
 
     maintenance_note = 'Информация по обслуживанию недоступна.'
     vehicle_ids = [vehicle.id for vehicle in driver.vehicles]
@@ -122,18 +90,22 @@ def today_routes():
         'maintenance_note': maintenance_note,
     }
 
-    return jsonify({'routes': prepared_routes, 'summary': summary}), 200
+    return json_response({'routes': prepared_routes, 'summary': summary})
 
 
-def _serialize_route(route):
-    return {
-        'id': route.id,
-        'start_location': route.start_location,
-        'end_location': route.end_location,
-        'date': route.date.isoformat() if route.date else None,
-        'distance': route.distance,
-        'vehicle_reg_number': route.vehicle.reg_number if route.vehicle else None,
-    }
+def _route_item(route, vehicle):
+    return ROUTE_ITEM.dump_objects(route, vehicle)
+
+
+def _serialize_current_route(route):
+    """_route_item() with the travel time for the current hour, when the store knows it."""
+
+    data = _route_item(route, route.vehicle)
+    seconds, source = route_eta(route)
+    data['eta_source'] = source
+    if seconds is not None:
+        data['duration_text'] = format_duration(seconds)
+    return data
 
 
 @driver_bp.route('/navigation', methods=['GET'])
@@ -163,33 +135,24 @@ def navigation_overview():
 
     current_route = upcoming_route or latest_route
 
-    routes = (
-        Route.query.filter_by(driver_id=driver.id)
+    routes = ROUTE_ITEM.all(
+        ROUTE_ITEM.select()
+        .where(Route.driver_id == driver.id)
         .order_by(Route.date.desc(), Route.id.desc())
         .limit(25)
-        .all()
     )
 
     payload = {
-        'current_route': _serialize_route(current_route) if current_route else None,
-        'routes': [_serialize_route(r) for r in routes],
+        'current_route': _serialize_current_route(current_route) if current_route else None,
+        'routes': routes,
     }
 
-    if payload['current_route']:
-        preview = _map_preview(
-            payload['current_route']['start_location'],
-            payload['current_route']['end_location'],
-        )
-        if preview:
-            payload['current_route'].update(
-                {
-                    'map_url': preview.get('map_url'),
-                    'distance_text': preview.get('distance_text'),
-                    'duration_text': preview.get('duration_text'),
-                }
-            )
+    # previews are precomputed; old routes created before that get resolved lazily
+    if current_route and not current_route.resolved_at:
+        enqueue_route_resolution(current_route.id, priority=10)
+        db.session.commit()
 
-    return jsonify(payload), 200
+    return json_response(payload)
 
 
 @driver_bp.route('/navigation', methods=['POST'])
@@ -219,40 +182,29 @@ def create_navigation_route():
     except ValueError:
         return jsonify({'message': 'Некорректный формат даты. Используйте ГГГГ-ММ-ДД.'}), 400
 
-    map_data = _map_preview(start_location, end_location, payload.get('waypoint'), payload.get('preference'))
-    distance_value = None
-    if map_data and map_data.get('distance_value') is not None:
-        try:
-            distance_value = float(map_data['distance_value']) / 1000.0
-        except (TypeError, ValueError):
-            distance_value = None
-
-    if distance_value is None:
-        distance_value = 0
+    try:
+        stops = clean_stops(payload['stops'] if 'stops' in payload else payload.get('waypoint'))
+    except ValueError as exc:
+        return jsonify({'message': str(exc)}), 400
 
     new_route = Route(
         start_location=start_location,
         end_location=end_location,
+        stops=stops,
+        optimize_stops=bool(payload.get('optimize_stops')),
         date=route_date,
-        distance=distance_value,
+        distance=0,
         vehicle_id=vehicle.id,
         driver_id=driver.id,
     )
 
     db.session.add(new_route)
+    db.session.flush()
+    enqueue_route_resolution(new_route.id, priority=10)
+    item = _route_item(new_route, vehicle)
     db.session.commit()
 
-    route_payload = _serialize_route(new_route)
-    if map_data:
-        route_payload.update(
-            {
-                'map_url': map_data.get('map_url'),
-                'distance_text': map_data.get('distance_text'),
-                'duration_text': map_data.get('duration_text'),
-            }
-        )
-
-    return jsonify({'route': route_payload, 'message': 'Маршрут сохранён.'}), 201
+    return json_response({'route': item, 'message': 'Маршрут сохранён.'}, 201)
 
 
 def _get_driver_vehicle(driver):
@@ -265,6 +217,7 @@ def _get_driver_vehicle(driver):
 
 @driver_bp.route('/vehicle', methods=['GET'])
 @role_required('driver')
+@read_only
 def vehicle_overview():
     driver = _get_current_driver()
     if not driver:
@@ -274,7 +227,8 @@ def vehicle_overview():
     if not vehicle:
         return jsonify({'message': 'За вами не закреплено транспортное средство.'}), 404
 
-    today = date.today()
+    # GPS days, route dates and the window are all fleet-local days
+    today = fleet_today()
     window_start = today - timedelta(days=30)
 
     maintenance_items = (
@@ -284,30 +238,63 @@ def vehicle_overview():
         .all()
     )
 
-    routes_all = Route.query.filter(Route.vehicle_id == vehicle.id).all()
-    total_distance = round(sum(r.distance or 0 for r in routes_all), 1)
-
     recent_routes = (
         Route.query.filter(Route.vehicle_id == vehicle.id, Route.date >= window_start)
         .order_by(Route.date.desc())
         .all()
     )
-    recent_distance = sum(r.distance or 0 for r in recent_routes)
+
+    # Kilometres driven according to GPS (services/mileage.py) from the first
+    # tracked day on, planned route distance before it (or throughout for
+    # vehicles without telemetry).
+    tracked_total, tracked_recent, first_tracked = (
+        db.session.query(
+            db.func.coalesce(db.func.sum(VehicleDailyDistance.distance_km), 0.0),
+            db.func.coalesce(
+                db.func.sum(VehicleDailyDistance.distance_km).filter(VehicleDailyDistance.day >= window_start),
+                0.0,
+            ),
+            db.func.min(VehicleDailyDistance.day),
+        )
+        .filter(VehicleDailyDistance.vehicle_id == vehicle.id)
+        .one()
+    )
+    planned_total = (
+        db.session.query(db.func.coalesce(db.func.sum(Route.distance), 0.0))
+        .filter(
+            Route.vehicle_id == vehicle.id,
+            *((Route.date < first_tracked,) if first_tracked else ()),
+        )
+        .scalar()
+    )
+    planned_recent = sum(
+        r.distance or 0 for r in recent_routes if first_tracked is None or r.date < first_tracked
+    )
+    total_distance = round(planned_total + tracked_total, 1)
+    recent_distance = planned_recent + tracked_recent
+    if first_tracked is None:
+        distance_source = 'routes'
+    elif planned_total:
+        distance_source = 'mixed'
+    else:
+        distance_source = 'telemetry'
     recent_days = max((today - window_start).days, 1)
     avg_daily_km = round(recent_distance / recent_days, 1)
     avg_monthly_km = round(avg_daily_km * 30, 1)
 
     latest_maintenance = maintenance_items[0] if maintenance_items else None
-    next_service_km = max(0, 10000 - (total_distance % 10000))
     days_since_maintenance = (
         (today - latest_maintenance.created_at.date()).days
         if latest_maintenance
         else None
     )
 
-    if not latest_maintenance:
+    # same intervals and km as the fleet report (services/service_due.py)
+    service = vehicle_service_status(vehicle.id, today)
+    next_service_km = max(0, service['km_left'])
+    if not service['last_service_date']:
         status = 'Нужна диагностика'
-    elif days_since_maintenance <= 120 and next_service_km > 1000:
+    elif service['status'] == 'ok':
         status = 'Готов к рейсу'
     else:
         status = 'Требуется ТО'
@@ -338,6 +325,8 @@ def vehicle_overview():
             'avg_monthly_km': avg_monthly_km,
             'trips_last_30_days': len(recent_routes),
             'days_since_maintenance': days_since_maintenance,
+            'days_to_service': service['days_left'],
+            'distance_source': distance_source,
         },
         'maintenance': maintenance_list,
         'latest_maintenance': (
@@ -356,6 +345,7 @@ def vehicle_overview():
 
 @driver_bp.route('/maintenance', methods=['GET'])
 @role_required('driver')
+@read_only
 def maintenance_overview():
     driver = _get_current_driver()
     if not driver:
@@ -495,6 +485,8 @@ def create_maintenance():
         )
 
     db.session.add(new_entry)
+    if op_type == 'fuel':
+        enqueue_detection()
     db.session.commit()
 
     return (
@@ -0,0 +1,93 @@
+import time
+
+import orjson
+from flask import Blueprint, Response, current_app, jsonify, request, stream_with_context
+from flask_jwt_extended import get_jwt, get_jwt_identity
+from itsdangerous import BadSignature, URLSafeTimedSerializer
+
+from routes.auth import role_required
+from services.database import session_engine
+from services.live import hub, snapshot
+
+
+live_bp = Blueprint('live', __name__)
+
+STREAM_ROLES = ('admin', 'manager')
+
+
+def _tickets() -> URLSafeTimedSerializer:
+    return URLSafeTimedSerializer(current_app.config['SECRET_KEY'], salt='live.stream')
+
+
+def _sse(event: str, data) -> bytes:
+    return b'event: %s\ndata: %s\n\n' % (event.encode(), orjson.dumps(data))
+
+
+def _stream(subscriber):
+    config = current_app.config
+    flush_interval = config['LIVE_FLUSH_INTERVAL']
+    heartbeat = config['LIVE_HEARTBEAT_SECONDS']
+    deadline = time.monotonic() + config['LIVE_STREAM_MAX_SECONDS']
+    try:
+        yield b'retry: 3000\n\n'
+        yield _sse('snapshot', snapshot())
+        while time.monotonic() < deadline:
+            taken = subscriber.take(heartbeat)
+            if taken is None:
+                # keeps proxies from closing the idle connection and
+                # surfaces disconnected clients as a failed write
+                yield b': ping\n\n'
+                continue
+
+            events, resync = taken
+            if resync:
+                yield _sse('snapshot', snapshot())
+            for event, items in events.items():
+                yield _sse(event, items)
+            # everything that arrives meanwhile is coalesced into the next batch
+            time.sleep(flush_interval)
+    finally:
+        hub.unsubscribe(subscriber)
+
+
+@live_bp.route('/ticket', methods=['POST'])
+@role_required(*STREAM_ROLES)
+def ticket():
+    """Short-lived ticket that opens /live/stream only.
+
+    EventSource cannot set headers, and a JWT in the URL would end up in
+    access logs; the ticket is good for LIVE_TICKET_SECONDS and nothing else.
+    """
+
+    value = _tickets().dumps({'user': get_jwt_identity(), 'role': get_jwt().get('role')})
+    return jsonify({'ticket': value, 'expires_in': current_app.config['LIVE_TICKET_SECONDS']}), 200
+
+
+@live_bp.route('/stream', methods=['GET'])
+def stream():
+    """Server-Sent Events: `snapshot`, then `position` and `route` deltas.
+
+    Opened with `?ticket=` from POST /live/ticket. The stream ends after
+    LIVE_STREAM_MAX_SECONDS; the page then takes a new ticket and reconnects.
+    """
+
+    try:
+        claims = _tickets().loads(
+            request.args.get('ticket', ''), max_age=current_app.config['LIVE_TICKET_SECONDS']
+        )
+    except BadSignature:
+        return jsonify({'message': 'Invalid or expired stream ticket.'}), 401
+    if claims.get('role') not in STREAM_ROLES:
+        return jsonify({'message': 'Insufficient permissions.'}), 403
+
+    subscriber = hub.subscribe(session_engine())
+    response = Response(stream_with_context(_stream(subscriber)), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+
+@live_bp.route('/positions', methods=['GET'])
+@role_required('admin', 'manager')
+def positions():
+    return jsonify(snapshot()), 200
@@ -0,0 +1,110 @@
+from functools import wraps
+import hmac
+import zlib
+
+from flask import Blueprint, current_app, g, jsonify, request
+from flask_jwt_extended import get_jwt, get_jwt_identity
+
+from app import db
+from models.driver import Driver
+from models.vehicle import Vehicle
+from routes.auth import role_required
+from services.geofences import process_fixes as process_geofences
+from services.live import update_positions
+from services.mileage import enqueue_mileage
+from services.telemetry import copy_fixes, drop_unassigned_vehicles, drop_unknown_vehicles, fix_days, parse_ndjson
+from services.trips import enqueue_segmentation
+
+
+telemetry_bp = Blueprint('telemetry', __name__)
+
+
+def _ingest_auth(fn):
+    """Devices authenticate with X-Telemetry-Token, users with their JWT."""
+
+    with_jwt = role_required('admin', 'driver')(fn)
+
+    @wraps(fn)
+    def decorated(*args, **kwargs):
+        token = current_app.config.get('TELEMETRY_INGEST_TOKEN')
+        provided = request.headers.get('X-Telemetry-Token')
+        if token and provided and hmac.compare_digest(provided, token):
+            g.telemetry_device = True
+            return fn(*args, **kwargs)
+        return with_jwt(*args, **kwargs)
+
+    return decorated
+
+
+def _allowed_vehicles():
+    """Vehicle ids the caller may post fixes for, None for any vehicle."""
+
+    if g.get('telemetry_device') or get_jwt().get('role') == 'admin':
+        return None
+    return {
+        vehicle_id
+        for (vehicle_id,) in db.session.query(Vehicle.id)
+        .join(Driver, Driver.id == Vehicle.driver_id)
+        .filter(Driver.user_id == int(get_jwt_identity()))
+    }
+
+
+def _gunzip(body: bytes, max_size: int):
+    """Decompressed body, or None when it is not gzip or exceeds max_size."""
+
+    decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    data = decompressor.decompress(body, max_size)
+    if decompressor.unconsumed_tail:
+        raise OverflowError
+    if not decompressor.eof:
+        return None
+    return data
+
+
+@telemetry_bp.route('', methods=['POST'])
+@_ingest_auth
+def ingest():
+    max_size = current_app.config['TELEMETRY_MAX_BODY_BYTES']
+    if (request.content_length or 0) > max_size:
+        return jsonify({'message': f'Тело запроса больше {max_size} байт.'}), 413
+    body = request.get_data(cache=False)
+    if request.headers.get('Content-Encoding') == 'gzip':
+        try:
+            body = _gunzip(body, max_size)
+        except OverflowError:
+            return jsonify({'message': f'Распакованные данные больше {max_size} байт.'}), 413
+        except zlib.error:
+            body = None
+        if body is None:
+            return jsonify({'message': 'Некорректные gzip-данные.'}), 400
+
+    result = parse_ndjson(body)
+    max_fixes = current_app.config['TELEMETRY_MAX_FIXES_PER_REQUEST']
+    if len(result.fixes) > max_fixes:
+        return jsonify({'message': f'Не больше {max_fixes} точек за запрос.'}), 413
+
+    drop_unknown_vehicles(result)
+    allowed = _allowed_vehicles()
+    if allowed is not None:
+        drop_unassigned_vehicles(result, allowed)
+
+    try:
+        copy_fixes(result.fixes)
+        update_positions(result.fixes)
+        process_geofences(result.fixes)
+        enqueue_mileage(fix_days(result.fixes))
+        if result.fixes:
+            enqueue_segmentation()
+        db.session.commit()
+    except Exception:  # pragma: no cover - простая обработка ошибок для demo
+        db.session.rollback()
+        return jsonify({'message': 'Не удалось сохранить телеметрию.'}), 500
+
+    return (
+        jsonify({
+            'accepted': len(result.fixes),
+            'rejected': result.rejected,
+            'errors': result.errors,
+        }),
+        202,
+    )
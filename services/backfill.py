@@ -0,0 +1,297 @@
+"""`flask backfill route-distance`: fill in distances of routes stored with 0.
+
+Routes are walked in id order (keyset, no OFFSET) in pages. Within a page,
+identical start/end pairs are resolved once: first from routes that already
+have a distance for the same addresses, then through the proxy's batch
+/distances endpoint at a bounded rate; a busy proxy (429/503) is retried
+with backoff. Each page is written with a single UPDATE and the last
+processed id is stored in `app_state`, so an interrupted run continues where
+it stopped. Pairs left unresolved are stored with the checkpoint and are
+tried again by `--retry-unresolved`.
+"""
+import time
+
+import click
+from flask.cli import AppGroup
+from sqlalchemy import bindparam, text, tuple_
+
+from app import db
+from models.app_state import AppState
+from models.route import Route
+from services.maps import MapProxyBusy, batch_distances
+from services.route_enrichment import enqueue_route_resolution
+
+
+CHECKPOINT_KEY = 'backfill.route_distance'
+
+# attempts per /distances call and the longest pause between them, seconds
+PROXY_ATTEMPTS = 5
+MAX_BACKOFF = 60
+
+backfill_cli = AppGroup('backfill', help='Заполнение исторических данных.')
+
+
+PAGE_SQL = text(
+    """
+    SELECT id, start_location, end_location, stops
+    FROM route
+    WHERE distance = 0 AND id > :after_id
+    ORDER BY id
+    LIMIT :limit
+    """
+)
+
+# routes of the stored unresolved pairs, found through ix_route_locations
+RETRY_SQL = text(
+    """
+    SELECT id, start_location, end_location
+    FROM route
+    WHERE (start_location, end_location) IN (
+            SELECT * FROM unnest(CAST(:starts AS varchar[]), CAST(:ends AS varchar[]))
+        )
+        AND distance = 0 AND stops IS NULL
+    """
+).bindparams(bindparam('starts'), bindparam('ends'))
+
+UPDATE_SQL = text(
+    """
+    UPDATE route AS r
+    SET distance = v.distance,
+        duration = COALESCE(r.duration, v.duration),
+        start_lon = COALESCE(r.start_lon, v.start_lon),
+        start_lat = COALESCE(r.start_lat, v.start_lat),
+        end_lon = COALESCE(r.end_lon, v.end_lon),
+        end_lat = COALESCE(r.end_lat, v.end_lat),
+        updated_at = now() at time zone 'utc'
+    FROM unnest(
+        CAST(:ids AS integer[]), CAST(:distances AS double precision[]),
+        CAST(:durations AS double precision[]),
+        CAST(:start_lons AS double precision[]), CAST(:start_lats AS double precision[]),
+        CAST(:end_lons AS double precision[]), CAST(:end_lats AS double precision[])
+    ) AS v(id, distance, duration, start_lon, start_lat, end_lon, end_lat)
+    WHERE r.id = v.id AND r.distance = 0
+    """
+).bindparams(
+    *(
+        bindparam(name)
+        for name in ('ids', 'distances', 'durations', 'start_lons', 'start_lats', 'end_lons', 'end_lats')
+    )
+)
+
+
+class RateLimiter:
+    """Allows `rate` units per second on average."""
+
+    def __init__(self, rate: float):
+        self.interval = 1.0 / rate if rate > 0 else 0.0
+        self.next_at = time.monotonic()
+
+    def wait(self, units: int = 1):
+        now = time.monotonic()
+        if self.next_at > now:
+            time.sleep(self.next_at - now)
+        self.next_at = max(self.next_at, now) + units * self.interval
+
+
+def _known_distances(pairs):
+    """Distances already stored on other routes with the same addresses."""
+
+    if not pairs:
+        return {}
+    rows = (
+        db.session.query(
+            Route.start_location,
+            Route.end_location,
+            db.func.max(Route.distance),
+            db.func.max(Route.duration),
+        )
+        .filter(
+            tuple_(Route.start_location, Route.end_location).in_(list(pairs)),
+            Route.stops.is_(None),
+            Route.distance > 0,
+        )
+        .group_by(Route.start_location, Route.end_location)
+        .all()
+    )
+    return {
+        (start, end): {'distance': distance, 'duration': duration}
+        for start, end, distance, duration in rows
+    }
+
+
+def _fetch_chunk(chunk, limiter):
+    """batch_distances() with backoff while the proxy is busy or unreachable."""
+
+    for attempt in range(PROXY_ATTEMPTS):
+        limiter.wait(len(chunk))
+        try:
+            results = batch_distances(chunk)
+        except MapProxyBusy as exc:
+            delay = max(exc.retry_after, 2 ** attempt)
+        else:
+            if results is not None:
+                return results
+            delay = 2 ** attempt
+        if attempt + 1 < PROXY_ATTEMPTS:
+            time.sleep(min(delay, MAX_BACKOFF))
+    return None
+
+
+def _resolve_pairs(pairs, chunk_size, limiter):
+    resolved = {}
+    for offset in range(0, len(pairs), chunk_size):
+        chunk = pairs[offset:offset + chunk_size]
+        results = _fetch_chunk(chunk, limiter)
+        if results is None:
+            click.echo(f'Сервис карт не ответил, пары отложены до --retry-unresolved: {len(chunk)}', err=True)
+            continue
+        for pair, result in zip(chunk, results):
+            if not result or result.get('distance_value') is None:
+                continue
+            start_point = result.get('start_point') or [None, None]
+            end_point = result.get('end_point') or [None, None]
+            resolved[pair] = {
+                'distance': round(float(result['distance_value']) / 1000.0, 3),
+                'duration': result.get('duration_value'),
+                'start_lon': start_point[0],
+                'start_lat': start_point[1],
+                'end_lon': end_point[0],
+                'end_lat': end_point[1],
+            }
+    return resolved
+
+
+def _write_page(route_pairs, values):
+    columns = {name: [] for name in ('ids', 'distances', 'durations', 'start_lons', 'start_lats', 'end_lons', 'end_lats')}
+    for route_id, pair in route_pairs:
+        value = values.get(pair)
+        if not value:
+            continue
+        columns['ids'].append(route_id)
+        columns['distances'].append(value['distance'])
+        columns['durations'].append(value.get('duration'))
+        columns['start_lons'].append(value.get('start_lon'))
+        columns['start_lats'].append(value.get('start_lat'))
+        columns['end_lons'].append(value.get('end_lon'))
+        columns['end_lats'].append(value.get('end_lat'))
+    if not columns['ids']:
+        return 0
+    return db.session.execute(UPDATE_SQL, columns).rowcount
+
+
+def _save_checkpoint(last_id, unresolved_pairs):
+    AppState.set_value(
+        CHECKPOINT_KEY,
+        {'last_id': last_id, 'unresolved': [list(pair) for pair in sorted(unresolved_pairs)]},
+    )
+
+
+def _retry_unresolved(checkpoint, pairs_per_call, limiter):
+    """Resolve again the pairs a previous run could not; returns (updated, still unresolved)."""
+
+    pairs = sorted(tuple(pair) for pair in checkpoint.get('unresolved', []))
+    click.echo(f'Повторный расчёт нерешённых пар адресов: {len(pairs)}')
+    if not pairs:
+        return 0, set()
+
+    values = _known_distances(set(pairs))
+    db.session.commit()
+    values.update(_resolve_pairs([pair for pair in pairs if pair not in values], pairs_per_call, limiter))
+    route_pairs = [
+        (route_id, (start, end))
+        for route_id, start, end in db.session.execute(
+            RETRY_SQL,
+            {'starts': [start for start, _ in pairs], 'ends': [end for _, end in pairs]},
+        )
+    ]
+    updated = _write_page(route_pairs, values)
+    unresolved_pairs = set(pairs) - values.keys()
+    _save_checkpoint(checkpoint.get('last_id', 0), unresolved_pairs)
+    db.session.commit()
+    return updated, unresolved_pairs
+
+
+@backfill_cli.command('route-distance')
+@click.option('--page-size', default=1000, show_default=True, help='Маршрутов за одну страницу.')
+@click.option(
+    '--pairs-per-call', default=8, show_default=True,
+    help='Пар адресов в одном запросе к сервису карт (каждая пара — до двух запросов геокодера).',
+)
+@click.option('--rate', default=20.0, show_default=True, help='Не больше стольких пар адресов в секунду.')
+@click.option('--after-id', type=int, default=None, help='Начать после этого id (по умолчанию — с сохранённой позиции).')
+@click.option('--restart', is_flag=True, help='Игнорировать сохранённую позицию и начать сначала.')
+@click.option('--max-pages', type=int, default=None, help='Остановиться после N страниц.')
+@click.option('--retry-unresolved', is_flag=True, help='Только повторить пары адресов, не рассчитанные прошлыми запусками.')
+def route_distance_command(page_size, pairs_per_call, rate, after_id, restart, max_pages, retry_unresolved):
+    """Рассчитать расстояние маршрутов, сохранённых с distance = 0."""
+
+    limiter = RateLimiter(rate)
+    checkpoint = {} if restart else AppState.get_value(CHECKPOINT_KEY, {})
+    if retry_unresolved:
+        updated, unresolved_pairs = _retry_unresolved(checkpoint, pairs_per_call, limiter)
+        click.echo(f'Готово: обновлено {updated}, нерешённых пар адресов {len(unresolved_pairs)}.')
+        return
+
+    if after_id is None:
+        after_id = checkpoint.get('last_id', 0)
+    # pairs stored as unresolved wait for --retry-unresolved
+    unresolved_pairs = {tuple(pair) for pair in checkpoint.get('unresolved', [])}
+
+    remaining = db.session.execute(
+        text('SELECT count(*) FROM route WHERE distance = 0 AND id > :after_id'),
+        {'after_id': after_id},
+    ).scalar()
+    click.echo(f'Маршрутов без расстояния после id={after_id}: {remaining}')
+
+    started = time.monotonic()
+    processed = updated = queued = pages = 0
+
+    while max_pages is None or pages < max_pages:
+        rows = db.session.execute(PAGE_SQL, {'after_id': after_id, 'limit': page_size}).all()
+        if not rows:
+            break
+
+        route_pairs = []
+        for route_id, start, end, stops in rows:
+            if stops:
+                # the batch endpoint only handles plain pairs
+                enqueue_route_resolution(route_id)
+                queued += 1
+            else:
+                route_pairs.append((route_id, (start, end)))
+
+        pairs = {pair for _, pair in route_pairs} - unresolved_pairs
+        values = _known_distances(pairs)
+        missing = sorted(pairs - values.keys())
+        # release the read transaction while the proxy works
+        db.session.commit()
+        fetched = _resolve_pairs(missing, pairs_per_call, limiter)
+        unresolved_pairs |= set(missing) - fetched.keys()
+        values.update(fetched)
+
+        updated += _write_page(route_pairs, values)
+        after_id = rows[-1][0]
+        _save_checkpoint(after_id, unresolved_pairs)
+        db.session.commit()
+
+        pages += 1
+        processed += len(rows)
+        elapsed = time.monotonic() - started
+        speed = processed / elapsed if elapsed else 0
+        eta = (remaining - processed) / speed if speed else 0
+        click.echo(
+            f'[{processed}/{remaining}] id<={after_id} обновлено={updated} '
+            f'в очереди={queued} не найдено пар={len(unresolved_pairs)} '
+            f'{speed:.0f} маршр./с, осталось ~{eta:.0f} с'
+        )
+
+    click.echo(
+        f'Готово: обработано {processed}, обновлено {updated}, '
+        f'поставлено в очередь {queued}, нерешённых пар адресов {len(unresolved_pairs)}.'
+    )
+    if unresolved_pairs:
+        click.echo('Повторить их расчёт: flask backfill route-distance --retry-unresolved')
+
+
+def init_backfill(app):
+    app.cli.add_command(backfill_cli)
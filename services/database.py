@@ -0,0 +1,262 @@
+"""Connection pool settings, read replicas and session-level connections.
+
+Pool size, overflow, pre-ping, recycle and statement_timeout come from the
+DB_* settings (see create_app). With DB_PGBOUNCER=1 the app sits behind
+PgBouncer in transaction mode: the local pool is turned off (PgBouncer does
+the pooling) and statement_timeout is set per transaction with SET LOCAL,
+because PgBouncer rejects the `options` startup parameter and a plain SET
+would stay on a server connection shared with other clients. LISTEN and
+advisory locks need a server session of their own; they go through
+session_engine(), which connects to DATABASE_DIRECT_URL when it is set.
+
+Views marked @read_only send their queries to one of DATABASE_REPLICA_URLS.
+Each process checks a replica's lag at most every DB_REPLICA_CHECK_INTERVAL
+seconds; a replica more than DB_REPLICA_MAX_LAG seconds behind, or not
+answering, or not streaming WAL from the primary, is left out until the next
+check, and with no usable replica the view reads from the primary. A view
+whose replica drops the connection mid-request is run again on the primary.
+Flushes always go to the primary.
+"""
+import random
+import threading
+import time
+from functools import wraps
+
+import click
+from flask import current_app, g, has_app_context
+from flask.cli import AppGroup
+from flask_sqlalchemy.session import Session
+from psycopg2.errors import QueryCanceled
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.exc import OperationalError, SQLAlchemyError
+from sqlalchemy.pool import NullPool
+
+
+REPLICA_CONNECT_TIMEOUT = 2
+# an idle primary does not advance the replay timestamp: a replica that has
+# replayed everything it received is current whatever the timestamp says, as
+# long as it is still receiving; NULL (lagging) once the WAL receiver stops
+# streaming. Reading its status needs pg_monitor on the replica.
+LAG_SQL = text(
+    """
+    SELECT CASE
+        WHEN NOT pg_is_in_recovery() THEN 0
+        WHEN (SELECT status FROM pg_stat_wal_receiver) IS DISTINCT FROM 'streaming' THEN NULL
+        WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+        ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+    END
+    """
+)
+
+_engines_lock = threading.Lock()
+
+db_cli = AppGroup('database', help='Подключения к PostgreSQL и реплики.')
+
+
+def engine_options(config, pgbouncer: bool = None) -> dict:
+    """create_engine() keyword arguments for the DB_* settings in `config`."""
+
+    if pgbouncer is None:
+        pgbouncer = config['DB_PGBOUNCER']
+    if pgbouncer:
+        return {'poolclass': NullPool}
+
+    options = {
+        'pool_size': config['DB_POOL_SIZE'],
+        'max_overflow': config['DB_MAX_OVERFLOW'],
+        'pool_timeout': config['DB_POOL_TIMEOUT'],
+        'pool_recycle': config['DB_POOL_RECYCLE'],
+        'pool_pre_ping': config['DB_POOL_PRE_PING'],
+    }
+    if config['DB_STATEMENT_TIMEOUT_MS']:
+        options['connect_args'] = {'options': f"-c statement_timeout={config['DB_STATEMENT_TIMEOUT_MS']}"}
+    return options
+
+
+def _set_local_timeout(engine, timeout_ms: int):
+    @event.listens_for(engine, 'begin')
+    def begin(connection):
+        connection.exec_driver_sql(f'SET LOCAL statement_timeout = {int(timeout_ms)}')
+
+
+class ReplicaSet:
+    """Replica engines and the last lag reading of each."""
+
+    def __init__(self, urls, options: dict, max_lag: float, check_interval: float, statement_timeout_ms: int = None):
+        self.urls = list(urls)
+        self.options = dict(options)
+        self.options['connect_args'] = {**options.get('connect_args', {}), 'connect_timeout': REPLICA_CONNECT_TIMEOUT}
+        self.max_lag = max_lag
+        self.check_interval = check_interval
+        # set per transaction behind PgBouncer, as on the primary
+        self.statement_timeout_ms = statement_timeout_ms
+        self._engines = {}
+        # url -> (monotonic time of the check, lag in seconds or None)
+        self._readings = {}
+
+    def engine(self, url: str):
+        engine = self._engines.get(url)
+        if engine is None:
+            with _engines_lock:
+                engine = self._engines.get(url)
+                if engine is None:
+                    engine = create_engine(url, **self.options)
+                    if self.statement_timeout_ms:
+                        _set_local_timeout(engine, self.statement_timeout_ms)
+                    self._engines[url] = engine
+        return engine
+
+    def measure(self, url: str):
+        """Seconds the replica is behind the primary, None when it does not answer
+        and infinity when it does not stream WAL."""
+
+        try:
+            with self.engine(url).connect() as connection:
+                lag = connection.execute(LAG_SQL).scalar()
+        except SQLAlchemyError as exc:
+            current_app.logger.warning('replica %s unavailable: %s', self.engine(url).url, exc)
+            return None
+        if lag is None:
+            current_app.logger.warning('replica %s is not streaming WAL', self.engine(url).url)
+            return float('inf')
+        return float(lag)
+
+    def lag(self, url: str):
+        checked_at, lag = self._readings.get(url, (None, None))
+        now = time.monotonic()
+        if checked_at is None or now - checked_at >= self.check_interval:
+            # concurrent requests keep the previous reading while this one checks
+            self._readings[url] = (now, lag)
+            lag = self.measure(url)
+            self._readings[url] = (time.monotonic(), lag)
+        return lag
+
+    def choose(self):
+        """Engine of a random replica within max_lag, None to use the primary."""
+
+        usable = []
+        for url in self.urls:
+            lag = self.lag(url)
+            if lag is not None and lag <= self.max_lag:
+                usable.append(url)
+        return self.engine(random.choice(usable)) if usable else None
+
+    def failed(self, engine):
+        """Leave out the replica of `engine` until its next check."""
+
+        for url, replica in self._engines.items():
+            if replica is engine:
+                self._readings[url] = (time.monotonic(), None)
+
+    def dispose(self):
+        for engine in self._engines.values():
+            engine.dispose(close=False)
+
+
+class RoutingSession(Session):
+    """db.session that reads from a replica inside @read_only views."""
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and not self._flushing:
+            replica = _request_replica()
+            if replica is not None:
+                return replica
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+def _request_replica():
+    if not has_app_context() or not g.get('db_read_only'):
+        return None
+    # one replica per request, so its queries see one snapshot of the data
+    if 'db_replica' not in g:
+        replicas = current_app.extensions.get('db_replicas')
+        g.db_replica = replicas.choose() if replicas else None
+    return g.db_replica
+
+
+def read_only(fn):
+    """Run the view against a replica when one is configured and current enough."""
+
+    @wraps(fn)
+    def decorated(*args, **kwargs):
+        g.db_read_only = True
+        try:
+            return fn(*args, **kwargs)
+        except OperationalError as exc:
+            replica = g.get('db_replica')
+            # a statement timeout would take as long on the primary
+            if replica is None or isinstance(exc.orig, QueryCanceled):
+                raise
+            current_app.logger.warning('replica %s failed, reading from the primary: %s', replica.url, exc)
+            current_app.extensions['db_replicas'].failed(replica)
+            current_app.extensions['sqlalchemy'].session.rollback()
+            g.db_replica = None
+            return fn(*args, **kwargs)
+
+    return decorated
+
+
+def session_engine():
+    """Engine for LISTEN and advisory locks, which need a server session of their own."""
+
+    app = current_app._get_current_object()
+    url = app.config['DATABASE_DIRECT_URL']
+    if not url:
+        return app.extensions['sqlalchemy'].engine
+    engine = app.extensions.get('db_direct_engine')
+    if engine is None:
+        with _engines_lock:
+            engine = app.extensions.get('db_direct_engine')
+            if engine is None:
+                engine = create_engine(url, **engine_options(app.config, pgbouncer=False))
+                app.extensions['db_direct_engine'] = engine
+    return engine
+
+
+def dispose_engines(app):
+    """Drop pooled connections inherited from a parent process (after fork)."""
+
+    app.extensions['sqlalchemy'].engine.dispose(close=False)
+    if 'db_direct_engine' in app.extensions:
+        app.extensions['db_direct_engine'].dispose(close=False)
+    if 'db_replicas' in app.extensions:
+        app.extensions['db_replicas'].dispose()
+
+
+@db_cli.command('replicas')
+def replicas_command():
+    """Отставание реплик и какие из них используются для чтения."""
+
+    replicas = current_app.extensions.get('db_replicas')
+    if not replicas:
+        click.echo('Реплики не настроены (DATABASE_REPLICA_URLS).')
+        return
+    for url in replicas.urls:
+        lag = replicas.measure(url)
+        name = replicas.engine(url).url.render_as_string(hide_password=True)
+        if lag is None:
+            click.echo(f'{name}: недоступна')
+        elif lag == float('inf'):
+            click.echo(f'{name}: не получает WAL с основной БД, не используется')
+        else:
+            state = 'используется' if lag <= replicas.max_lag else f'отстаёт больше {replicas.max_lag:g} с'
+            click.echo(f'{name}: отставание {lag:.1f} с, {state}')
+
+
+def init_database(app):
+    config = app.config
+    timeout_ms = config['DB_STATEMENT_TIMEOUT_MS'] if config['DB_PGBOUNCER'] else None
+    if timeout_ms:
+        with app.app_context():
+            _set_local_timeout(app.extensions['sqlalchemy'].engine, timeout_ms)
+
+    if config['DATABASE_REPLICA_URLS']:
+        app.extensions['db_replicas'] = ReplicaSet(
+            config['DATABASE_REPLICA_URLS'],
+            engine_options(config),
+            config['DB_REPLICA_MAX_LAG'],
+            config['DB_REPLICA_CHECK_INTERVAL'],
+            timeout_ms,
+        )
+
+    app.cli.add_command(db_cli)
@@ -0,0 +1,175 @@
+"""Driving distance matrices with a database cache.
+
+Points are snapped to a 1e-4 degree grid (~10 m) and every answered
+origin/destination pair is kept in `distance_cache` for `CACHE_TTL`, so the
+same depots and customer sites are asked from the router once. Pairs that
+are not cached are requested from the maps proxy (`POST /matrix`) as one
+sub-matrix of the rows and columns that have gaps; only the gaps are
+written back, and `prune_expired()` deletes rows past the TTL. Whatever the
+router cannot answer is estimated as the great-circle distance times
+`DETOUR_FACTOR`.
+"""
+from datetime import datetime, timedelta
+
+import numpy as np
+from sqlalchemy import bindparam, text
+
+from app import db
+from services.maps import distance_matrix as fetch_matrix
+from services.mileage import haversine_km
+
+
+GRID = 10000
+CACHE_TTL = timedelta(days=30)
+DETOUR_FACTOR = 1.3
+# points per side of one proxy request (its MAX_MATRIX_POINTS)
+REQUEST_POINTS = 1000
+# expired rows deleted per prune_expired() call
+PRUNE_BATCH = 50000
+
+LOOKUP_SQL = text(
+    """
+    SELECT s.i, d.j, c.distance_m
+    FROM unnest(CAST(:src_lat AS integer[]), CAST(:src_lon AS integer[])) WITH ORDINALITY AS s(lat, lon, i)
+    JOIN distance_cache c ON c.from_lat = s.lat AND c.from_lon = s.lon
+    JOIN unnest(CAST(:dst_lat AS integer[]), CAST(:dst_lon AS integer[])) WITH ORDINALITY AS d(lat, lon, j)
+      ON c.to_lat = d.lat AND c.to_lon = d.lon
+    WHERE c.updated_at >= :fresh_after
+    """
+).bindparams(*(bindparam(name) for name in ('src_lat', 'src_lon', 'dst_lat', 'dst_lon')))
+
+STORE_SQL = text(
+    """
+    INSERT INTO distance_cache (from_lat, from_lon, to_lat, to_lon, distance_m, duration_s, updated_at)
+    SELECT v.*, now() at time zone 'utc'
+    FROM unnest(
+        CAST(:from_lat AS integer[]), CAST(:from_lon AS integer[]),
+        CAST(:to_lat AS integer[]), CAST(:to_lon AS integer[]),
+        CAST(:distance_m AS real[]), CAST(:duration_s AS real[])
+    ) AS v
+    ON CONFLICT (from_lat, from_lon, to_lat, to_lon) DO UPDATE
+    SET distance_m = EXCLUDED.distance_m, duration_s = EXCLUDED.duration_s, updated_at = EXCLUDED.updated_at
+    """
+).bindparams(*(bindparam(name) for name in ('from_lat', 'from_lon', 'to_lat', 'to_lon', 'distance_m', 'duration_s')))
+
+
+def snap(points):
+    """(lat, lon) pairs -> integer grid keys, as an (n, 2) array."""
+
+    return np.rint(np.asarray(points, dtype=float).reshape(-1, 2) * GRID).astype(np.int64)
+
+
+def _lookup(src: np.ndarray, dst: np.ndarray) -> np.ndarray:
+    km = np.full((len(src), len(dst)), np.nan)
+    rows = db.session.execute(
+        LOOKUP_SQL,
+        {
+            'src_lat': src[:, 0].tolist(), 'src_lon': src[:, 1].tolist(),
+            'dst_lat': dst[:, 0].tolist(), 'dst_lon': dst[:, 1].tolist(),
+            'fresh_after': datetime.utcnow() - CACHE_TTL,
+        },
+    ).all()
+    if rows:
+        index = np.asarray(rows, dtype=float)
+        km[index[:, 0].astype(int) - 1, index[:, 1].astype(int) - 1] = index[:, 2] / 1000.0
+    return km
+
+
+PRUNE_SQL = text(
+    """
+    DELETE FROM distance_cache
+    WHERE ctid IN (
+        SELECT ctid FROM distance_cache WHERE updated_at < :expired_before LIMIT :limit
+    )
+    """
+)
+
+
+def _fetch(src: np.ndarray, dst: np.ndarray, wanted: np.ndarray):
+    """Router answer for unique keys: (km matrix with NaN gaps, cache rows) or None.
+
+    Only cells set in `wanted` (the ones missing from the cache) become cache rows.
+    """
+
+    km = np.full((len(src), len(dst)), np.nan)
+    store = []
+    for row in range(0, len(src), REQUEST_POINTS):
+        for col in range(0, len(dst), REQUEST_POINTS):
+            block_src, block_dst = src[row:row + REQUEST_POINTS], dst[col:col + REQUEST_POINTS]
+            data = fetch_matrix(
+                [(lon / GRID, lat / GRID) for lat, lon in block_src.tolist()],
+                [(lon / GRID, lat / GRID) for lat, lon in block_dst.tolist()],
+            )
+            if data is None:
+                return None
+            durations = data.get('durations') or []
+            for i, values in enumerate(data['distances']):
+                for j, meters in enumerate(values):
+                    if meters is None:
+                        continue
+                    km[row + i, col + j] = meters / 1000.0
+                    if not wanted[row + i, col + j]:
+                        continue
+                    duration = durations[i][j] if i < len(durations) else None
+                    store.append((*block_src[i].tolist(), *block_dst[j].tolist(), meters, duration))
+    return km, store
+
+
+def _store(rows):
+    if not rows:
+        return
+    columns = list(zip(*rows))
+    db.session.execute(
+        STORE_SQL,
+        dict(zip(('from_lat', 'from_lon', 'to_lat', 'to_lon', 'distance_m', 'duration_s'), map(list, columns))),
+    )
+
+
+def driving_km(sources, destinations):
+    """Road km from each (lat, lon) source to each destination.
+
+    Returns (matrix, {'cached': n, 'routed': n, 'estimated': n}); new router
+    answers are added to the cache in the caller's transaction.
+    """
+
+    src_keys, dst_keys = snap(sources), snap(destinations)
+    src_unique, src_inverse = np.unique(src_keys, axis=0, return_inverse=True)
+    dst_unique, dst_inverse = np.unique(dst_keys, axis=0, return_inverse=True)
+    src_inverse, dst_inverse = src_inverse.ravel(), dst_inverse.ravel()
+
+    km = _lookup(src_unique, dst_unique)
+    same = (src_unique[:, None, :] == dst_unique[None, :, :]).all(axis=2)
+    km[same] = 0.0
+    stats = {'cached': int(np.count_nonzero(~np.isnan(km) & ~same)), 'routed': 0, 'estimated': 0}
+
+    missing = np.isnan(km)
+    if missing.any():
+        rows = np.flatnonzero(missing.any(axis=1))
+        cols = np.flatnonzero(missing.any(axis=0))
+        current = km[np.ix_(rows, cols)]
+        gaps = np.isnan(current)
+        fetched = _fetch(src_unique[rows], dst_unique[cols], gaps)
+        if fetched is not None:
+            block, store = fetched
+            current[gaps] = block[gaps]
+            km[np.ix_(rows, cols)] = current
+            stats['routed'] = int(np.count_nonzero(gaps & ~np.isnan(block)))
+            _store(store)
+
+    missing = np.isnan(km)
+    if missing.any():
+        i, j = np.nonzero(missing)
+        km[i, j] = DETOUR_FACTOR * haversine_km(
+            src_unique[i, 0] / GRID, src_unique[i, 1] / GRID, dst_unique[j, 0] / GRID, dst_unique[j, 1] / GRID
+        )
+        stats['estimated'] = len(i)
+
+    return km[np.ix_(src_inverse, dst_inverse)], stats
+
+
+def prune_expired(limit: int = PRUNE_BATCH) -> int:
+    """Delete up to `limit` cache rows older than CACHE_TTL; the caller commits."""
+
+    return db.session.execute(
+        PRUNE_SQL, {'expired_before': datetime.utcnow() - CACHE_TTL, 'limit': limit}
+    ).rowcount
@@ -0,0 +1,332 @@
+"""Travel times learned from completed routes and router answers.
+
+Origin/destination points are snapped to a 1e-3 degree grid (~100 m) and
+durations are kept per pair and weekly hour slot (weekday * 24 + hour, UTC)
+as running statistics of log seconds: an exponentially decayed weight, the
+weighted mean and the sum of squared deviations. A pair costs one small row
+per slot however many trips it has seen.
+
+Routes completed by geofence events (services/geofences.py) feed the hour
+slots; router durations stored on route resolution go to `ROUTER_SLOT`.
+`estimate()` answers from trips observed on the same weekday within an hour
+of the asked time when there are enough of them and they agree, otherwise
+from a fresh router answer; only pairs with neither need the maps proxy.
+"""
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+import math
+
+import click
+from flask.cli import AppGroup
+from sqlalchemy import bindparam, text, tuple_, update
+
+from app import db
+from models.route import Route
+from services.telemetry import fleet_zone
+
+
+GRID = 1000
+ROUTER_SLOT = -1
+SLOTS_PER_WEEK = 7 * 24
+HALF_LIFE = timedelta(days=28)
+ROUTER_TTL = timedelta(days=30)
+# an hour-slot answer needs this much decayed weight (~trips) and spread
+MIN_WEIGHT = 3.0
+MAX_LOG_STD = 0.35
+# completed routes outside these bounds are not trips worth learning from
+MIN_TRIP_SECONDS = 60
+MAX_TRIP_SECONDS = 12 * 3600
+
+eta_cli = AppGroup('eta', help='Статистика времени в пути.')
+
+_DECAY = (
+    "power(0.5, GREATEST(extract(epoch FROM EXCLUDED.updated_at - t.updated_at), 0) / :half_life)"
+)
+
+UPSERT_SQL = text(
+    f"""
+    INSERT INTO travel_time_stat AS t
+        (from_lat, from_lon, to_lat, to_lon, slot, weight, mean_log, m2_log, updated_at)
+    SELECT v.*, :now
+    FROM unnest(
+        CAST(:from_lat AS integer[]), CAST(:from_lon AS integer[]),
+        CAST(:to_lat AS integer[]), CAST(:to_lon AS integer[]), CAST(:slot AS smallint[]),
+        CAST(:weight AS real[]), CAST(:mean_log AS real[]), CAST(:m2_log AS real[])
+    ) AS v
+    ON CONFLICT (from_lat, from_lon, to_lat, to_lon, slot) DO UPDATE
+    SET weight = t.weight * {_DECAY} + EXCLUDED.weight,
+        mean_log = t.mean_log + (EXCLUDED.mean_log - t.mean_log) * EXCLUDED.weight
+                   / (t.weight * {_DECAY} + EXCLUDED.weight),
+        m2_log = t.m2_log * {_DECAY} + EXCLUDED.m2_log
+                 + power(EXCLUDED.mean_log - t.mean_log, 2) * t.weight * {_DECAY} * EXCLUDED.weight
+                   / (t.weight * {_DECAY} + EXCLUDED.weight),
+        updated_at = GREATEST(t.updated_at, EXCLUDED.updated_at)
+    """
+).bindparams(
+    *(bindparam(name) for name in ('from_lat', 'from_lon', 'to_lat', 'to_lon', 'slot', 'weight', 'mean_log', 'm2_log'))
+)
+
+LOOKUP_SQL = text(
+    """
+    SELECT p.i, s.slot, s.weight, s.mean_log, s.m2_log, s.updated_at
+    FROM unnest(
+        CAST(:from_lat AS integer[]), CAST(:from_lon AS integer[]),
+        CAST(:to_lat AS integer[]), CAST(:to_lon AS integer[])
+    ) WITH ORDINALITY AS p(from_lat, from_lon, to_lat, to_lon, i)
+    JOIN travel_time_stat s
+      ON s.from_lat = p.from_lat AND s.from_lon = p.from_lon
+     AND s.to_lat = p.to_lat AND s.to_lon = p.to_lon
+    WHERE s.slot = ANY(CAST(:slots AS smallint[]))
+    """
+).bindparams(*(bindparam(name) for name in ('from_lat', 'from_lon', 'to_lat', 'to_lon', 'slots')))
+
+
+def slot_of(at: datetime) -> int:
+    return at.weekday() * 24 + at.hour
+
+
+def _key(origin, destination) -> tuple:
+    """(lat, lon) pair -> integer grid key of the leg."""
+
+    return tuple(int(round(value * GRID)) for value in (*origin, *destination))
+
+
+def _combine(a, b):
+    """Merge two (weight, mean, m2) summaries."""
+
+    weight = a[0] + b[0]
+    if weight <= 0:
+        return 0.0, 0.0, 0.0
+    delta = b[1] - a[1]
+    return weight, a[1] + delta * b[0] / weight, a[2] + b[2] + delta * delta * a[0] * b[0] / weight
+
+
+def record(observations, now: datetime = None):
+    """Add (origin, destination, slot, seconds, weight) observations; the caller commits.
+
+    Points are (lat, lon). Observations of the same pair and slot are merged
+    before the upsert, which decays the stored weight by its age.
+    """
+
+    merged = {}
+    for origin, destination, slot, seconds, weight in observations:
+        if not seconds or seconds <= 0:
+            continue
+        key = (*_key(origin, destination), slot)
+        summary = (float(weight), math.log(seconds), 0.0)
+        merged[key] = _combine(merged[key], summary) if key in merged else summary
+    if not merged:
+        return 0
+
+    keys = list(merged)
+    columns = list(zip(*keys))
+    values = list(zip(*merged.values()))
+    db.session.execute(
+        UPSERT_SQL,
+        {
+            'from_lat': list(columns[0]), 'from_lon': list(columns[1]),
+            'to_lat': list(columns[2]), 'to_lon': list(columns[3]), 'slot': list(columns[4]),
+            'weight': list(values[0]), 'mean_log': list(values[1]), 'm2_log': list(values[2]),
+            'now': now or datetime.utcnow(),
+            'half_life': HALF_LIFE.total_seconds(),
+        },
+    )
+    return len(keys)
+
+
+def record_router_legs(points, legs, now: datetime = None):
+    """Store router leg durations of a directions answer ([lon, lat] points)."""
+
+    if not legs or len(legs) != len(points) - 1:
+        return 0
+    return record(
+        (
+            (tuple(reversed(start)), tuple(reversed(end)), ROUTER_SLOT, leg.get('duration'), 1.0)
+            for start, end, leg in zip(points, points[1:], legs)
+        ),
+        now,
+    )
+
+
+def trip_observation(route: Route):
+    """Observation of a completed route, or None when it does not make one.
+
+    Routes with stops are skipped: their time is not the time of the pair.
+    """
+
+    if route.stops or not route.started_at or not route.completed_at or route.start_lat is None \
+            or route.end_lat is None:
+        return None
+    seconds = (route.completed_at - route.started_at).total_seconds()
+    if not MIN_TRIP_SECONDS <= seconds <= MAX_TRIP_SECONDS:
+        return None
+    return (
+        (route.start_lat, route.start_lon), (route.end_lat, route.end_lon),
+        slot_of(route.started_at), seconds, 1.0,
+    )
+
+
+def record_trips(routes, now: datetime = None):
+    """Learn completed routes not learned before and mark them; the caller commits."""
+
+    routes = [route for route in routes if route.eta_learned_at is None]
+    learned_at = datetime.utcnow()
+    for route in routes:
+        route.eta_learned_at = learned_at
+    return record(filter(None, (trip_observation(route) for route in routes)), now)
+
+
+def estimate(legs, at: datetime):
+    """Seconds and source ('history' or 'router') for each ((lat, lon), (lat, lon)) leg.
+
+    Legs the store cannot answer confidently get (None, None).
+    """
+
+    legs = list(legs)
+    if not legs:
+        return []
+    slot = slot_of(at)
+    hour_slots = [(slot + offset) % SLOTS_PER_WEEK for offset in (-1, 0, 1)]
+    keys = [_key(origin, destination) for origin, destination in legs]
+    columns = list(zip(*keys))
+    rows = db.session.execute(
+        LOOKUP_SQL,
+        {
+            'from_lat': list(columns[0]), 'from_lon': list(columns[1]),
+            'to_lat': list(columns[2]), 'to_lon': list(columns[3]),
+            'slots': hour_slots + [ROUTER_SLOT],
+        },
+    ).all()
+
+    now = datetime.utcnow()
+    history = defaultdict(lambda: (0.0, 0.0, 0.0))
+    router = {}
+    for index, row_slot, weight, mean_log, m2_log, updated_at in rows:
+        if row_slot == ROUTER_SLOT:
+            if now - updated_at <= ROUTER_TTL:
+                router[index - 1] = math.exp(mean_log)
+            continue
+        decay = 0.5 ** (max((now - updated_at).total_seconds(), 0) / HALF_LIFE.total_seconds())
+        history[index - 1] = _combine(history[index - 1], (weight * decay, mean_log, m2_log * decay))
+
+    answers = []
+    for index in range(len(legs)):
+        weight, mean_log, m2_log = history.get(index, (0.0, 0.0, 0.0))
+        if weight >= MIN_WEIGHT and math.sqrt(max(m2_log, 0.0) / weight) <= MAX_LOG_STD:
+            answers.append((math.exp(mean_log), 'history'))
+        elif index in router:
+            answers.append((router[index], 'router'))
+        else:
+            answers.append((None, None))
+    return answers
+
+
+def route_legs(route: Route):
+    if route.start_lat is None or route.end_lat is None:
+        return []
+    points = [(route.start_lat, route.start_lon)]
+    points += [(lat, lon) for lon, lat in route.waypoint_coords or []]
+    points.append((route.end_lat, route.end_lon))
+    return list(zip(points, points[1:]))
+
+
+def planned_at(route: Route) -> datetime:
+    """The route's day at the current time of day, as naive UTC; routes carry no departure time.
+
+    route.date is a fleet-local day, so the time of day is local too.
+    """
+
+    zone = fleet_zone()
+    local = datetime.combine(route.date, datetime.now(zone).time(), zone)
+    return local.astimezone(timezone.utc).replace(tzinfo=None)
+
+
+def route_eta(route: Route, at: datetime = None):
+    """(seconds, source) for a resolved route, or (None, None) on a miss.
+
+    The source is 'history' only when every leg came from observed trips.
+    """
+
+    answers = estimate(route_legs(route), at or planned_at(route))
+    if not answers or any(seconds is None for seconds, _ in answers):
+        return None, None
+    source = 'history' if all(source == 'history' for _, source in answers) else 'router'
+    return sum(seconds for seconds, _ in answers), source
+
+
+def learn_completed(since: datetime, batch_size: int = 5000) -> int:
+    """Feed routes completed since `since` into the store, oldest day first.
+
+    Each day is recorded as of its last completion, so older trips decay as
+    they would have if they had been learned live. Routes already learned
+    (live or by an earlier run) are skipped, so reruns do not count them twice.
+    Returns the number of routes learned.
+    """
+
+    learned = 0
+    after = (since, 0)
+    while True:
+        routes = (
+            Route.query
+            .filter(
+                Route.status == 'completed', Route.stops.is_(None), Route.eta_learned_at.is_(None),
+                tuple_(Route.completed_at, Route.id) > after,
+            )
+            .order_by(Route.completed_at, Route.id)
+            .limit(batch_size)
+            .all()
+        )
+        if not routes:
+            return learned
+        by_day = defaultdict(list)
+        for route in routes:
+            by_day[route.completed_at.date()].append(route)
+        for day_routes in by_day.values():
+            observations = [observation for observation in map(trip_observation, day_routes) if observation]
+            record(observations, now=day_routes[-1].completed_at)
+            learned += len(observations)
+        # one UPDATE for the batch instead of a flush per route
+        db.session.execute(
+            update(Route)
+            .where(
+                Route.id.in_([route.id for route in routes]),
+                # lets the planner skip the other month partitions
+                Route.date.in_({route.date for route in routes}),
+                Route.eta_learned_at.is_(None),
+            )
+            .values(eta_learned_at=datetime.utcnow())
+            .execution_options(synchronize_session=False)
+        )
+        after = (routes[-1].completed_at, routes[-1].id)
+        db.session.commit()
+
+
+@eta_cli.command('learn')
+@click.option('--since', type=click.DateTime(['%Y-%m-%d']), required=True, help='С какого дня (UTC) учесть маршруты.')
+def learn_command(since):
+    """Учесть завершённые маршруты в статистике времени в пути."""
+
+    learned = learn_completed(since)
+    click.echo(f'Учтено маршрутов: {learned}')
+
+
+@eta_cli.command('stats')
+def stats_command():
+    """Размер статистики времени в пути."""
+
+    pairs, slots, router = db.session.execute(
+        text(
+            """
+            SELECT count(DISTINCT (from_lat, from_lon, to_lat, to_lon)),
+                   count(*) FILTER (WHERE slot <> :router_slot),
+                   count(*) FILTER (WHERE slot = :router_slot)
+            FROM travel_time_stat
+            """
+        ),
+        {'router_slot': ROUTER_SLOT},
+    ).one()
+    click.echo(f'Пар: {pairs}, часовых слотов: {slots}, ответов маршрутизатора: {router}')
+
+
+def init_eta(app):
+    app.cli.add_command(eta_cli)
@@ -0,0 +1,147 @@
+"""Fuel consumption anomalies across the fleet.
+
+Consumption is taken between consecutive fills of a vehicle (full-tank
+method): the litres of a fill over the odometer delta since the previous
+one, in l/100 km. One SQL statement computes it for every vehicle with
+window functions and scores each interval against that vehicle's own
+history with a robust z-score, 0.6745 * (x - median) / MAD, which a few
+bad entries cannot drag the way they would a mean and standard deviation.
+
+Intervals scoring beyond `Z_THRESHOLD` are stored in `fuel_anomaly` as
+`high_consumption` (possible fuel theft or a leak) or `low_consumption`
+(usually a missed fill or a mistyped odometer); fills whose odometer did
+not increase are stored as `odometer`. Every run recomputes the whole set,
+flags that no longer hold are removed.
+"""
+from datetime import datetime, timedelta
+import time
+
+import click
+from flask.cli import AppGroup
+from sqlalchemy import bindparam, text
+
+from app import db
+from services.jobs import enqueue, job_handler
+
+
+DETECT_JOB = 'fuel.detect'
+# fills entered within this time are checked together
+DETECT_DELAY = timedelta(minutes=5)
+
+# Iglewicz & Hoaglin: |z| > 3.5 is an outlier
+Z_THRESHOLD = 3.5
+# intervals a vehicle needs before its own median means anything
+MIN_INTERVALS = 5
+
+fuel_cli = AppGroup('fuel', help='Расход топлива.')
+
+DETECT_SQL = text(
+    """
+    WITH fills AS (
+        SELECT id, vehicle_id, event_date, fuel_volume_l,
+               mileage_km - lag(mileage_km) OVER w AS distance_km
+        FROM maintenance
+        WHERE operation_type = 'fuel' AND fuel_volume_l > 0
+        WINDOW w AS (PARTITION BY vehicle_id ORDER BY event_date, id)
+    ),
+    intervals AS (
+        SELECT *, fuel_volume_l * 100.0 / distance_km AS consumption
+        FROM fills
+        WHERE distance_km > 0
+    ),
+    centre AS (
+        SELECT vehicle_id, percentile_cont(0.5) WITHIN GROUP (ORDER BY consumption) AS median
+        FROM intervals
+        GROUP BY vehicle_id
+        HAVING count(*) >= :min_intervals
+    ),
+    spread AS (
+        SELECT i.vehicle_id, c.median,
+               percentile_cont(0.5) WITHIN GROUP (ORDER BY abs(i.consumption - c.median)) AS mad,
+               avg(abs(i.consumption - c.median)) AS mean_ad
+        FROM intervals i
+        JOIN centre c USING (vehicle_id)
+        GROUP BY i.vehicle_id, c.median
+    ),
+    scored AS (
+        SELECT i.id, i.vehicle_id, i.event_date, i.consumption, s.median, i.distance_km, i.fuel_volume_l,
+               CASE
+                   WHEN s.mad > 0 THEN 0.6745 * (i.consumption - s.median) / s.mad
+                   -- more than half of the intervals are identical
+                   WHEN s.mean_ad > 0 THEN (i.consumption - s.median) / (1.253314 * s.mean_ad)
+               END AS score
+        FROM intervals i
+        JOIN spread s USING (vehicle_id)
+    ),
+    found AS (
+        SELECT id, vehicle_id, event_date, 'odometer' AS kind,
+               NULL::float AS consumption, NULL::float AS median, NULL::float AS score,
+               distance_km, fuel_volume_l
+        FROM fills
+        WHERE distance_km <= 0
+        UNION ALL
+        SELECT id, vehicle_id, event_date,
+               CASE WHEN score > 0 THEN 'high_consumption' ELSE 'low_consumption' END,
+               consumption, median, score, distance_km, fuel_volume_l
+        FROM scored
+        WHERE abs(score) > :threshold
+    )
+    INSERT INTO fuel_anomaly (
+        maintenance_id, vehicle_id, event_date, kind, consumption_l_100km, expected_l_100km,
+        score, distance_km, fuel_volume_l, detected_at
+    )
+    SELECT found.*, :now FROM found
+    ON CONFLICT (maintenance_id, kind) DO UPDATE
+    SET vehicle_id = EXCLUDED.vehicle_id,
+        event_date = EXCLUDED.event_date,
+        consumption_l_100km = EXCLUDED.consumption_l_100km,
+        expected_l_100km = EXCLUDED.expected_l_100km,
+        score = EXCLUDED.score,
+        distance_km = EXCLUDED.distance_km,
+        fuel_volume_l = EXCLUDED.fuel_volume_l
+    RETURNING id
+    """
+)
+
+PRUNE_SQL = text(
+    'DELETE FROM fuel_anomaly WHERE id <> ALL(CAST(:keep AS bigint[]))'
+).bindparams(bindparam('keep'))
+
+
+def detect() -> dict:
+    """Recompute fuel anomalies for the whole fleet; the caller commits."""
+
+    kept = db.session.execute(
+        DETECT_SQL,
+        {'min_intervals': MIN_INTERVALS, 'threshold': Z_THRESHOLD, 'now': datetime.utcnow()},
+    ).scalars().all()
+    removed = db.session.execute(PRUNE_SQL, {'keep': kept}).rowcount
+    return {'flagged': len(kept), 'removed': removed}
+
+
+@job_handler(DETECT_JOB, concurrency=1)
+def detect_job(payload: dict):
+    detect()
+    db.session.commit()
+
+
+def enqueue_detection():
+    """Queue a detection run in the current transaction."""
+
+    enqueue(DETECT_JOB, run_at=datetime.utcnow() + DETECT_DELAY, dedupe_key=DETECT_JOB)
+
+
+@fuel_cli.command('detect')
+def detect_command():
+    """Пересчитать аномалии расхода топлива по всему парку."""
+
+    started = time.monotonic()
+    result = detect()
+    db.session.commit()
+    click.echo(
+        f"Аномалий: {result['flagged']}, снято: {result['removed']}, {time.monotonic() - started:.2f} с"
+    )
+
+
+def init_fuel(app):
+    app.cli.add_command(fuel_cli)
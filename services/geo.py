@@ -0,0 +1,156 @@
+"""Geometry helpers shared by the backend services."""
+import math
+from typing import Dict, Hashable, Iterable, List, Tuple
+
+
+def encode_polyline(points: Iterable[Tuple[float, float]], precision: int = 5) -> str:
+    """Encode (lon, lat) pairs with the Google encoded polyline algorithm.
+
+    The format stores (lat, lon) deltas, ~1-2 bytes per coordinate on a
+    typical road geometry instead of ~20 for JSON floats.
+    """
+
+    factor = 10 ** precision
+    output = []
+    prev_lat = prev_lon = 0
+    for lon, lat in points:
+        lat_i = int(round(lat * factor))
+        lon_i = int(round(lon * factor))
+        for delta in (lat_i - prev_lat, lon_i - prev_lon):
+            value = ~(delta << 1) if delta < 0 else delta << 1
+            while value >= 0x20:
+                output.append(chr((0x20 | (value & 0x1F)) + 63))
+                value >>= 5
+            output.append(chr(value + 63))
+        prev_lat, prev_lon = lat_i, lon_i
+    return ''.join(output)
+
+
+def decode_polyline(encoded: str, precision: int = 5) -> List[Tuple[float, float]]:
+    """Decode an encoded polyline back into (lon, lat) pairs."""
+
+    factor = 10 ** precision
+    points = []
+    index = lat = lon = 0
+    length = len(encoded)
+    while index < length:
+        deltas = []
+        for _ in range(2):
+            shift = result = 0
+            while True:
+                byte = ord(encoded[index]) - 63
+                index += 1
+                result |= (byte & 0x1F) << shift
+                shift += 5
+                if byte < 0x20:
+                    break
+            deltas.append(~(result >> 1) if result & 1 else result >> 1)
+        lat += deltas[0]
+        lon += deltas[1]
+        points.append((lon / factor, lat / factor))
+    return points
+
+
+EARTH_RADIUS_KM = 6371.0088
+KM_PER_DEGREE_LAT = 111.195
+
+
+def haversine_km(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    lat1, lon1, lat2, lon2 = map(math.radians, (lat1, lon1, lat2, lon2))
+    a = (
+        math.sin((lat2 - lat1) / 2) ** 2
+        + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    )
+    return 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(min(1.0, a)))
+
+
+class GridIndex:
+    """Uniform lat/lon grid over keyed points for radius and nearest queries.
+
+    A query only looks at the cells overlapping the search circle's bounding
+    box, so its cost depends on the local density, not on the total number of
+    points. Updates are O(1). Not thread-safe; callers hold their own lock.
+    """
+
+    def __init__(self, cell_degrees: float = 0.05):
+        self.cell_degrees = cell_degrees
+        self._cells: Dict[Tuple[int, int], Dict[Hashable, Tuple[float, float]]] = {}
+        self._points: Dict[Hashable, Tuple[float, float]] = {}
+
+    def __len__(self) -> int:
+        return len(self._points)
+
+    def __contains__(self, key) -> bool:
+        return key in self._points
+
+    def get(self, key) -> Tuple[float, float]:
+        return self._points.get(key)
+
+    def _cell(self, lat: float, lon: float) -> Tuple[int, int]:
+        return int(math.floor(lat / self.cell_degrees)), int(math.floor(lon / self.cell_degrees))
+
+    def upsert(self, key: Hashable, lat: float, lon: float):
+        self.remove(key)
+        self._points[key] = (lat, lon)
+        self._cells.setdefault(self._cell(lat, lon), {})[key] = (lat, lon)
+
+    def remove(self, key: Hashable):
+        point = self._points.pop(key, None)
+        if point is None:
+            return
+        cell = self._cell(*point)
+        members = self._cells[cell]
+        del members[key]
+        if not members:
+            del self._cells[cell]
+
+    def clear(self):
+        self._cells.clear()
+        self._points.clear()
+
+    def within(self, lat: float, lon: float, radius_km: float) -> List[Tuple[float, Hashable]]:
+        """(distance_km, key) of points within `radius_km`, nearest first."""
+
+        dlat = radius_km / KM_PER_DEGREE_LAT
+        dlon = radius_km / (KM_PER_DEGREE_LAT * max(math.cos(math.radians(lat)), 0.01))
+        row_min, col_min = self._cell(lat - dlat, lon - dlon)
+        row_max, col_max = self._cell(lat + dlat, lon + dlon)
+
+        if (row_max - row_min + 1) * (col_max - col_min + 1) > len(self._cells):
+            cells = (
+                members for (row, col), members in self._cells.items()
+                if row_min <= row <= row_max and col_min <= col <= col_max
+            )
+        else:
+            cells = (
+                self._cells[(row, col)]
+                for row in range(row_min, row_max + 1)
+                for col in range(col_min, col_max + 1)
+                if (row, col) in self._cells
+            )
+
+        found = []
+        for members in cells:
+            for key, (point_lat, point_lon) in members.items():
+                distance = haversine_km(lat, lon, point_lat, point_lon)
+                if distance <= radius_km:
+                    found.append((distance, key))
+        found.sort(key=lambda item: item[0])
+        return found
+
+    def nearest(self, lat: float, lon: float, count: int, max_radius_km: float,
+                start_radius_km: float = 5.0, accept=None) -> List[Tuple[float, Hashable]]:
+        """Up to `count` nearest points (optionally passing `accept(key)`) within `max_radius_km`.
+
+        Searches a growing circle: once it holds `count` points, no point
+        outside of it can be nearer.
+        """
+
+        radius = min(start_radius_km, max_radius_km)
+        while True:
+            found = self.within(lat, lon, radius)
+            if accept is not None:
+                found = [item for item in found if accept(item[1])]
+            if len(found) >= count or radius >= max_radius_km:
+                return found[:count]
+            radius = min(radius * 2, max_radius_km)
@@ -0,0 +1,324 @@
+"""Geofences: enter/exit events and route progress from incoming telemetry.
+
+Every accepted telemetry batch is checked against the geofences in one pass:
+fixes are bucketed into grid cells, each cell knows the fences whose
+bounding boxes overlap it, and only those fences run the exact
+point-in-polygon test, vectorized over the fixes of their cells.
+
+Per vehicle, `vehicle_geofence_state` keeps the fences it is inside of and
+the time of its last checked fix; fixes not newer than that are skipped, so
+late uploads do not produce spurious events. A change of the inside-set
+becomes rows in `geofence_event`.
+
+The same events drive the planned routes of the day: leaving a fence that
+contains a route's start marks it `in_progress`, entering a fence that
+contains its end marks it `completed`, and the time between the two is
+recorded as a travel-time observation.
+"""
+from collections import defaultdict
+from datetime import datetime
+import math
+import threading
+import time
+from typing import Dict, List
+
+import numpy as np
+from sqlalchemy import bindparam, text
+
+from app import db
+from models.geofence import Geofence, VehicleGeofenceState
+from models.route import Route
+from services.eta import record_trips
+from services.geo import KM_PER_DEGREE_LAT
+from services.live import publish_route_change
+from services.telemetry import fix_datetime, fix_local_date
+
+
+CELL_DEGREES = 0.01
+FENCE_CACHE_TTL = 60.0
+CIRCLE_SEGMENTS = 32
+
+_EPOCH = datetime(1970, 1, 1)
+
+INSERT_EVENTS_SQL = text(
+    """
+    INSERT INTO geofence_event (vehicle_id, geofence_id, recorded_at, entered)
+    SELECT * FROM unnest(
+        CAST(:vehicle_ids AS integer[]), CAST(:geofence_ids AS integer[]),
+        CAST(:recorded_at AS timestamp[]), CAST(:entered AS boolean[])
+    )
+    """
+).bindparams(*(bindparam(name) for name in ('vehicle_ids', 'geofence_ids', 'recorded_at', 'entered')))
+
+# vehicles seen for the first time get a row to lock; the epoch is older than any fix
+CREATE_STATES_SQL = text(
+    """
+    INSERT INTO vehicle_geofence_state (vehicle_id, checked_at, inside)
+    SELECT vehicle_id, timestamp '1970-01-01', '{}'
+    FROM unnest(CAST(:vehicle_ids AS integer[])) AS vehicle_id
+    ORDER BY vehicle_id
+    ON CONFLICT (vehicle_id) DO NOTHING
+    """
+).bindparams(bindparam('vehicle_ids'))
+
+UPSERT_STATE_SQL = text(
+    """
+    INSERT INTO vehicle_geofence_state (vehicle_id, checked_at, inside)
+    SELECT v.vehicle_id, v.checked_at, CAST(v.inside AS integer[])
+    FROM unnest(
+        CAST(:vehicle_ids AS integer[]), CAST(:checked_at AS timestamp[]), CAST(:inside AS text[])
+    ) AS v(vehicle_id, checked_at, inside)
+    ON CONFLICT (vehicle_id) DO UPDATE
+    SET checked_at = EXCLUDED.checked_at, inside = EXCLUDED.inside
+    WHERE vehicle_geofence_state.checked_at < EXCLUDED.checked_at
+    """
+).bindparams(*(bindparam(name) for name in ('vehicle_ids', 'checked_at', 'inside')))
+
+
+def points_in_polygon(lat, lon, polygon) -> np.ndarray:
+    """Even-odd test of coordinate arrays against a [[lon, lat], ...] ring."""
+
+    lat = np.asarray(lat, dtype=float)
+    lon = np.asarray(lon, dtype=float)
+    ring = np.asarray(polygon, dtype=float)
+    xs, ys = ring[:, 0], ring[:, 1]
+    inside = np.zeros(lat.shape, dtype=bool)
+    for x1, y1, x2, y2 in zip(xs, ys, np.roll(xs, -1), np.roll(ys, -1)):
+        if y1 == y2:
+            continue
+        crosses = (y1 > lat) != (y2 > lat)
+        inside ^= crosses & (lon < x1 + (lat - y1) * (x2 - x1) / (y2 - y1))
+    return inside
+
+
+def bounding_box(polygon) -> dict:
+    lons = [point[0] for point in polygon]
+    lats = [point[1] for point in polygon]
+    return {'min_lat': min(lats), 'min_lon': min(lons), 'max_lat': max(lats), 'max_lon': max(lons)}
+
+
+def circle_polygon(lat: float, lon: float, radius_m: float, segments: int = CIRCLE_SEGMENTS) -> List[list]:
+    """Ring approximating a circle, for fences given as a center and radius."""
+
+    dlat = radius_m / 1000.0 / KM_PER_DEGREE_LAT
+    dlon = dlat / max(math.cos(math.radians(lat)), 1e-6)
+    return [
+        [round(lon + dlon * math.cos(angle), 7), round(lat + dlat * math.sin(angle), 7)]
+        for angle in (2 * math.pi * i / segments for i in range(segments))
+    ]
+
+
+class FenceIndex:
+    """Geofences by the grid cells their bounding boxes overlap."""
+
+    def __init__(self, fences, cell_degrees: float = CELL_DEGREES):
+        self.cell_degrees = cell_degrees
+        self.polygons = {}
+        self.boxes = {}
+        self._cells: Dict[tuple, list] = defaultdict(list)
+        for fence_id, polygon, box in fences:
+            self.polygons[fence_id] = polygon
+            self.boxes[fence_id] = box
+            for row in range(self._cell(box['min_lat']), self._cell(box['max_lat']) + 1):
+                for col in range(self._cell(box['min_lon']), self._cell(box['max_lon']) + 1):
+                    self._cells[(row, col)].append(fence_id)
+
+    def __len__(self):
+        return len(self.polygons)
+
+    def _cell(self, value: float) -> int:
+        return math.floor(value / self.cell_degrees)
+
+    def locate(self, lat, lon) -> List[frozenset]:
+        """Ids of the fences containing each point of the coordinate arrays."""
+
+        lat = np.asarray(lat, dtype=float)
+        lon = np.asarray(lon, dtype=float)
+        found = [frozenset()] * len(lat)
+        if not len(lat) or not self._cells:
+            return found
+
+        cells = np.stack((np.floor(lat / self.cell_degrees), np.floor(lon / self.cell_degrees)), axis=1)
+        unique, inverse = np.unique(cells.astype(np.int64), axis=0, return_inverse=True)
+        inverse = inverse.ravel()
+        order = np.argsort(inverse, kind='stable')
+        bounds = np.searchsorted(inverse[order], np.arange(len(unique) + 1))
+
+        # points of the cells each fence overlaps
+        candidates = defaultdict(list)
+        for cell_index, (row, col) in enumerate(unique.tolist()):
+            for fence_id in self._cells.get((row, col), ()):
+                candidates[fence_id].append(order[bounds[cell_index]:bounds[cell_index + 1]])
+
+        hits = defaultdict(set)
+        for fence_id, parts in candidates.items():
+            index = np.concatenate(parts)
+            box = self.boxes[fence_id]
+            plat, plon = lat[index], lon[index]
+            in_box = (plat >= box['min_lat']) & (plat <= box['max_lat']) & \
+                     (plon >= box['min_lon']) & (plon <= box['max_lon'])
+            index, plat, plon = index[in_box], plat[in_box], plon[in_box]
+            if not len(index):
+                continue
+            for point in index[points_in_polygon(plat, plon, self.polygons[fence_id])].tolist():
+                hits[point].add(fence_id)
+
+        for point, fence_ids in hits.items():
+            found[point] = frozenset(fence_ids)
+        return found
+
+    def contains(self, fence_id: int, lat: float, lon: float) -> bool:
+        polygon = self.polygons.get(fence_id)
+        return polygon is not None and bool(points_in_polygon([lat], [lon], polygon)[0])
+
+
+class _FenceCache:
+    """Per-process FenceIndex of all geofences, rebuilt every `ttl` seconds."""
+
+    def __init__(self, ttl: float = FENCE_CACHE_TTL):
+        self.ttl = ttl
+        self._index = None
+        self._loaded_at = 0.0
+        self._lock = threading.Lock()
+
+    def get(self) -> FenceIndex:
+        if self._index is None or time.monotonic() - self._loaded_at > self.ttl:
+            with self._lock:
+                rows = db.session.query(
+                    Geofence.id, Geofence.polygon, Geofence.min_lat, Geofence.min_lon,
+                    Geofence.max_lat, Geofence.max_lon,
+                ).all()
+                self._index = FenceIndex(
+                    (fence_id, polygon,
+                     {'min_lat': min_lat, 'min_lon': min_lon, 'max_lat': max_lat, 'max_lon': max_lon})
+                    for fence_id, polygon, min_lat, min_lon, max_lat, max_lon in rows
+                )
+                self._loaded_at = time.monotonic()
+        return self._index
+
+    def invalidate(self):
+        self._index = None
+
+
+fences = _FenceCache()
+
+
+def _timestamp(value: datetime) -> float:
+    return (value - _EPOCH).total_seconds()
+
+
+def process_fixes(fixes):
+    """Check fixes against the geofences, record events and advance routes.
+
+    `fixes` are (vehicle_id, unix seconds, lat, lon, speed, odometer) tuples as
+    produced by services.telemetry; the caller commits.
+    """
+
+    index = fences.get()
+    if not fixes or not len(index):
+        return []
+
+    fixes = sorted(fixes, key=lambda fix: (fix[0], fix[1]))
+    vehicle_ids = sorted({fix[0] for fix in fixes})
+    # SELECT ... FOR UPDATE only locks rows that exist: without a row two
+    # uploads for a new vehicle would both see it outside every fence
+    db.session.execute(CREATE_STATES_SQL, {'vehicle_ids': vehicle_ids})
+    states = {
+        state.vehicle_id: state
+        for state in VehicleGeofenceState.query
+        .filter(VehicleGeofenceState.vehicle_id.in_(vehicle_ids))
+        .order_by(VehicleGeofenceState.vehicle_id)
+        .with_for_update()
+    }
+    located = index.locate([fix[2] for fix in fixes], [fix[3] for fix in fixes])
+
+    events = []
+    checked = {}
+    inside_now = {}
+    for fix, fence_ids in zip(fixes, located):
+        vehicle_id, ts = fix[0], fix[1]
+        if vehicle_id not in checked:
+            state = states.get(vehicle_id)
+            checked[vehicle_id] = _timestamp(state.checked_at) if state else float('-inf')
+            # fences deleted since then are forgotten without an exit
+            inside_now[vehicle_id] = frozenset(
+                fence_id for fence_id in (state.inside if state else ()) if fence_id in index.polygons
+            )
+        if ts <= checked[vehicle_id]:
+            continue
+        previous = inside_now[vehicle_id]
+        for fence_id in sorted(fence_ids - previous):
+            events.append((vehicle_id, fence_id, ts, True))
+        for fence_id in sorted(previous - fence_ids):
+            events.append((vehicle_id, fence_id, ts, False))
+        inside_now[vehicle_id] = fence_ids
+        checked[vehicle_id] = ts
+
+    updated = [vehicle_id for vehicle_id in vehicle_ids if checked[vehicle_id] != float('-inf')]
+    if updated:
+        db.session.execute(
+            UPSERT_STATE_SQL,
+            {
+                'vehicle_ids': updated,
+                'checked_at': [fix_datetime(checked[vehicle_id]) for vehicle_id in updated],
+                'inside': ['{%s}' % ','.join(map(str, sorted(inside_now[vehicle_id]))) for vehicle_id in updated],
+            },
+        )
+    if events:
+        db.session.execute(
+            INSERT_EVENTS_SQL,
+            {
+                'vehicle_ids': [event[0] for event in events],
+                'geofence_ids': [event[1] for event in events],
+                'recorded_at': [fix_datetime(event[2]) for event in events],
+                'entered': [event[3] for event in events],
+            },
+        )
+        advance_routes(events, index)
+    return events
+
+
+def advance_routes(events, index: FenceIndex):
+    """Mark the day's routes started or completed from geofence events."""
+
+    days = {fix_local_date(event[2]) for event in events}
+    routes = defaultdict(list)
+    for route in (
+        Route.query
+        .filter(
+            Route.vehicle_id.in_({event[0] for event in events}),
+            Route.date.in_(days),
+            Route.status != 'completed',
+            Route.start_lat.isnot(None),
+            Route.end_lat.isnot(None),
+        )
+        .order_by(Route.date, Route.id)
+        .all()
+    ):
+        routes[route.vehicle_id].append(route)
+
+    changed = set()
+    for vehicle_id, fence_id, ts, entered in sorted(events, key=lambda event: event[2]):
+        at, day = fix_datetime(ts), fix_local_date(ts)
+        for route in routes.get(vehicle_id, ()):
+            if route.date != day:
+                continue
+            if (
+                not entered and route.status == 'planned'
+                and index.contains(fence_id, route.start_lat, route.start_lon)
+            ):
+                route.status, route.started_at = 'in_progress', at
+                changed.add(route)
+                break
+            if (
+                entered and route.status == 'in_progress'
+                and index.contains(fence_id, route.end_lat, route.end_lon)
+            ):
+                route.status, route.completed_at = 'completed', at
+                changed.add(route)
+                break
+
+    # completed routes teach the travel-time store (services/eta.py)
+    record_trips(route for route in changed if route.status == 'completed')
+    for route in changed:
+        publish_route_change(route, 'updated')
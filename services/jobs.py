@@ -0,0 +1,501 @@
+"""PostgreSQL-backed job queue.
+
+Jobs are rows in the `job` table. `enqueue()` adds one inside the caller's
+transaction, so a job becomes visible exactly when the data it refers to is
+committed. `flask worker` claims jobs with `SELECT ... FOR UPDATE SKIP LOCKED`,
+runs the registered handler and records the outcome: done, queued again with
+exponential backoff, or dead once `max_attempts` is exhausted.
+
+At most one job per `dedupe_key` is queued or running. Enqueueing a key whose
+job is already running marks that job dirty instead, and it is queued again
+when it finishes, so changes made while it ran are not lost.
+"""
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+import importlib
+import logging
+import os
+import random
+import signal
+import socket
+import threading
+import time
+import traceback
+from typing import Callable
+
+import click
+from flask import current_app
+from flask.cli import AppGroup
+from sqlalchemy import bindparam, case, delete, func, text, update
+from sqlalchemy.dialects.postgresql import insert
+
+from app import db
+from models.job import Job
+
+
+logger = logging.getLogger(__name__)
+
+# Modules whose import registers job handlers through @job_handler.
+HANDLER_MODULES = [
+    'services.route_enrichment',
+    'services.mileage',
+    'services.trips',
+    'services.fuel',
+    'services.route_planner',
+]
+
+BACKOFF_BASE_SECONDS = 10
+BACKOFF_MAX_SECONDS = 3600
+# The worker refreshes locked_at of its running jobs this often; a running
+# job not refreshed within STALE_AFTER (crash, OOM kill) is put back into
+# the queue.
+HEARTBEAT_INTERVAL = timedelta(seconds=60)
+STALE_AFTER = timedelta(minutes=5)
+
+
+@dataclass
+class JobType:
+    name: str
+    func: Callable[[dict], dict]
+    concurrency: int = None
+    max_attempts: int = 5
+
+
+HANDLERS = {}
+
+
+def job_handler(job_type: str, concurrency: int = None, max_attempts: int = 5):
+    """Register `func(payload)` as the handler of `job_type`.
+
+    `concurrency` caps how many jobs of this type run at once across all
+    workers; None means no cap. Whatever `func` returns is stored in
+    `job.result` when the job is done.
+    """
+
+    def decorator(func):
+        HANDLERS[job_type] = JobType(job_type, func, concurrency, max_attempts)
+        return func
+
+    return decorator
+
+
+def enqueue(job_type: str, payload: dict = None, priority: int = 0, run_at: datetime = None,
+            dedupe_key: str = None, max_attempts: int = None) -> int:
+    """Add a job in the current transaction and return its id; the caller commits.
+
+    With `dedupe_key` the insert is skipped while another job with the same key
+    is queued (its id is returned); a running one is marked dirty and runs
+    again after it finishes.
+    """
+
+    handler = HANDLERS.get(job_type)
+    values = {
+        'job_type': job_type,
+        'payload': payload or {},
+        'priority': priority,
+        'status': 'queued',
+        'dedupe_key': dedupe_key,
+        'attempts': 0,
+        'max_attempts': max_attempts or (handler.max_attempts if handler else 5),
+        'run_at': run_at or datetime.utcnow(),
+        'created_at': datetime.utcnow(),
+        'updated_at': datetime.utcnow(),
+    }
+    statement = insert(Job.__table__).values(**values)
+    if dedupe_key:
+        statement = _merge_duplicate(statement)
+    return db.session.execute(statement.returning(Job.__table__.c.id)).scalar_one()
+
+
+def _merge_duplicate(statement):
+    """ON CONFLICT for the dedupe key: keep the live job, mark it dirty if it runs."""
+
+    return statement.on_conflict_do_update(
+        index_elements=['dedupe_key'],
+        index_where=text("status IN ('queued', 'running')"),
+        set_={
+            'dirty': Job.__table__.c.dirty | (Job.__table__.c.status == 'running'),
+            'priority': func.greatest(Job.__table__.c.priority, statement.excluded.priority),
+        },
+    )
+
+
+def enqueue_many(job_type: str, payloads, priority: int = 0, run_at: datetime = None, dedupe_keys=None):
+    """Add many jobs of one type with a single INSERT; the caller commits.
+
+    `dedupe_keys`, when given, is aligned with `payloads` (see enqueue()).
+    """
+
+    payloads = list(payloads)
+    if not payloads:
+        return
+    handler = HANDLERS.get(job_type)
+    now = datetime.utcnow()
+    keys = list(dedupe_keys) if dedupe_keys is not None else [None] * len(payloads)
+    if dedupe_keys is not None:
+        # ON CONFLICT DO UPDATE may not touch one row twice in a statement
+        unique = {}
+        for payload, key in zip(payloads, keys):
+            unique.setdefault(key, payload)
+        keys, payloads = list(unique), list(unique.values())
+    statement = insert(Job.__table__).values([
+        {
+            'job_type': job_type,
+            'payload': payload or {},
+            'priority': priority,
+            'status': 'queued',
+            'dedupe_key': key,
+            'attempts': 0,
+            'max_attempts': handler.max_attempts if handler else 5,
+            'run_at': run_at or now,
+            'created_at': now,
+            'updated_at': now,
+        }
+        for payload, key in zip(payloads, keys)
+    ])
+    if dedupe_keys is not None:
+        statement = _merge_duplicate(statement)
+    db.session.execute(statement)
+
+
+def load_handlers():
+    for module in HANDLER_MODULES:
+        importlib.import_module(module)
+
+
+def _backoff(attempts: int) -> float:
+    delay = min(BACKOFF_BASE_SECONDS * 2 ** max(attempts - 1, 0), BACKOFF_MAX_SECONDS)
+    return delay * random.uniform(0.8, 1.2)
+
+
+CLAIM_SQL = text(
+    """
+    UPDATE job
+    SET status = 'running', locked_by = :worker, locked_at = :now, dirty = false,
+        attempts = attempts + 1, updated_at = :now
+    WHERE id = (
+        SELECT id FROM job
+        WHERE status = 'queued' AND run_at <= :now AND job_type IN :types
+        ORDER BY priority DESC, run_at
+        LIMIT 1
+        FOR UPDATE SKIP LOCKED
+    )
+    RETURNING id, job_type, payload, attempts, max_attempts
+    """
+).bindparams(bindparam('types', expanding=True))
+
+RUNNING_COUNTS_SQL = text(
+    "SELECT job_type, count(*) FROM job WHERE status = 'running' GROUP BY job_type"
+)
+CLAIM_LOCK_SQL = text("SELECT pg_advisory_xact_lock(hashtext('job.claim:' || :type))")
+
+
+def _claimable_types(job_types):
+    capped = {name for name in job_types if HANDLERS[name].concurrency}
+    if not capped:
+        return list(job_types)
+
+    # Claims of a capped type are serialized until commit, so two workers
+    # cannot both count the same free slot. Sorted to avoid lock cycles.
+    for name in sorted(capped):
+        db.session.execute(CLAIM_LOCK_SQL, {'type': name})
+    running = dict(db.session.execute(RUNNING_COUNTS_SQL).all())
+    return [
+        name for name in job_types
+        if name not in capped or running.get(name, 0) < HANDLERS[name].concurrency
+    ]
+
+
+def claim(worker_name: str, job_types):
+    types = _claimable_types(job_types)
+    if not types:
+        db.session.rollback()
+        return None
+
+    row = db.session.execute(
+        CLAIM_SQL, {'worker': worker_name, 'now': datetime.utcnow(), 'types': types}
+    ).first()
+    db.session.commit()
+    return row
+
+
+def heartbeat(worker_name: str) -> int:
+    """Refresh locked_at of the jobs this worker is running."""
+
+    now = datetime.utcnow()
+    result = db.session.execute(
+        update(Job)
+        .where(Job.status == 'running', Job.locked_by == worker_name)
+        .values(locked_at=now)
+    )
+    db.session.commit()
+    return result.rowcount
+
+
+def requeue_stale():
+    now = datetime.utcnow()
+    result = db.session.execute(
+        text(
+            """
+            UPDATE job
+            SET status = CASE WHEN attempts >= max_attempts THEN 'dead' ELSE 'queued' END,
+                locked_by = NULL, locked_at = NULL, run_at = :now, updated_at = :now,
+                last_error = 'worker lost while running the job'
+            WHERE status = 'running' AND locked_at < :stale_before
+            """
+        ),
+        {'now': now, 'stale_before': now - STALE_AFTER},
+    )
+    db.session.commit()
+    return result.rowcount
+
+
+class WorkerMetrics:
+    """Per job type counters, logged periodically by the worker."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stats = {}
+
+    def record(self, job_type: str, outcome: str, duration_ms: int):
+        with self._lock:
+            stats = self._stats.setdefault(
+                job_type, {'done': 0, 'retried': 0, 'dead': 0, 'total_ms': 0, 'max_ms': 0}
+            )
+            stats[outcome] += 1
+            stats['total_ms'] += duration_ms
+            stats['max_ms'] = max(stats['max_ms'], duration_ms)
+
+    def flush(self):
+        with self._lock:
+            stats, self._stats = self._stats, {}
+        for job_type, item in sorted(stats.items()):
+            count = item['done'] + item['retried'] + item['dead']
+            logger.info(
+                'jobs %s: done=%d retried=%d dead=%d avg=%.0fms max=%dms',
+                job_type, item['done'], item['retried'], item['dead'],
+                item['total_ms'] / count, item['max_ms'],
+            )
+
+
+class Worker:
+    def __init__(self, app, concurrency: int = 4, poll_interval: float = 1.0,
+                 job_types=None, metrics_interval: float = 60.0):
+        self.app = app
+        self.concurrency = concurrency
+        self.poll_interval = poll_interval
+        self.job_types = list(job_types or HANDLERS)
+        self.metrics_interval = metrics_interval
+        self.name = f'{socket.gethostname()}:{os.getpid()}'
+        self.metrics = WorkerMetrics()
+        self.stopping = threading.Event()
+
+    def run(self):
+        signal.signal(signal.SIGTERM, lambda *_: self.stop())
+        signal.signal(signal.SIGINT, lambda *_: self.stop())
+
+        threads = [
+            threading.Thread(target=self._loop, name=f'job-worker-{i}', daemon=True)
+            for i in range(self.concurrency)
+        ]
+        for thread in threads:
+            thread.start()
+
+        last_maintenance = last_heartbeat = 0.0
+        while not self.stopping.wait(1.0):
+            if time.monotonic() - last_heartbeat >= HEARTBEAT_INTERVAL.total_seconds():
+                last_heartbeat = time.monotonic()
+                with self.app.app_context():
+                    try:
+                        heartbeat(self.name)
+                    except Exception:
+                        db.session.rollback()
+                        logger.exception('Job heartbeat failed')
+            if time.monotonic() - last_maintenance >= self.metrics_interval:
+                last_maintenance = time.monotonic()
+                self.metrics.flush()
+                with self.app.app_context():
+                    try:
+                        requeued = requeue_stale()
+                        if requeued:
+                            logger.warning('Requeued %d stale jobs', requeued)
+                    except Exception:
+                        db.session.rollback()
+                        logger.exception('Stale job check failed')
+
+        for thread in threads:
+            thread.join()
+        self.metrics.flush()
+
+    def stop(self):
+        logger.info('Worker %s stopping after current jobs', self.name)
+        self.stopping.set()
+
+    def _loop(self):
+        while not self.stopping.is_set():
+            with self.app.app_context():
+                try:
+                    row = claim(self.name, self.job_types)
+                except Exception:
+                    db.session.rollback()
+                    logger.exception('Failed to claim a job')
+                    row = None
+
+                if row is None:
+                    self.stopping.wait(self.poll_interval)
+                    continue
+
+                self._execute(row)
+
+    def _execute(self, row):
+        job_id, job_type, payload, attempts, max_attempts = row
+        started = time.monotonic()
+        try:
+            result = HANDLERS[job_type].func(payload or {})
+        except Exception as exc:
+            db.session.rollback()
+            duration_ms = int((time.monotonic() - started) * 1000)
+            dead = attempts >= max_attempts
+            self._finish(
+                job_id,
+                status='dead' if dead else 'queued',
+                duration_ms=duration_ms,
+                run_at=None if dead else datetime.utcnow() + timedelta(seconds=_backoff(attempts)),
+                error=''.join(traceback.format_exception_only(type(exc), exc)).strip(),
+            )
+            self.metrics.record(job_type, 'dead' if dead else 'retried', duration_ms)
+            log = logger.error if dead else logger.warning
+            log('Job %s (%s) failed, attempt %d/%d: %s', job_id, job_type, attempts, max_attempts, exc)
+            return
+
+        duration_ms = int((time.monotonic() - started) * 1000)
+        self._finish(job_id, status='done', duration_ms=duration_ms, result=result)
+        self.metrics.record(job_type, 'done', duration_ms)
+
+    def _finish(self, job_id, status, duration_ms, run_at=None, error=None, result=None):
+        now = datetime.utcnow()
+        values = {
+            'status': status,
+            'duration_ms': duration_ms,
+            'locked_by': None,
+            'locked_at': None,
+            'dirty': False,
+            'updated_at': now,
+            'finished_at': now if status in ('done', 'dead') else None,
+        }
+        if run_at is not None:
+            values['run_at'] = run_at
+        if error is not None:
+            values['last_error'] = error
+        if result is not None:
+            values['result'] = result
+        if status in ('done', 'dead'):
+            # enqueued again while running: start over on the latest data
+            values.update(
+                status=case((Job.dirty, 'queued'), else_=status),
+                attempts=case((Job.dirty, 0), else_=Job.attempts),
+                run_at=case((Job.dirty, now), else_=Job.run_at),
+                finished_at=case((Job.dirty, None), else_=now),
+            )
+        db.session.execute(update(Job).where(Job.id == job_id).values(**values))
+        db.session.commit()
+
+
+@click.command('worker')
+@click.option('--concurrency', default=4, show_default=True, help='Число потоков-обработчиков.')
+@click.option('--poll-interval', default=1.0, show_default=True, help='Пауза при пустой очереди, с.')
+@click.option('--type', 'job_types', multiple=True, help='Обрабатывать только указанные типы задач.')
+def worker_command(concurrency, poll_interval, job_types):
+    """Запустить обработчик фоновых задач."""
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(name)s: %(message)s')
+    load_handlers()
+    unknown = set(job_types) - set(HANDLERS)
+    if unknown:
+        raise click.BadParameter(f"неизвестные типы задач: {', '.join(sorted(unknown))}")
+
+    worker = Worker(
+        current_app._get_current_object(),
+        concurrency=concurrency,
+        poll_interval=poll_interval,
+        job_types=job_types or None,
+    )
+    logger.info('Worker %s started: %s', worker.name, ', '.join(worker.job_types))
+    worker.run()
+
+
+jobs_cli = AppGroup('jobs', help='Управление очередью фоновых задач.')
+
+
+@jobs_cli.command('stats')
+def stats_command():
+    """Количество задач и время выполнения по типам и статусам."""
+
+    rows = db.session.execute(
+        text(
+            """
+            SELECT job_type, status, count(*),
+                   avg(duration_ms),
+                   percentile_cont(0.95) WITHIN GROUP (ORDER BY duration_ms)
+            FROM job
+            GROUP BY job_type, status
+            ORDER BY job_type, status
+            """
+        )
+    ).all()
+    for job_type, status, count, avg_ms, p95_ms in rows:
+        click.echo(
+            f'{job_type:<30} {status:<8} {count:>8}'
+            f"  avg={avg_ms or 0:.0f}ms p95={p95_ms or 0:.0f}ms"
+        )
+
+
+@jobs_cli.command('retry-dead')
+@click.option('--type', 'job_type', default=None, help='Только задачи этого типа.')
+def retry_dead_command(job_type):
+    """Вернуть задачи из dead-очереди на повторное выполнение."""
+
+    now = datetime.utcnow()
+    # a key may have one live job: skip keys that already have one and take
+    # only the latest dead job of each key
+    result = db.session.execute(
+        text(
+            """
+            UPDATE job
+            SET status = 'queued', attempts = 0, run_at = :now, updated_at = :now, finished_at = NULL
+            WHERE status = 'dead'
+              AND (CAST(:job_type AS varchar) IS NULL OR job_type = :job_type)
+              AND (
+                  dedupe_key IS NULL
+                  OR (
+                      id = (SELECT max(d.id) FROM job d WHERE d.dedupe_key = job.dedupe_key AND d.status = 'dead')
+                      AND NOT EXISTS (
+                          SELECT 1 FROM job live
+                          WHERE live.dedupe_key = job.dedupe_key AND live.status IN ('queued', 'running')
+                      )
+                  )
+              )
+            """
+        ),
+        {'now': now, 'job_type': job_type},
+    )
+    db.session.commit()
+    click.echo(f'Возвращено в очередь: {result.rowcount}')
+
+
+@jobs_cli.command('purge')
+@click.option('--older-than-days', default=7, show_default=True)
+def purge_command(older_than_days):
+    """Удалить выполненные задачи старше указанного срока."""
+
+    cutoff = datetime.utcnow() - timedelta(days=older_than_days)
+    result = db.session.execute(
+        delete(Job).where(Job.status == 'done', Job.finished_at < cutoff)
+    )
+    db.session.commit()
+    click.echo(f'Удалено задач: {result.rowcount}')
+
+
+def init_jobs(app):
+    app.cli.add_command(worker_command)
+    app.cli.add_command(jobs_cli)
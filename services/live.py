@@ -0,0 +1,292 @@
+"""Live vehicle positions and dashboard events.
+
+The latest position of every vehicle lives in the UNLOGGED `vehicle_position`
+table, so all web workers see the same state without an extra service.
+Writers announce changes with NOTIFY inside their own transaction, which
+PostgreSQL delivers only on commit. Each web process keeps one LISTEN
+connection (`LiveHub`) and fans the events out to its SSE subscribers.
+
+A subscriber keeps only the newest pending state per vehicle and per route:
+a client that reads slowly skips intermediate positions instead of making
+the server buffer them.
+"""
+from collections import defaultdict
+import logging
+import select
+import threading
+import time
+
+import orjson
+from sqlalchemy import bindparam, text
+
+from app import db
+from services.telemetry import fix_datetime
+
+
+logger = logging.getLogger(__name__)
+
+CHANNEL = 'fleet_live'
+# PostgreSQL rejects NOTIFY payloads of 8000 bytes and more.
+NOTIFY_PAYLOAD_LIMIT = 7500
+# A subscriber with more pending keys than this gets a fresh snapshot instead.
+MAX_PENDING = 5000
+LISTEN_POLL_SECONDS = 5.0
+RECONNECT_DELAY_SECONDS = 2.0
+
+UPSERT_POSITIONS_SQL = text(
+    """
+    INSERT INTO vehicle_position (vehicle_id, recorded_at, lat, lon, speed_kmh, updated_at)
+    SELECT v.vehicle_id, v.recorded_at, v.lat, v.lon, v.speed_kmh, now() at time zone 'utc'
+    FROM unnest(
+        CAST(:vehicle_ids AS integer[]), CAST(:recorded_at AS timestamp[]),
+        CAST(:lats AS double precision[]), CAST(:lons AS double precision[]),
+        CAST(:speeds AS real[])
+    ) WITH ORDINALITY AS v(vehicle_id, recorded_at, lat, lon, speed_kmh, n)
+    ORDER BY v.n
+    ON CONFLICT (vehicle_id) DO UPDATE
+    SET recorded_at = EXCLUDED.recorded_at, lat = EXCLUDED.lat, lon = EXCLUDED.lon,
+        speed_kmh = EXCLUDED.speed_kmh, updated_at = EXCLUDED.updated_at
+    WHERE vehicle_position.recorded_at < EXCLUDED.recorded_at
+    RETURNING vehicle_id, recorded_at, lat, lon, speed_kmh
+    """
+).bindparams(*(bindparam(name) for name in ('vehicle_ids', 'recorded_at', 'lats', 'lons', 'speeds')))
+
+SNAPSHOT_SQL = text(
+    """
+    SELECT p.vehicle_id, p.recorded_at, p.lat, p.lon, p.speed_kmh, v.reg_number
+    FROM vehicle_position p
+    JOIN vehicle v ON v.id = p.vehicle_id
+    ORDER BY p.vehicle_id
+    """
+)
+
+
+def _position(vehicle_id, recorded_at, lat, lon, speed_kmh) -> dict:
+    return {
+        'vehicle_id': vehicle_id,
+        'recorded_at': recorded_at.isoformat() + 'Z',
+        'lat': lat,
+        'lon': lon,
+        'speed_kmh': speed_kmh,
+    }
+
+
+def publish(event: str, items):
+    """NOTIFY listeners about `items` of `event`; delivered when the caller commits."""
+
+    batch, size = [], 0
+    for item in items:
+        encoded = orjson.dumps(item)
+        if batch and size + len(encoded) > NOTIFY_PAYLOAD_LIMIT:
+            _notify(event, batch)
+            batch, size = [], 0
+        batch.append(encoded)
+        size += len(encoded) + 1
+    if batch:
+        _notify(event, batch)
+
+
+def _notify(event: str, encoded_items):
+    payload = b'{"event":"%s","items":[%s]}' % (event.encode(), b','.join(encoded_items))
+    db.session.execute(
+        text('SELECT pg_notify(:channel, :payload)'),
+        {'channel': CHANNEL, 'payload': payload.decode()},
+    )
+
+
+def update_positions(fixes):
+    """Store the newest fix per vehicle and publish the positions that changed.
+
+    `fixes` are (vehicle_id, unix seconds, lat, lon, speed, odometer) tuples as
+    produced by services.telemetry; the caller commits.
+    """
+
+    latest = {}
+    for fix in fixes:
+        current = latest.get(fix[0])
+        if current is None or fix[1] > current[1]:
+            latest[fix[0]] = fix
+    if not latest:
+        return
+    # concurrent uploads lock the rows in the same (vehicle id) order, so they
+    # wait for each other instead of deadlocking
+    latest = dict(sorted(latest.items()))
+
+    rows = db.session.execute(
+        UPSERT_POSITIONS_SQL,
+        {
+            'vehicle_ids': list(latest),
+            'recorded_at': [fix_datetime(fix[1]) for fix in latest.values()],
+            'lats': [fix[2] for fix in latest.values()],
+            'lons': [fix[3] for fix in latest.values()],
+            'speeds': [fix[4] for fix in latest.values()],
+        },
+    ).all()
+    publish('position', (_position(*row) for row in rows))
+
+
+def _route_item(route, action: str) -> dict:
+    item = {'id': route.id, 'action': action}
+    if action != 'deleted':
+        item.update({
+            'date': route.date.isoformat(),
+            'start_location': route.start_location,
+            'end_location': route.end_location,
+            'driver_id': route.driver_id,
+            'vehicle_id': route.vehicle_id,
+            'distance': route.distance,
+            'status': route.status,
+        })
+    return item
+
+
+def publish_route_change(route, action: str):
+    """Announce a created/updated/deleted route; the caller commits."""
+
+    publish('route', [_route_item(route, action)])
+
+
+def publish_route_changes(routes, action: str):
+    """publish_route_change() for many routes, packed into few notifications."""
+
+    publish('route', (_route_item(route, action) for route in routes))
+
+
+def snapshot() -> dict:
+    rows = db.session.execute(SNAPSHOT_SQL).all()
+    # the stream stays open for minutes, do not keep the connection meanwhile
+    db.session.close()
+    positions = []
+    for vehicle_id, recorded_at, lat, lon, speed_kmh, reg_number in rows:
+        position = _position(vehicle_id, recorded_at, lat, lon, speed_kmh)
+        position['reg_number'] = reg_number
+        positions.append(position)
+    return {'positions': positions}
+
+
+class Subscriber:
+    """Pending events of one SSE client, coalesced by (event, key)."""
+
+    KEYS = {'position': 'vehicle_id', 'route': 'id'}
+
+    def __init__(self, max_pending: int = MAX_PENDING):
+        self.max_pending = max_pending
+        self._pending = {}
+        self._resync = False
+        self._lock = threading.Lock()
+        self._ready = threading.Event()
+
+    def offer(self, event: str, item: dict):
+        key = (event, item.get(self.KEYS.get(event, 'id')))
+        with self._lock:
+            if key not in self._pending and len(self._pending) >= self.max_pending:
+                self._pending.clear()
+                self._resync = True
+            elif not self._resync:
+                self._pending[key] = item
+        self._ready.set()
+
+    def resync(self):
+        with self._lock:
+            self._pending.clear()
+            self._resync = True
+        self._ready.set()
+
+    def take(self, timeout: float):
+        """Wait up to `timeout` for events; return (events by type, resync) or None."""
+
+        if not self._ready.wait(timeout):
+            return None
+        with self._lock:
+            self._ready.clear()
+            pending, self._pending = self._pending, {}
+            resync, self._resync = self._resync, False
+
+        events = defaultdict(list)
+        for (event, _), item in pending.items():
+            events[event].append(item)
+        return events, resync
+
+
+class LiveHub:
+    """Per-process LISTEN connection feeding the local subscribers."""
+
+    def __init__(self):
+        self._subscribers = set()
+        self._lock = threading.Lock()
+        self._listener = None
+
+    def subscribe(self, engine, subscriber=None):
+        """Register `subscriber` (anything with offer()/resync(), a new Subscriber by default)."""
+
+        subscriber = subscriber or Subscriber()
+        with self._lock:
+            self._subscribers.add(subscriber)
+            if self._listener is None:
+                self._listener = threading.Thread(
+                    target=self._listen, args=(engine,), name='live-listener', daemon=True
+                )
+                self._listener.start()
+        return subscriber
+
+    def unsubscribe(self, subscriber: Subscriber):
+        with self._lock:
+            self._subscribers.discard(subscriber)
+
+    @property
+    def subscriber_count(self) -> int:
+        return len(self._subscribers)
+
+    def dispatch(self, payload: str):
+        message = orjson.loads(payload)
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for item in message['items']:
+            for subscriber in subscribers:
+                subscriber.offer(message['event'], item)
+
+    def _resync_all(self):
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for subscriber in subscribers:
+            subscriber.resync()
+
+    def _listen(self, engine):
+        reconnect = False
+        while True:
+            connection = None
+            try:
+                connection = engine.raw_connection()
+                # a long-lived LISTEN connection must not go back to the pool
+                connection.detach()
+                dbapi_connection = connection.dbapi_connection
+                dbapi_connection.autocommit = True
+                with dbapi_connection.cursor() as cursor:
+                    cursor.execute(f'LISTEN {CHANNEL}')
+                if reconnect:
+                    # anything published while we were disconnected is lost
+                    self._resync_all()
+                reconnect = True
+
+                while True:
+                    readable, _, _ = select.select([dbapi_connection], [], [], LISTEN_POLL_SECONDS)
+                    if not readable:
+                        continue
+                    dbapi_connection.poll()
+                    while dbapi_connection.notifies:
+                        notify = dbapi_connection.notifies.pop(0)
+                        try:
+                            self.dispatch(notify.payload)
+                        except Exception:
+                            logger.exception('Bad live event payload')
+            except Exception:
+                logger.exception('Live listener connection lost, reconnecting')
+                if connection is not None:
+                    try:
+                        connection.close()
+                    except Exception:
+                        pass
+                time.sleep(RECONNECT_DELAY_SECONDS)
+
+
+hub = LiveHub()
@@ -0,0 +1,178 @@
+"""Client for the YandexMaps proxy service (`YandexMaps/app.py`)."""
+import os
+import threading
+
+import requests
+
+
+MAP_PROXY_ENDPOINTS = [
+    os.environ.get('MAPS_PROXY_URL'),
+    'http://yandexmaps:8081/directions',
+    'http://localhost:8081/directions',
+]
+
+# (connect, read) timeouts. Only unreachable endpoints fall through to the next
+# one, so a slow proxy costs at most one read timeout per request.
+MAP_PROXY_TIMEOUT = (2, float(os.environ.get('MAPS_PROXY_TIMEOUT', 8)))
+
+# Upper bound on simultaneous proxy calls per worker. When the proxy is slow the
+# extra callers skip the map preview instead of queueing behind it.
+MAP_PROXY_MAX_CONCURRENCY = int(os.environ.get('MAPS_PROXY_MAX_CONCURRENCY', 20))
+
+_map_proxy_slots = threading.BoundedSemaphore(MAP_PROXY_MAX_CONCURRENCY)
+_map_proxy_session = requests.Session()
+
+
+def _endpoint_for(directions_url: str, path: str) -> str:
+    base = directions_url[:-len('/directions')] if directions_url.endswith('/directions') else directions_url
+    return f"{base.rstrip('/')}/{path}"
+
+
+class MapProxyBusy(Exception):
+    """The proxy answered 429/503; retry after `retry_after` seconds."""
+
+    def __init__(self, retry_after: float):
+        super().__init__(f'maps proxy busy, retry after {retry_after:g} s')
+        self.retry_after = retry_after
+
+
+def _retry_after(response) -> float:
+    try:
+        return max(float(response.headers.get('Retry-After', 1)), 0.0)
+    except ValueError:
+        return 1.0
+
+
+def call_map_proxy(payload, path: str = 'directions', timeout=MAP_PROXY_TIMEOUT, raise_busy: bool = False):
+    """Try contacting the maps proxy service with fallbacks.
+
+    With `raise_busy` a 429/503 answer raises MapProxyBusy instead of giving
+    None, so batch callers can back off and repeat the call.
+    """
+
+    if not _map_proxy_slots.acquire(timeout=0.5):
+        return None
+
+    try:
+        for endpoint in [ep for ep in MAP_PROXY_ENDPOINTS if ep]:
+            try:
+                response = _map_proxy_session.post(
+                    _endpoint_for(endpoint, path), json=payload, timeout=timeout
+                )
+            except requests.ConnectionError:
+                continue
+            except requests.RequestException:
+                return None
+
+            if raise_busy and response.status_code in (429, 503):
+                raise MapProxyBusy(_retry_after(response))
+            if not response.ok:
+                return None
+            try:
+                return response.json()
+            except ValueError:
+                return None
+        return None
+    finally:
+        _map_proxy_slots.release()
+
+
+# intermediate stops accepted on a route
+MAX_ROUTE_STOPS = 50
+
+
+def clean_stops(value):
+    """Stop addresses from a request payload, or raise ValueError.
+
+    Accepts a list of addresses or a single address string (the older
+    `waypoint` field); blank entries are dropped, no stops gives None.
+    """
+
+    if value is None:
+        return None
+    if isinstance(value, str):
+        value = [value]
+    if not isinstance(value, list) or not all(isinstance(stop, str) for stop in value):
+        raise ValueError('Остановки передаются списком адресов.')
+    stops = [stop.strip() for stop in value if stop.strip()]
+    if len(stops) > MAX_ROUTE_STOPS:
+        raise ValueError(f'Не больше {MAX_ROUTE_STOPS} промежуточных остановок.')
+    if any(len(stop) > 100 for stop in stops):
+        raise ValueError('Адрес остановки длиннее 100 символов.')
+    return stops or None
+
+
+def map_preview(start_location: str, end_location: str, stops=None, optimize: bool = False,
+                preference: str = None):
+    payload = {
+        'start': start_location,
+        'end': end_location,
+        'stops': list(stops or []),
+        'optimize': optimize,
+        'preference': preference,
+    }
+
+    # a long route with reordering takes a matrix and several route calls
+    timeout = (2, max(MAP_PROXY_TIMEOUT[1], 30)) if stops and len(stops) > 1 else MAP_PROXY_TIMEOUT
+    return call_map_proxy(payload, timeout=timeout)
+
+
+def batch_distances(pairs):
+    """Distance/duration for [(start, end), ...] via the proxy's /distances.
+
+    Returns a list aligned with `pairs` (None for unresolved pairs), or None
+    when the proxy could not be reached. Raises MapProxyBusy on 429/503.
+    """
+
+    data = call_map_proxy(
+        {'pairs': [{'start': start, 'end': end} for start, end in pairs]},
+        path='distances',
+        timeout=(2, 120),
+        raise_busy=True,
+    )
+    if not data or not isinstance(data.get('results'), list):
+        return None
+    return data['results']
+
+
+def distance_matrix(sources, destinations):
+    """Driving {'distances': [[m]], 'durations': [[s]]} via the proxy's /matrix.
+
+    Points are (lon, lat); cells the router could not answer are None.
+    Returns None when the proxy could not be reached.
+    """
+
+    data = call_map_proxy(
+        {'sources': [list(point) for point in sources], 'destinations': [list(point) for point in destinations]},
+        path='matrix',
+        # the proxy runs a large matrix a few OSRM blocks at a time
+        timeout=(2, 300),
+    )
+    if not data or not isinstance(data.get('distances'), list):
+        return None
+    return data
+
+
+def geocode_address(address: str):
+    """(lon, lat) of an address via the proxy's /geocode, or None."""
+
+    data = call_map_proxy({'address': address}, path='geocode')
+    if not data or data.get('lon') is None or data.get('lat') is None:
+        return None
+    return float(data['lon']), float(data['lat'])
+
+
+def format_distance(distance_km):
+    if not distance_km:
+        return None
+    return f"{round(distance_km, 1)} км"
+
+
+def format_duration(seconds):
+    if seconds is None:
+        return None
+    minutes = int(round(seconds / 60))
+    hours, mins = divmod(minutes, 60)
+    if hours:
+        return f"{hours} ч {mins} мин"
+    return f"{mins} мин"
@@ -0,0 +1,224 @@
+"""Driven distance per vehicle and day from GPS tracks.
+
+A day of telemetry is read with one COPY per batch of vehicles into NumPy
+arrays sorted by (vehicle, time) and processed without Python loops over
+fixes:
+
+- a fix is a jump when the implied speed on both sides of it exceeds
+  `MAX_SPEED_KMH` (or on its only side at the ends of a track); jumps are
+  dropped and the check repeats on the remaining fixes;
+- segments between consecutive fixes of the same vehicle are summed, except
+  those still faster than `MAX_SPEED_KMH` (teleports after data gaps) and
+  those where the tracker reports standing still at both ends (GPS drift).
+
+Days are fleet-local (FLEET_TIMEZONE), the same days as `route.date`, so
+GPS and planned kilometres can be added up day by day. Results go to
+`vehicle_daily_distance`. The ingest endpoint queues
+`mileage.compute` for the days it received fixes for, so the aggregates
+follow the incoming data; `flask mileage compute` recalculates any range.
+"""
+from datetime import date, datetime, timedelta
+import io
+import time
+
+import click
+import numpy as np
+from flask.cli import AppGroup
+from sqlalchemy import bindparam, text
+
+from app import db
+from models.vehicle import Vehicle
+from services.geo import EARTH_RADIUS_KM
+from services.jobs import enqueue, job_handler
+from services.pgcopy import copy_expert
+from services.telemetry import fleet_today, local_day_start
+
+
+COMPUTE_JOB = 'mileage.compute'
+# Recalculation of a day waits this long, so a stream of uploads is
+# folded into one run.
+COMPUTE_DELAY = timedelta(minutes=10)
+
+MAX_SPEED_KMH = 200.0
+STOP_SPEED_KMH = 3.0
+JUMP_PASSES = 3
+VEHICLES_PER_BATCH = 200
+
+TRACK_COPY_SQL = """
+    COPY (
+        SELECT vehicle_id, extract(epoch FROM recorded_at), lat, lon, coalesce(speed_kmh, 'NaN')
+        FROM telemetry_fix
+        WHERE recorded_at >= '{start}' AND recorded_at < '{end}'
+          AND vehicle_id BETWEEN {first_id} AND {last_id}
+        ORDER BY vehicle_id, recorded_at
+    ) TO STDOUT
+"""
+
+UPSERT_SQL = text(
+    """
+    INSERT INTO vehicle_daily_distance (vehicle_id, day, distance_km, fixes, rejected_fixes, updated_at)
+    SELECT v.vehicle_id, :day, v.distance_km, v.fixes, v.rejected_fixes, now() at time zone 'utc'
+    FROM unnest(
+        CAST(:vehicle_ids AS integer[]), CAST(:distances AS double precision[]),
+        CAST(:fixes AS integer[]), CAST(:rejected AS integer[])
+    ) AS v(vehicle_id, distance_km, fixes, rejected_fixes)
+    ON CONFLICT (vehicle_id, day) DO UPDATE
+    SET distance_km = EXCLUDED.distance_km, fixes = EXCLUDED.fixes,
+        rejected_fixes = EXCLUDED.rejected_fixes, updated_at = EXCLUDED.updated_at
+    """
+).bindparams(*(bindparam(name) for name in ('vehicle_ids', 'distances', 'fixes', 'rejected')))
+
+mileage_cli = AppGroup('mileage', help='Пробег по данным GPS.')
+
+
+def haversine_km(lat1, lon1, lat2, lon2) -> np.ndarray:
+    """Element-wise great-circle distance of coordinate arrays in degrees."""
+
+    lat1, lon1, lat2, lon2 = (np.radians(a) for a in (lat1, lon1, lat2, lon2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+
+def _segments(vehicle_ids, ts, lat, lon):
+    """Per-segment (same vehicle, km, implied km/h) between consecutive fixes."""
+
+    same = vehicle_ids[1:] == vehicle_ids[:-1]
+    distance = haversine_km(lat[:-1], lon[:-1], lat[1:], lon[1:])
+    hours = (ts[1:] - ts[:-1]) / 3600.0
+    with np.errstate(divide='ignore', invalid='ignore'):
+        speed = np.where(hours > 0, distance / hours, np.where(distance > 0, np.inf, 0.0))
+    return same, distance, speed
+
+
+def track_distances(vehicle_ids, ts, lat, lon, speed_kmh, max_speed_kmh: float = MAX_SPEED_KMH):
+    """Driven km per vehicle for fixes sorted by (vehicle_id, ts).
+
+    Returns (vehicle ids, km, fixes, rejected fixes) arrays, one entry per
+    vehicle present in the input.
+    """
+
+    count = len(vehicle_ids)
+    keep = np.ones(count, dtype=bool)
+
+    for _ in range(JUMP_PASSES):
+        index = np.flatnonzero(keep)
+        if len(index) < 2:
+            break
+        same, _, speed = _segments(vehicle_ids[index], ts[index], lat[index], lon[index])
+        fast = same & (speed > max_speed_kmh)
+        if not fast.any():
+            break
+
+        fast_before = np.concatenate(([False], fast))
+        fast_after = np.concatenate((fast, [False]))
+        track_start = np.concatenate(([True], ~same))
+        track_end = np.concatenate((~same, [True]))
+        jump = (fast_before & fast_after) | (fast_before & track_end) | (fast_after & track_start)
+        if not jump.any():
+            break
+        keep[index[jump]] = False
+
+    index = np.flatnonzero(keep)
+    kept_vehicles = vehicle_ids[index]
+    same, distance, speed = _segments(kept_vehicles, ts[index], lat[index], lon[index])
+    reported = speed_kmh[index]
+    # NaN (no reported speed) compares False, so such segments are kept
+    standing = (reported[:-1] < STOP_SPEED_KMH) & (reported[1:] < STOP_SPEED_KMH)
+    counted = same & (speed <= max_speed_kmh) & ~standing
+
+    vehicles, inverse = np.unique(vehicle_ids, return_inverse=True)
+    kept_inverse = inverse[index]
+    totals = np.bincount(kept_inverse[1:][counted], weights=distance[counted], minlength=len(vehicles))
+    fixes = np.bincount(inverse, minlength=len(vehicles))
+    rejected = fixes - np.bincount(kept_inverse, minlength=len(vehicles))
+    return vehicles, totals, fixes, rejected
+
+
+def _load_tracks(day: date, first_id: int, last_id: int):
+    buffer = io.BytesIO()
+    copy_expert(
+        TRACK_COPY_SQL.format(
+            start=local_day_start(day),
+            end=local_day_start(day + timedelta(days=1)),
+            first_id=int(first_id),
+            last_id=int(last_id),
+        ),
+        buffer,
+    )
+    if not buffer.tell():
+        return None
+    buffer.seek(0)
+    data = np.loadtxt(buffer, delimiter='\t', ndmin=2)
+    return data[:, 0].astype(np.int64), data[:, 1], data[:, 2], data[:, 3], data[:, 4]
+
+
+def compute_day(day: date, vehicles_per_batch: int = VEHICLES_PER_BATCH,
+                max_speed_kmh: float = MAX_SPEED_KMH) -> dict:
+    """Recalculate `vehicle_daily_distance` for one fleet-local day; the caller commits."""
+
+    vehicle_ids = [vehicle_id for (vehicle_id,) in db.session.query(Vehicle.id).order_by(Vehicle.id)]
+    summary = {'vehicles': 0, 'fixes': 0, 'rejected': 0, 'distance_km': 0.0}
+    for offset in range(0, len(vehicle_ids), vehicles_per_batch):
+        batch = vehicle_ids[offset:offset + vehicles_per_batch]
+        tracks = _load_tracks(day, batch[0], batch[-1])
+        if tracks is None:
+            continue
+
+        vehicles, totals, fixes, rejected = track_distances(*tracks, max_speed_kmh=max_speed_kmh)
+        db.session.execute(
+            UPSERT_SQL,
+            {
+                'day': day,
+                'vehicle_ids': vehicles.tolist(),
+                'distances': np.round(totals, 3).tolist(),
+                'fixes': fixes.tolist(),
+                'rejected': rejected.tolist(),
+            },
+        )
+        summary['vehicles'] += len(vehicles)
+        summary['fixes'] += int(fixes.sum())
+        summary['rejected'] += int(rejected.sum())
+        summary['distance_km'] += float(totals.sum())
+    return summary
+
+
+@job_handler(COMPUTE_JOB, concurrency=1)
+def compute_day_job(payload: dict):
+    compute_day(date.fromisoformat(payload['day']))
+    db.session.commit()
+
+
+def enqueue_mileage(days):
+    """Queue recalculation of `days` (fleet-local dates) in the current transaction."""
+
+    run_at = datetime.utcnow() + COMPUTE_DELAY
+    for day in sorted(days):
+        enqueue(COMPUTE_JOB, {'day': day.isoformat()}, run_at=run_at, dedupe_key=f'{COMPUTE_JOB}:{day}')
+
+
+@mileage_cli.command('compute')
+@click.option('--since', type=click.DateTime(['%Y-%m-%d']), default=None, help='Первый день (по умолчанию вчера).')
+@click.option('--until', type=click.DateTime(['%Y-%m-%d']), default=None, help='Последний день (по умолчанию сегодня).')
+@click.option('--vehicles-per-batch', default=VEHICLES_PER_BATCH, show_default=True)
+@click.option('--max-speed', default=MAX_SPEED_KMH, show_default=True, help='Скорость, выше которой точка считается скачком, км/ч.')
+def compute_command(since, until, vehicles_per_batch, max_speed):
+    """Пересчитать пробег за дни по GPS-трекам (дни по часовому поясу парка)."""
+
+    today = fleet_today()
+    day = since.date() if since else today - timedelta(days=1)
+    last = until.date() if until else today
+    while day <= last:
+        started = time.monotonic()
+        summary = compute_day(day, vehicles_per_batch, max_speed)
+        db.session.commit()
+        elapsed = time.monotonic() - started
+        click.echo(
+            f"{day}: машин {summary['vehicles']}, точек {summary['fixes']} "
+            f"(отброшено {summary['rejected']}), {summary['distance_km']:.1f} км, "
+            f"{summary['fixes'] / elapsed if elapsed else 0:.0f} точек/с"
+        )
+        day += timedelta(days=1)
+
+
+def init_mileage(app):
+    app.cli.add_command(mileage_cli)
@@ -0,0 +1,112 @@
+"""Nearest-vehicle and within-radius queries over live positions.
+
+Each web process keeps a `GridIndex` of the positions in `vehicle_position`.
+It is loaded once and then kept current by the live hub's position events
+(services/live.py); after a lost LISTEN connection it is reloaded.
+"""
+from datetime import datetime, timedelta
+import threading
+
+from app import db
+from services.database import session_engine
+from services.geo import GridIndex
+from services.live import hub
+
+
+POSITIONS_SQL = db.text('SELECT vehicle_id, recorded_at, lat, lon FROM vehicle_position')
+
+
+def _parse_time(value: str) -> datetime:
+    return datetime.fromisoformat(value.rstrip('Z'))
+
+
+class VehicleLocator:
+    def __init__(self):
+        self.grid = GridIndex()
+        self._recorded_at = {}
+        self._lock = threading.Lock()
+        # one load at a time; the others wait for it instead of reading a
+        # half-filled grid
+        self._load_lock = threading.Lock()
+        # bumped by resync(); the grid is current while it matches the loaded one
+        self._generation = 0
+        self._loaded_generation = None
+        self._subscribed = False
+
+    # live hub subscriber interface
+
+    def offer(self, event: str, item: dict):
+        if event != 'position':
+            return
+        recorded_at = _parse_time(item['recorded_at'])
+        with self._lock:
+            self._store(item['vehicle_id'], recorded_at, item['lat'], item['lon'])
+
+    def resync(self):
+        self._generation += 1
+
+    def _store(self, vehicle_id, recorded_at, lat, lon):
+        known = self._recorded_at.get(vehicle_id)
+        if known is None or known < recorded_at:
+            self._recorded_at[vehicle_id] = recorded_at
+            self.grid.upsert(vehicle_id, lat, lon)
+
+    def _ensure_loaded(self):
+        if self._subscribed and self._loaded_generation == self._generation:
+            return
+        with self._load_lock:
+            if not self._subscribed:
+                # subscribe before loading so no update falls in between
+                hub.subscribe(session_engine(), self)
+                self._subscribed = True
+            generation = self._generation
+            if self._loaded_generation == generation:
+                return
+            rows = db.session.execute(POSITIONS_SQL).all()
+            with self._lock:
+                self.grid.clear()
+                self._recorded_at.clear()
+                for vehicle_id, recorded_at, lat, lon in rows:
+                    self._store(vehicle_id, recorded_at, lat, lon)
+            # a resync() during the load leaves the generations apart: reload next time
+            self._loaded_generation = generation
+
+    def _fresh(self, max_age: timedelta):
+        if max_age is None:
+            return None
+        cutoff = datetime.utcnow() - max_age
+        return lambda vehicle_id: self._recorded_at[vehicle_id] >= cutoff
+
+    def within(self, lat: float, lon: float, radius_km: float, max_age: timedelta = None):
+        """[(distance_km, vehicle_id, lat, lon, recorded_at)] within `radius_km`, nearest first."""
+
+        self._ensure_loaded()
+        accept = self._fresh(max_age)
+        with self._lock:
+            found = self.grid.within(lat, lon, radius_km)
+            return [
+                self._result(distance, vehicle_id)
+                for distance, vehicle_id in found
+                if accept is None or accept(vehicle_id)
+            ]
+
+    def nearest(self, lat: float, lon: float, count: int, max_radius_km: float,
+                max_age: timedelta = None, exclude=()):
+        """Up to `count` nearest vehicles, skipping ids in `exclude`."""
+
+        self._ensure_loaded()
+        fresh = self._fresh(max_age)
+
+        def accept(vehicle_id):
+            return vehicle_id not in exclude and (fresh is None or fresh(vehicle_id))
+
+        with self._lock:
+            found = self.grid.nearest(lat, lon, count, max_radius_km, accept=accept)
+            return [self._result(distance, vehicle_id) for distance, vehicle_id in found]
+
+    def _result(self, distance, vehicle_id):
+        lat, lon = self.grid.get(vehicle_id)
+        return distance, vehicle_id, lat, lon, self._recorded_at[vehicle_id]
+
+
+locator = VehicleLocator()
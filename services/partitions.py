@@ -0,0 +1,239 @@
+"""Monthly partitions of the high-volume tables.
+
+`route`, `maintenance` and `telemetry_fix` are range-partitioned by month
+(migration 7c3d91b5a2e8), one partition per month named `<table>_pYYYY_MM`
+plus `<table>_default` for rows outside them. `flask partitions maintain`:
+
+- creates partitions for the coming months and for months whose rows
+  landed in the DEFAULT partition, moving those rows over;
+- downsamples raw telemetry of expired months into `telemetry_rollup`;
+- drops (or detaches) partitions older than the retention period.
+
+Every step commits on its own, so an interrupted run leaves the tables
+consistent and a rerun picks up the rest.
+"""
+from dataclasses import dataclass
+from datetime import date
+import re
+from typing import Optional
+
+import click
+from flask.cli import AppGroup
+from sqlalchemy import text
+
+from app import db
+from services.database import session_engine
+
+
+MONTHS_AHEAD = 3
+ROLLUP_BUCKET = '5 minutes'
+LOCK_KEY = 'partitions.maintain'
+
+
+@dataclass
+class PartitionedTable:
+    name: str
+    key: str
+    # months kept besides the current one; None keeps everything
+    retention_months: Optional[int] = None
+    # run against a partition before it is removed, with {partition} substituted
+    rollup_sql: Optional[str] = None
+
+
+TELEMETRY_ROLLUP_SQL = f"""
+    INSERT INTO telemetry_rollup (
+        vehicle_id, bucket_start, fixes, lat, lon,
+        speed_avg, speed_max, odometer_min, odometer_max
+    )
+    SELECT vehicle_id,
+           date_bin(interval '{ROLLUP_BUCKET}', recorded_at, timestamp '2000-01-01') AS bucket_start,
+           count(*), avg(lat), avg(lon),
+           avg(speed_kmh), max(speed_kmh), min(odometer_km), max(odometer_km)
+    FROM {{partition}}
+    GROUP BY 1, 2
+    ON CONFLICT (vehicle_id, bucket_start) DO UPDATE
+    SET fixes = EXCLUDED.fixes, lat = EXCLUDED.lat, lon = EXCLUDED.lon,
+        speed_avg = EXCLUDED.speed_avg, speed_max = EXCLUDED.speed_max,
+        odometer_min = EXCLUDED.odometer_min, odometer_max = EXCLUDED.odometer_max
+"""
+
+PARTITIONED_TABLES = {
+    table.name: table
+    for table in (
+        PartitionedTable('route', 'date'),
+        PartitionedTable('maintenance', 'event_date'),
+        PartitionedTable('telemetry_fix', 'recorded_at', retention_months=3, rollup_sql=TELEMETRY_ROLLUP_SQL),
+    )
+}
+
+PARTITIONS_SQL = text(
+    """
+    SELECT child.relname, child.reltuples::bigint
+    FROM pg_inherits
+    JOIN pg_class parent ON parent.oid = pg_inherits.inhparent
+    JOIN pg_class child ON child.oid = pg_inherits.inhrelid
+    WHERE parent.relname = :table
+    ORDER BY child.relname
+    """
+)
+
+partitions_cli = AppGroup('partitions', help='Обслуживание секционированных таблиц.')
+
+
+def add_months(month: date, count: int) -> date:
+    index = month.year * 12 + month.month - 1 + count
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def partition_name(table: str, month: date) -> str:
+    return f'{table}_p{month:%Y_%m}'
+
+
+def monthly_partitions(connection, table: str) -> dict:
+    """{month: partition name} of the existing monthly partitions."""
+
+    pattern = re.compile(rf'^{re.escape(table)}_p(\d{{4}})_(\d{{2}})$')
+    months = {}
+    for name, _ in connection.execute(PARTITIONS_SQL, {'table': table}):
+        match = pattern.match(name)
+        if match:
+            months[date(int(match.group(1)), int(match.group(2)), 1)] = name
+    return months
+
+
+def create_partition(connection, table: PartitionedTable, month: date) -> int:
+    """Create the partition for `month`, return how many rows moved from DEFAULT."""
+
+    name = partition_name(table.name, month)
+    bounds = {'lower': month, 'upper': add_months(month, 1)}
+    default = f'{table.name}_default'
+    # no row may land in DEFAULT between the count and the CREATE; the parent
+    # is locked first, in the order inserts take their locks
+    connection.execute(text(f'LOCK TABLE ONLY {table.name} IN SHARE ROW EXCLUSIVE MODE'))
+    connection.execute(text(f'LOCK TABLE {default} IN SHARE ROW EXCLUSIVE MODE'))
+    in_default = connection.execute(
+        text(f'SELECT count(*) FROM {default} WHERE {table.key} >= :lower AND {table.key} < :upper'),
+        bounds,
+    ).scalar()
+
+    if not in_default:
+        connection.execute(text(
+            f"CREATE TABLE {name} PARTITION OF {table.name} "
+            f"FOR VALUES FROM ('{bounds['lower']}') TO ('{bounds['upper']}')"
+        ))
+        return 0
+
+    # The new range overlaps rows in DEFAULT: move them to a standalone table
+    # first, then attach it (attaching also creates the partitioned indexes).
+    connection.execute(text(f'CREATE TABLE {name} (LIKE {table.name} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)'))
+    connection.execute(
+        text(
+            f'WITH moved AS (DELETE FROM {default} WHERE {table.key} >= :lower AND {table.key} < :upper '
+            f'RETURNING *) INSERT INTO {name} SELECT * FROM moved'
+        ),
+        bounds,
+    )
+    connection.execute(text(
+        f"ALTER TABLE {table.name} ATTACH PARTITION {name} "
+        f"FOR VALUES FROM ('{bounds['lower']}') TO ('{bounds['upper']}')"
+    ))
+    return in_default
+
+
+def expire_partition(connection, table: PartitionedTable, name: str, detach_only: bool = False):
+    if table.rollup_sql:
+        connection.execute(text(table.rollup_sql.format(partition=name)))
+    connection.execute(text(f'ALTER TABLE {table.name} DETACH PARTITION {name}'))
+    if not detach_only:
+        connection.execute(text(f'DROP TABLE {name}'))
+
+
+def maintain(connection, months_ahead: int = MONTHS_AHEAD, retention: dict = None,
+             detach_only: bool = False, today: date = None, log=print):
+    current = (today or date.today()).replace(day=1)
+    retention = retention or {}
+
+    for table in PARTITIONED_TABLES.values():
+        existing = monthly_partitions(connection, table.name)
+        # months that only have rows in DEFAULT get their own partitions too,
+        # so retention and partition pruning apply to them
+        stray = connection.execute(text(
+            f"SELECT DISTINCT date_trunc('month', {table.key})::date FROM {table.name}_default"
+        )).scalars()
+
+        wanted = {add_months(current, offset) for offset in range(months_ahead + 1)} | set(stray)
+        for month in sorted(wanted - existing.keys()):
+            moved = create_partition(connection, table, month)
+            existing[month] = partition_name(table.name, month)
+            connection.commit()
+            log(f'{table.name}: создана секция {partition_name(table.name, month)}'
+                + (f', перенесено из DEFAULT: {moved}' if moved else ''))
+
+        months = retention.get(table.name, table.retention_months)
+        if months is None:
+            continue
+        cutoff = add_months(current, -months)
+        for month, name in sorted(existing.items()):
+            if month >= cutoff:
+                break
+            expire_partition(connection, table, name, detach_only)
+            connection.commit()
+            log(f'{table.name}: секция {name} ' + ('отсоединена' if detach_only else 'удалена'))
+
+
+def maintain_locked(months_ahead: int = MONTHS_AHEAD, retention: dict = None, detach_only: bool = False,
+                    log=print) -> bool:
+    """maintain() under the advisory lock; False when another process holds it."""
+
+    with session_engine().connect() as connection:
+        locked = connection.execute(
+            text('SELECT pg_try_advisory_lock(hashtext(:key))'), {'key': LOCK_KEY}
+        ).scalar()
+        if not locked:
+            return False
+        try:
+            maintain(connection, months_ahead, retention, detach_only, log=log)
+        finally:
+            connection.rollback()
+            connection.execute(text('SELECT pg_advisory_unlock(hashtext(:key))'), {'key': LOCK_KEY})
+            connection.commit()
+    return True
+
+
+def _parse_retention(values) -> dict:
+    retention = {}
+    for value in values:
+        table, _, months = value.partition('=')
+        if table not in PARTITIONED_TABLES or not months.isdigit():
+            raise click.BadParameter(
+                f"ожидается ТАБЛИЦА=МЕСЯЦЫ, таблицы: {', '.join(PARTITIONED_TABLES)}",
+                param_hint='--retain',
+            )
+        retention[table] = int(months)
+    return retention
+
+
+@partitions_cli.command('maintain')
+@click.option('--months-ahead', default=MONTHS_AHEAD, show_default=True, help='На сколько месяцев вперёд создавать секции.')
+@click.option('--retain', multiple=True, metavar='ТАБЛИЦА=МЕСЯЦЫ',
+              help='Срок хранения секций таблицы (по умолчанию telemetry_fix=3, остальные бессрочно).')
+@click.option('--detach', 'detach_only', is_flag=True, help='Отсоединять устаревшие секции вместо удаления.')
+def maintain_command(months_ahead, retain, detach_only):
+    """Создать будущие секции, агрегировать и удалить устаревшие."""
+
+    retention = _parse_retention(retain)
+    if not maintain_locked(months_ahead, retention, detach_only, log=click.echo):
+        raise click.ClickException('Обслуживание секций уже выполняется в другом процессе.')
+
+
+@partitions_cli.command('list')
+def list_command():
+    """Секции таблиц и примерное число строк."""
+
+    for table in PARTITIONED_TABLES.values():
+        for name, rows in db.session.execute(PARTITIONS_SQL, {'table': table.name}):
+            click.echo(f'{table.name:<15} {name:<30} ~{max(rows, 0)}')
+
+
+def init_partitions(app):
+    app.cli.add_command(partitions_cli)
@@ -0,0 +1,41 @@
+"""COPY through the session's psycopg2 connection."""
+import time
+
+import psycopg2.extensions
+
+from app import db
+
+
+def copy_expert(sql: str, file):
+    """Run `COPY ... FROM STDIN` / `TO STDOUT` in the current session transaction.
+
+    psycopg2 refuses COPY while a wait callback is installed (psycogreen
+    under gevent workers). The callback is lifted for the duration, so the
+    COPY blocks this process instead; split large data with copy_chunks().
+    """
+
+    connection = db.session.connection().connection.dbapi_connection
+    wait_callback = psycopg2.extensions.get_wait_callback()
+    if wait_callback is not None:
+        psycopg2.extensions.set_wait_callback(None)
+    try:
+        with connection.cursor() as cursor:
+            cursor.copy_expert(sql, file)
+    finally:
+        if wait_callback is not None:
+            psycopg2.extensions.set_wait_callback(wait_callback)
+
+
+def copy_chunks(sql: str, files):
+    """copy_expert() for each file in turn, letting other greenlets run in between.
+
+    A COPY blocks a gevent worker, so large data is split into files of a few
+    thousand rows: each one stalls the worker briefly and the other requests
+    run between them.
+    """
+
+    for file in files:
+        copy_expert(sql, file)
+        if psycopg2.extensions.get_wait_callback() is not None:
+            # time.sleep is patched by gevent: yields to the other greenlets
+            time.sleep(0)
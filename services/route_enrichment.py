@@ -0,0 +1,184 @@
+"""Background resolution of route distance, duration and map preview.
+
+Route create/update handlers only enqueue work here, so neither managers nor
+drivers wait on the geocoder and OSRM while a page loads. Coordinates and the
+encoded geometry are stored on the route as well, and a route whose addresses
+match an already resolved one is copied from it without any external call.
+A route that already has coordinates and a distance takes its duration from
+the learned travel times; only a miss there goes to the maps proxy.
+"""
+from datetime import datetime
+
+from app import db
+from models.route import Route
+from services.eta import record_router_legs, route_eta
+from services.jobs import enqueue, enqueue_many, job_handler
+from services.live import publish_route_change
+from services.maps import map_preview
+
+
+RESOLVE_JOB = 'route.resolve'
+
+
+class RouteNotResolved(Exception):
+    """The maps proxy gave no answer; the job is retried with backoff."""
+
+
+def apply_preview(route: Route, preview: dict):
+    distance_value = preview.get('distance_value')
+    # a distance typed in by the manager wins over the routed one
+    if distance_value is not None and not route.distance:
+        try:
+            route.distance = round(float(distance_value) / 1000.0, 3)
+        except (TypeError, ValueError):
+            pass
+    route.duration = preview.get('duration_value')
+    route.map_url = preview.get('map_url')
+    route.geometry = preview.get('geometry')
+
+    points = preview.get('points') or []
+    if len(points) >= 2:
+        (route.start_lon, route.start_lat), (route.end_lon, route.end_lat) = points[0], points[-1]
+        route.waypoint_coords = points[1:-1] or None
+    # the proxy returns the stops in the order it chose for travel
+    if route.optimize_stops and preview.get('optimized') and preview.get('stops'):
+        route.stops = list(preview['stops'])
+    route.resolved_at = datetime.utcnow()
+
+
+RESOLVED_FIELDS = (
+    'duration', 'map_url', 'geometry', 'start_lat', 'start_lon',
+    'end_lat', 'end_lon', 'waypoint_coords',
+)
+
+
+def copy_resolution(route: Route, source: Route):
+    """Fill the empty fields of `route` from its twin; a manual distance stays."""
+
+    for field in ('distance', *RESOLVED_FIELDS):
+        if getattr(route, field) in (None, 0):
+            setattr(route, field, getattr(source, field))
+    route.resolved_at = datetime.utcnow()
+
+
+def apply_eta(route: Route):
+    """Prefer the learned travel time over the router's free-flow one."""
+
+    seconds, _ = route_eta(route)
+    if seconds is not None:
+        route.duration = seconds
+
+
+def apply_learned_eta(route: Route) -> bool:
+    """Duration from the learned travel times when the route needs nothing else.
+
+    The proxy is still asked when the distance, the map (geometry and link)
+    or the coordinates of every stop are not known yet.
+    """
+
+    if not route.distance or route.start_lat is None or route.end_lat is None:
+        return False
+    if not route.geometry or not route.map_url:
+        return False
+    if route.stops and len(route.waypoint_coords or []) != len(route.stops):
+        return False
+    seconds, _ = route_eta(route)
+    if seconds is None:
+        return False
+    route.duration = seconds
+    route.resolved_at = datetime.utcnow()
+    return True
+
+
+def reset_preview(route: Route):
+    for field in RESOLVED_FIELDS:
+        setattr(route, field, None)
+    route.resolved_at = None
+
+
+def _resolved_twin(route: Route):
+    return (
+        Route.query.filter(
+            Route.id != route.id,
+            Route.start_location == route.start_location,
+            Route.end_location == route.end_location,
+            Route.stops.is_(None) if not route.stops else Route.stops == route.stops,
+            # an unordered twin is no answer for a route that asks for the best order
+            *((Route.optimize_stops.is_(True),) if route.optimize_stops and route.stops else ()),
+            Route.resolved_at.isnot(None),
+            Route.geometry.isnot(None),
+        )
+        .order_by(Route.resolved_at.desc())
+        .first()
+    )
+
+
+def resolve_route(route_id: int) -> bool:
+    """Fetch the preview for a route and store it on the row."""
+
+    route = db.session.get(Route, route_id)
+    if not route:
+        return False
+
+    twin = _resolved_twin(route)
+    if twin:
+        copy_resolution(route, twin)
+        apply_eta(route)
+        publish_route_change(route, 'updated')
+        db.session.commit()
+        return True
+
+    if apply_learned_eta(route):
+        publish_route_change(route, 'updated')
+        db.session.commit()
+        return True
+
+    requested = (route.start_location, route.end_location, route.stops, route.optimize_stops)
+    # do not hold a DB connection while the proxy works
+    db.session.rollback()
+
+    preview = map_preview(*requested)
+    if not preview:
+        return False
+
+    route = db.session.get(Route, route_id)
+    if not route or (route.start_location, route.end_location, route.stops, route.optimize_stops) != requested:
+        # the route was edited meanwhile, the job enqueued by that edit handles it
+        return False
+
+    apply_preview(route, preview)
+    record_router_legs(preview.get('points') or [], preview.get('legs'))
+    apply_eta(route)
+    publish_route_change(route, 'updated')
+    db.session.commit()
+    return True
+
+
+@job_handler(RESOLVE_JOB, concurrency=4, max_attempts=6)
+def resolve_route_job(payload: dict):
+    route_id = payload['route_id']
+    if not resolve_route(route_id) and db.session.get(Route, route_id) is not None:
+        raise RouteNotResolved(f'route {route_id}')
+
+
+def enqueue_route_resolution(route_id: int, priority: int = 0):
+    """Queue resolution in the current transaction; the caller commits."""
+
+    enqueue(
+        RESOLVE_JOB,
+        {'route_id': route_id},
+        priority=priority,
+        dedupe_key=f'{RESOLVE_JOB}:{route_id}',
+    )
+
+
+def enqueue_routes_resolution(route_ids, priority: int = 0):
+    """enqueue_route_resolution() for many routes with one INSERT."""
+
+    route_ids = list(route_ids)
+    enqueue_many(
+        RESOLVE_JOB,
+        [{'route_id': route_id} for route_id in route_ids],
+        priority=priority,
+        dedupe_keys=[f'{RESOLVE_JOB}:{route_id}' for route_id in route_ids],
+    )
@@ -0,0 +1,579 @@
+"""Assignment of a day's route requests to drivers.
+
+Each request is a trip from its start to its end; a driver's day is a
+sequence of requests. The planner minimizes deadhead: the empty kilometres
+from the vehicle's position to the first start and from each end to the
+next start. The driving distance of the requests themselves does not
+depend on the plan and is not part of the objective.
+
+`solve()` works on a cost matrix `cost` of shape (vehicles + requests,
+requests): row k < vehicles is the km from vehicle k to each start, row
+vehicles + i the km from the end of request i. It builds a plan by cheapest
+insertion, descends with three moves (relocate a request, swap two requests,
+exchange the tails of two routes) and then, while the time budget lasts,
+perturbs the best plan with a few random swaps and descends again.
+
+The search is CPU-bound, so /admin/routes/optimize does not run it in the
+web worker: it enqueues a `routes.optimize` job and `plan_day()` runs in
+`flask worker`, storing the response in `job.result`.
+"""
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from datetime import date, datetime, timedelta
+import math
+import random
+import time
+from typing import List
+
+import numpy as np
+from sqlalchemy import bindparam, insert, text
+
+from app import db
+from models.driver import Driver
+from models.route import Route
+from models.vehicle import Vehicle
+from models.vehicle_position import VehiclePosition
+from services.distance_matrix import driving_km, prune_expired
+from services.jobs import job_handler
+from services.live import publish_route_changes
+from services.maps import geocode_address
+from services.route_enrichment import enqueue_routes_resolution
+
+
+OPTIMIZE_JOB = 'routes.optimize'
+
+
+@dataclass
+class PlanResult:
+    routes: List[List[int]]
+    deadhead_km: float
+    construction_km: float
+    moves: int = 0
+    elapsed_ms: int = 0
+    vehicle_km: List[float] = field(default_factory=list)
+
+
+def route_cost(cost: np.ndarray, vehicles: int, vehicle: int, route: List[int]) -> float:
+    if not route:
+        return 0.0
+    total = cost[vehicle, route[0]]
+    for previous, current in zip(route, route[1:]):
+        total += cost[vehicles + previous, current]
+    return float(total)
+
+
+def _construct(cost: np.ndarray, vehicles: int, capacity: int) -> List[List[int]]:
+    """Cheapest insertion over all open gaps of all routes.
+
+    delta[g, j] is the extra km of putting request j into gap g (between a
+    row of `cost` and the next request, or at the end of a route); inserting
+    into a gap splits it into two, so only those rows are recomputed.
+    """
+
+    requests = cost.shape[1]
+    rows = vehicles + requests
+    delta = np.full((rows, requests), np.inf)
+    gap_prev = np.full(rows, -1)
+    gap_next = np.full(rows, -1)
+    gap_vehicle = np.full(rows, -1)
+    assigned = np.zeros(requests, dtype=bool)
+    routes = [[] for _ in range(vehicles)]
+    vehicle_gaps = [[vehicle] for vehicle in range(vehicles)]
+
+    def fill(gap):
+        previous, following = gap_prev[gap], gap_next[gap]
+        row = cost[previous].copy()
+        if following >= 0:
+            row += cost[vehicles:, following] - cost[previous, following]
+        row[assigned] = np.inf
+        delta[gap] = row
+
+    for vehicle in range(vehicles):
+        gap_prev[vehicle], gap_vehicle[vehicle] = vehicle, vehicle
+        if capacity > 0:
+            fill(vehicle)
+
+    next_free = vehicles
+    for _ in range(requests):
+        flat = int(np.argmin(delta))
+        gap, request = divmod(flat, requests)
+        if not np.isfinite(delta[gap, request]):
+            break
+        vehicle = gap_vehicle[gap]
+        previous, following = gap_prev[gap], gap_next[gap]
+
+        route = routes[vehicle]
+        position = 0 if previous < vehicles else route.index(previous - vehicles) + 1
+        route.insert(position, request)
+        assigned[request] = True
+        delta[:, request] = np.inf
+
+        gap_next[gap] = request
+        new_gap = next_free
+        next_free += 1
+        gap_prev[new_gap], gap_next[new_gap], gap_vehicle[new_gap] = vehicles + request, following, vehicle
+        vehicle_gaps[vehicle].append(new_gap)
+
+        if len(route) >= capacity:
+            delta[vehicle_gaps[vehicle]] = np.inf
+        else:
+            fill(gap)
+            fill(new_gap)
+    return routes
+
+
+class _LocalSearch:
+    def __init__(self, cost: np.ndarray, vehicles: int, capacity: int, routes: List[List[int]],
+                 neighbours: np.ndarray, deadline: float, seed: int = 0):
+        self.cost = cost
+        self.vehicles = vehicles
+        self.capacity = capacity
+        self.routes = routes
+        self.neighbours = neighbours
+        self.deadline = deadline
+        self.random = random.Random(seed)
+        self.moves = 0
+        self.where = {}
+        for vehicle, route in enumerate(routes):
+            for request in route:
+                self.where[request] = vehicle
+
+    def _prev_row(self, vehicle: int, route: List[int], position: int) -> int:
+        return vehicle if position == 0 else self.vehicles + route[position - 1]
+
+    def _link(self, row: int, following) -> float:
+        return self.cost[row, following] if following is not None else 0.0
+
+    def _replace_delta(self, vehicle: int, position: int, new: int) -> float:
+        """km change of putting request `new` in place of the one at `position`."""
+
+        route = self.routes[vehicle]
+        old = route[position]
+        previous = self._prev_row(vehicle, route, position)
+        following = route[position + 1] if position + 1 < len(route) else None
+        return (
+            self.cost[previous, new] + self._link(self.vehicles + new, following)
+            - self.cost[previous, old] - self._link(self.vehicles + old, following)
+        )
+
+    def relocate(self, request: int) -> bool:
+        vehicle = self.where[request]
+        route = self.routes[vehicle]
+        position = route.index(request)
+        previous = self._prev_row(vehicle, route, position)
+        following = route[position + 1] if position + 1 < len(route) else None
+        gain = self.cost[previous, request] + self._link(self.vehicles + request, following)
+        if following is not None:
+            gain -= self.cost[previous, following]
+        del route[position]
+
+        prevs, nexts, owners, positions = [], [], [], []
+        for other, other_route in enumerate(self.routes):
+            if len(other_route) >= self.capacity:
+                continue
+            row = other
+            for index, item in enumerate(other_route):
+                prevs.append(row)
+                nexts.append(item)
+                owners.append(other)
+                positions.append(index)
+                row = self.vehicles + item
+            prevs.append(row)
+            nexts.append(-1)
+            owners.append(other)
+            positions.append(len(other_route))
+
+        prevs = np.asarray(prevs)
+        nexts = np.asarray(nexts)
+        has_next = nexts >= 0
+        safe_next = np.where(has_next, nexts, 0)
+        insert = self.cost[prevs, request] + np.where(
+            has_next, self.cost[self.vehicles + request, safe_next] - self.cost[prevs, safe_next], 0.0
+        )
+        best = int(np.argmin(insert))
+        if insert[best] < gain - 1e-9:
+            target = owners[best]
+            self.routes[target].insert(positions[best], request)
+            self.where[request] = target
+            self.moves += 1
+            return True
+        route.insert(position, request)
+        return False
+
+    def swap(self, request: int) -> bool:
+        vehicle_a = self.where[request]
+        for other in self.neighbours[request]:
+            other = int(other)
+            vehicle_b = self.where.get(other)
+            if other == request or vehicle_b is None:
+                continue
+            route_a, route_b = self.routes[vehicle_a], self.routes[vehicle_b]
+            position_a, position_b = route_a.index(request), route_b.index(other)
+            if vehicle_a == vehicle_b and abs(position_a - position_b) < 2:
+                continue
+            change = self._replace_delta(vehicle_a, position_a, other)
+            route_a[position_a] = other
+            change += self._replace_delta(vehicle_b, position_b, request)
+            route_a[position_a] = request
+            if change < -1e-9:
+                route_a[position_a], route_b[position_b] = other, request
+                self.where[request], self.where[other] = vehicle_b, vehicle_a
+                self.moves += 1
+                return True
+        return False
+
+    def exchange_tails(self, request: int) -> bool:
+        """Cross two routes: the part from `request` on and the part from a neighbour on trade places."""
+
+        vehicle_a = self.where[request]
+        route_a = self.routes[vehicle_a]
+        position_a = route_a.index(request)
+        previous_a = self._prev_row(vehicle_a, route_a, position_a)
+        for other in self.neighbours[request]:
+            other = int(other)
+            vehicle_b = self.where.get(other)
+            if vehicle_b is None or vehicle_b == vehicle_a:
+                continue
+            route_b = self.routes[vehicle_b]
+            position_b = route_b.index(other)
+            if (position_a + len(route_b) - position_b > self.capacity
+                    or position_b + len(route_a) - position_a > self.capacity):
+                continue
+            previous_b = self._prev_row(vehicle_b, route_b, position_b)
+            change = (
+                self.cost[previous_a, other] + self.cost[previous_b, request]
+                - self.cost[previous_a, request] - self.cost[previous_b, other]
+            )
+            if change < -1e-9:
+                tail_a, tail_b = route_a[position_a:], route_b[position_b:]
+                del route_a[position_a:], route_b[position_b:]
+                route_a.extend(tail_b)
+                route_b.extend(tail_a)
+                for item in tail_b:
+                    self.where[item] = vehicle_a
+                for item in tail_a:
+                    self.where[item] = vehicle_b
+                self.moves += 1
+                return True
+        return False
+
+    def descend(self) -> bool:
+        """Apply improving moves until none is left; False if the deadline hit first."""
+
+        order = list(self.where)
+        improved = True
+        while improved:
+            improved = False
+            self.random.shuffle(order)
+            for request in order:
+                if time.monotonic() >= self.deadline:
+                    return False
+                if self.relocate(request) or self.swap(request) or self.exchange_tails(request):
+                    improved = True
+        return True
+
+    def total(self) -> float:
+        return sum(route_cost(self.cost, self.vehicles, vehicle, route) for vehicle, route in enumerate(self.routes))
+
+    def _kick(self, swaps: int):
+        """Random swaps of requests between routes, to leave a local optimum."""
+
+        requests = list(self.where)
+        for _ in range(swaps):
+            first, second = self.random.sample(requests, 2)
+            vehicle_a, vehicle_b = self.where[first], self.where[second]
+            route_a, route_b = self.routes[vehicle_a], self.routes[vehicle_b]
+            position_a, position_b = route_a.index(first), route_b.index(second)
+            route_a[position_a], route_b[position_b] = second, first
+            self.where[first], self.where[second] = vehicle_b, vehicle_a
+
+    def run(self):
+        """Local search, then perturb-and-descend from the best plan until the deadline."""
+
+        if not self.descend() or len(self.where) < 2:
+            return
+        best, best_cost = [list(route) for route in self.routes], self.total()
+        while time.monotonic() < self.deadline:
+            self._kick(self.random.randint(2, max(2, min(8, len(self.where) // 10))))
+            finished = self.descend()
+            current = self.total()
+            if current < best_cost - 1e-9:
+                best, best_cost = [list(route) for route in self.routes], current
+            else:
+                self._restore(best)
+            if not finished:
+                break
+        self._restore(best)
+
+    def _restore(self, routes):
+        self.routes[:] = [list(route) for route in routes]
+        for vehicle, route in enumerate(self.routes):
+            for request in route:
+                self.where[request] = vehicle
+
+
+def _neighbours(starts, count: int) -> np.ndarray:
+    """Indexes of the `count` requests with the nearest starts (planar approximation)."""
+
+    starts = np.asarray(starts, dtype=float).reshape(-1, 2)
+    lat = starts[:, 0]
+    lon = starts[:, 1] * np.cos(np.radians(lat.mean() if len(lat) else 0.0))
+    points = np.stack((lat, lon), axis=1)
+    squared = ((points[:, None, :] - points[None, :, :]) ** 2).sum(axis=2)
+    count = min(count, len(starts))
+    return np.argsort(squared, axis=1)[:, :count]
+
+
+def solve(cost: np.ndarray, vehicles: int, capacity: int, starts,
+          time_budget: float = 2.0, neighbours: int = 12, seed: int = 0) -> PlanResult:
+    """Plan requests onto `vehicles` routes of at most `capacity` requests each.
+
+    `starts` are the (lat, lon) of the request starts, used to pick swap
+    candidates. Requests that do not fit (capacity * vehicles < requests)
+    stay out of the plan.
+    """
+
+    started = time.monotonic()
+    deadline = started + time_budget
+    cost = cost.astype(float, copy=True)
+    requests = cost.shape[1]
+    # a request cannot follow itself
+    cost[vehicles + np.arange(requests), np.arange(requests)] = np.inf
+
+    routes = _construct(cost, vehicles, capacity)
+    construction_km = sum(route_cost(cost, vehicles, vehicle, route) for vehicle, route in enumerate(routes))
+
+    search = _LocalSearch(cost, vehicles, capacity, routes, _neighbours(starts, neighbours + 1), deadline, seed)
+    search.run()
+
+    vehicle_km = [route_cost(cost, vehicles, vehicle, route) for vehicle, route in enumerate(routes)]
+    return PlanResult(
+        routes=routes,
+        deadhead_km=sum(vehicle_km),
+        construction_km=construction_km,
+        moves=search.moves,
+        elapsed_ms=int((time.monotonic() - started) * 1000),
+        vehicle_km=vehicle_km,
+    )
+
+
+def default_capacity(requests: int, vehicles: int) -> int:
+    return math.ceil(requests / vehicles) if vehicles else 0
+
+
+START_POSITION_MAX_AGE = timedelta(hours=12)
+GEOCODE_CONCURRENCY = 8
+
+LAST_ROUTE_END_SQL = text(
+    """
+    SELECT DISTINCT ON (vehicle_id) vehicle_id, end_lat, end_lon
+    FROM route
+    WHERE vehicle_id IN :vehicle_ids AND date <= :day AND end_lat IS NOT NULL
+    ORDER BY vehicle_id, date DESC, id DESC
+    """
+).bindparams(bindparam('vehicle_ids', expanding=True))
+
+
+def geocode_many(addresses) -> dict:
+    """{address: (lat, lon) or None}, geocoded concurrently through the maps proxy."""
+
+    addresses = sorted(set(addresses))
+    with ThreadPoolExecutor(GEOCODE_CONCURRENCY) as pool:
+        found = list(pool.map(geocode_address, addresses))
+    return {address: (coords[1], coords[0]) if coords else None for address, coords in zip(addresses, found)}
+
+
+def vehicle_starts(vehicle_ids, day: date) -> dict:
+    """{vehicle_id: (lat, lon)} where each vehicle begins the day.
+
+    The live position when it is recent, otherwise the end of the vehicle's
+    last route up to `day`; vehicles with neither are left out.
+    """
+
+    if not vehicle_ids:
+        return {}
+    starts = {
+        vehicle_id: (lat, lon)
+        for vehicle_id, lat, lon in db.session.query(
+            VehiclePosition.vehicle_id, VehiclePosition.lat, VehiclePosition.lon
+        ).filter(
+            VehiclePosition.vehicle_id.in_(vehicle_ids),
+            VehiclePosition.recorded_at >= datetime.utcnow() - START_POSITION_MAX_AGE,
+        )
+    }
+    missing = [vehicle_id for vehicle_id in vehicle_ids if vehicle_id not in starts]
+    if missing:
+        for vehicle_id, lat, lon in db.session.execute(LAST_ROUTE_END_SQL, {'vehicle_ids': missing, 'day': day}):
+            starts[vehicle_id] = (lat, lon)
+    return starts
+
+
+def deadhead_matrix(vehicle_points, request_starts, request_ends):
+    """Cost matrix for solve(): vehicles without a known start (None) cost nothing to dispatch.
+
+    Returns (matrix, matrix stats from services.distance_matrix).
+    """
+
+    known = [point for point in vehicle_points if point is not None]
+    km, stats = driving_km(known + list(request_ends), request_starts)
+    cost = np.zeros((len(vehicle_points) + len(request_ends), len(request_starts)))
+    rows = [index for index, point in enumerate(vehicle_points) if point is not None]
+    cost[rows] = km[:len(known)]
+    cost[len(vehicle_points):] = km[len(known):]
+    return cost, stats
+
+
+class PlanError(Exception):
+    """The day cannot be planned; the message goes back to the manager."""
+
+    def __init__(self, message: str, unplanned=None):
+        super().__init__(message)
+        self.unplanned = unplanned or []
+
+
+def _crews(driver_ids):
+    """[(driver, vehicle)]; a driver's vehicle is the latest one assigned, as in create_route()."""
+
+    drivers_query = Driver.query
+    if driver_ids is not None:
+        drivers_query = drivers_query.filter(Driver.id.in_(driver_ids))
+    drivers = drivers_query.order_by(Driver.id).all()
+    latest_vehicle = {}
+    for vehicle in (
+        Vehicle.query.filter(Vehicle.driver_id.in_([driver.id for driver in drivers]))
+        .order_by(Vehicle.driver_id, Vehicle.created_at.desc())
+    ):
+        latest_vehicle.setdefault(vehicle.driver_id, vehicle)
+    return [(driver, latest_vehicle[driver.id]) for driver in drivers if driver.id in latest_vehicle]
+
+
+def _create_routes(route_date: date, crews, planned, result) -> dict:
+    """Insert the plan's routes; {request index in `planned`: route id}."""
+
+    rows = [
+        {
+            'start_location': planned[request_index]['start_location'],
+            'end_location': planned[request_index]['end_location'],
+            'date': route_date,
+            'distance': planned[request_index]['distance'],
+            'start_lat': planned[request_index]['start'][0],
+            'start_lon': planned[request_index]['start'][1],
+            'end_lat': planned[request_index]['end'][0],
+            'end_lon': planned[request_index]['end'][1],
+            'driver_id': driver.id,
+            'vehicle_id': vehicle.id,
+        }
+        for (driver, vehicle), route in zip(crews, result.routes)
+        for request_index in route
+    ]
+    new_routes = db.session.execute(
+        insert(Route).returning(Route, sort_by_parameter_order=True), rows
+    ).scalars().all()
+    enqueue_routes_resolution([route.id for route in new_routes], priority=5)
+    publish_route_changes(new_routes, 'created')
+    ordered = [request_index for route in result.routes for request_index in route]
+    return {request_index: route.id for request_index, route in zip(ordered, new_routes)}
+
+
+def plan_day(route_date: date, route_requests, driver_ids=None, capacity: int = None,
+             time_budget: float = 2.0, commit: bool = False) -> dict:
+    """Plan validated route requests onto the drivers; the response of /admin/routes/optimize.
+
+    `route_requests` are dicts with index, start_location, end_location,
+    start/end ((lat, lon) or None) and distance. With `commit` the routes
+    are created in the current transaction; the caller commits.
+    """
+
+    crews = _crews(driver_ids)
+    if not crews:
+        raise PlanError('Нет водителей с закреплённым транспортом.')
+
+    coords = geocode_many(
+        [item['start_location'] for item in route_requests if not item['start']]
+        + [item['end_location'] for item in route_requests if not item['end']]
+    )
+    unplanned, planned = [], []
+    for item in route_requests:
+        item['start'] = item['start'] or coords.get(item['start_location'])
+        item['end'] = item['end'] or coords.get(item['end_location'])
+        if item['start'] and item['end']:
+            planned.append(item)
+        else:
+            unplanned.append({'index': item['index'], 'reason': 'geocoding_failed'})
+    if not planned:
+        raise PlanError('Не удалось определить координаты ни одной заявки.', unplanned)
+
+    capacity = capacity or default_capacity(len(planned), len(crews))
+    starts = vehicle_starts([vehicle.id for _, vehicle in crews], route_date)
+    cost, matrix_stats = deadhead_matrix(
+        [starts.get(vehicle.id) for _, vehicle in crews],
+        [item['start'] for item in planned],
+        [item['end'] for item in planned],
+    )
+    result = solve(
+        cost, len(crews), capacity, [item['start'] for item in planned], time_budget=time_budget
+    )
+    placed = {request_index for route in result.routes for request_index in route}
+    unplanned.extend(
+        {'index': item['index'], 'reason': 'capacity'}
+        for request_index, item in enumerate(planned) if request_index not in placed
+    )
+
+    created = _create_routes(route_date, crews, planned, result) if commit else {}
+
+    plan = []
+    for vehicle_index, ((driver, vehicle), route) in enumerate(zip(crews, result.routes)):
+        row = vehicle_index
+        stops = []
+        for request_index in route:
+            item = planned[request_index]
+            stops.append({
+                'index': item['index'],
+                'route_id': created.get(request_index),
+                'start_location': item['start_location'],
+                'end_location': item['end_location'],
+                'deadhead_km': round(float(cost[row, request_index]), 2),
+            })
+            row = len(crews) + request_index
+        start = starts.get(vehicle.id)
+        plan.append({
+            'driver': {'id': driver.id, 'first_name': driver.first_name, 'last_name': driver.last_name},
+            'vehicle': {'id': vehicle.id, 'reg_number': vehicle.reg_number},
+            'start_point': {'lat': start[0], 'lon': start[1]} if start else None,
+            'deadhead_km': round(result.vehicle_km[vehicle_index], 2),
+            'routes': stops,
+        })
+
+    return {
+        'date': route_date.isoformat(),
+        'committed': bool(created),
+        'deadhead_km': round(result.deadhead_km, 2),
+        'construction_deadhead_km': round(result.construction_km, 2),
+        'max_routes_per_driver': capacity,
+        'matrix': matrix_stats,
+        'elapsed_ms': result.elapsed_ms,
+        'plan': plan,
+        'unplanned': unplanned,
+    }
+
+
+# one attempt: a rerun after a committed plan would create its routes twice
+@job_handler(OPTIMIZE_JOB, concurrency=2, max_attempts=1)
+def plan_day_job(payload: dict) -> dict:
+    try:
+        response = plan_day(
+            date.fromisoformat(payload['date']),
+            payload['requests'],
+            driver_ids=payload.get('driver_ids'),
+            capacity=payload.get('max_routes_per_driver'),
+            time_budget=payload['time_budget'],
+            commit=payload.get('commit', False),
+        )
+    except PlanError as exc:
+        db.session.rollback()
+        return {'message': str(exc), 'unplanned': exc.unplanned}
+    db.session.commit()
+    # the cache only grows here, so it is trimmed here as well
+    prune_expired()
+    db.session.commit()
+    return response
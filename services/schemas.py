@@ -0,0 +1,235 @@
+"""JSON shapes of the API resources, read straight from selected columns.
+
+Each resource has one Schema: its fields, the columns each field reads and
+how their values become JSON. An endpoint takes the fields it returns with
+`only()`, which selects just those columns and turns the row tuples into
+dicts, so no ORM objects are built and related rows are not lazy-loaded one
+by one; `dump_objects()` gives the same dict for ORM objects already loaded.
+`json_response()` encodes with orjson; dates and datetimes without a
+converter come out as ISO 8601, as from `.isoformat()`.
+"""
+from operator import itemgetter
+
+import orjson
+from flask import Response
+from sqlalchemy import func, select
+from sqlalchemy.dialects.postgresql import aggregate_order_by
+from sqlalchemy.orm import aliased
+
+from app import db
+from models.driver import Driver
+from models.maintenance import Maintenance
+from models.route import Route
+from models.user import User
+from models.vehicle import Vehicle
+from services.maps import format_distance, format_duration
+
+
+class Field:
+    """JSON value of one or more columns, passed to `convert` in order."""
+
+    def __init__(self, *columns, convert=None):
+        self.columns = columns
+        self.convert = convert
+
+    def reader(self, start: int):
+        if self.convert is None:
+            return itemgetter(start)
+        stop, convert = start + len(self.columns), self.convert
+        return lambda row: convert(*row[start:stop])
+
+
+class Nested:
+    """JSON object of `fields`; null when the `present` column is (outer join miss)."""
+
+    def __init__(self, present, **fields):
+        self.present = present
+        self.fields = {name: _field(field) for name, field in fields.items()}
+        self.columns = (present, *(column for field in self.fields.values() for column in field.columns))
+
+    def reader(self, start: int):
+        readers = _readers(self.fields, start + 1)
+
+        def read(row):
+            if row[start] is None:
+                return None
+            return {name: read_field(row) for name, read_field in readers}
+
+        return read
+
+
+def _field(field):
+    return field if isinstance(field, (Field, Nested)) else Field(field)
+
+
+def _readers(fields: dict, start: int) -> list:
+    readers = []
+    for name, field in fields.items():
+        readers.append((name, field.reader(start)))
+        start += len(field.columns)
+    return readers
+
+
+class Schema:
+    """Fields of a resource over `entity` and the outer joins their columns need."""
+
+    def __init__(self, entity, joins=(), **fields):
+        self.entity = entity
+        self.joins = joins
+        self.fields = {name: _field(field) for name, field in fields.items()}
+
+    def only(self, *names) -> 'Projection':
+        return Projection(self, {name: self.fields[name] for name in names})
+
+
+class Projection:
+    """The columns of some Schema fields and the rows -> dicts conversion."""
+
+    def __init__(self, schema: Schema, fields: dict):
+        self.schema = schema
+        self.columns = [column for field in fields.values() for column in field.columns]
+        self.readers = _readers(fields, 0)
+
+    def select(self, inner: bool = False):
+        """SELECT of the columns with the schema's joins; add filters, order and limit.
+
+        The joins are outer unless `inner`, which leaves out rows without the
+        related rows.
+        """
+
+        statement = select(*self.columns).select_from(self.schema.entity)
+        for target, onclause in self.schema.joins:
+            statement = statement.join(target, onclause, isouter=not inner)
+        return statement
+
+    def dump(self, row) -> dict:
+        return {name: read(row) for name, read in self.readers}
+
+    def dump_objects(self, *objects) -> dict:
+        """dump() read from ORM objects of the schema's entities; None for a missing one."""
+
+        by_entity = {type(obj): obj for obj in objects if obj is not None}
+        row = []
+        for column in self.columns:
+            obj = by_entity.get(column.class_)
+            row.append(getattr(obj, column.key) if obj is not None else None)
+        return self.dump(row)
+
+    def all(self, statement) -> list:
+        readers = self.readers
+        return [{name: read(row) for name, read in readers} for row in db.session.execute(statement)]
+
+    def first(self, statement):
+        row = db.session.execute(statement.limit(1)).first()
+        return self.dump(row) if row is not None else None
+
+
+def json_response(payload, status: int = 200) -> Response:
+    return Response(orjson.dumps(payload), status=status, mimetype='application/json')
+
+
+def iso_utc(value):
+    return value.isoformat() + 'Z' if value else None
+
+
+def point(lat, lon):
+    if lat is None or lon is None:
+        return None
+    return {'lat': lat, 'lon': lon}
+
+
+def waypoints(coords):
+    return [point(lat, lon) for lon, lat in coords or []]
+
+
+def _list(value):
+    return value or []
+
+
+DRIVER_NAME = dict(
+    first_name=Driver.first_name,
+    last_name=Driver.last_name,
+    license_number=Driver.license_number,
+)
+VEHICLE_BRIEF = dict(
+    id=Vehicle.id,
+    brand=Vehicle.brand,
+    model=Vehicle.model,
+    reg_number=Vehicle.reg_number,
+)
+
+USERS = Schema(
+    User,
+    joins=[(Driver, Driver.user_id == User.id)],
+    id=User.id,
+    username=User.username,
+    role=User.role,
+    created_at=User.created_at,
+    driver=Nested(Driver.id, **DRIVER_NAME),
+    vehicles=Field(
+        select(func.array_agg(aggregate_order_by(Vehicle.reg_number, Vehicle.id)))
+        .where(Vehicle.driver_id == Driver.id)
+        .scalar_subquery(),
+        convert=_list,
+    ),
+)
+
+VEHICLES = Schema(
+    Vehicle,
+    joins=[(Driver, Driver.id == Vehicle.driver_id)],
+    **VEHICLE_BRIEF,
+    driver=Nested(Driver.id, **DRIVER_NAME),
+)
+
+# a driver's vehicle is the one assigned last
+_assigned = aliased(Vehicle)
+DRIVERS = Schema(
+    Driver,
+    joins=[(
+        Vehicle,
+        Vehicle.id == select(_assigned.id)
+        .where(_assigned.driver_id == Driver.id)
+        .order_by(_assigned.created_at.desc())
+        .limit(1)
+        .scalar_subquery(),
+    )],
+    id=Driver.id,
+    **DRIVER_NAME,
+    vehicle=Nested(Vehicle.id, **VEHICLE_BRIEF),
+)
+
+MAINTENANCE = Schema(
+    Maintenance,
+    joins=[(Vehicle, Vehicle.id == Maintenance.vehicle_id)],
+    id=Maintenance.id,
+    type_of_work=Maintenance.type_of_work,
+    cost=Maintenance.cost,
+    created_at=Maintenance.created_at,
+    vehicle=Nested(Vehicle.id, **VEHICLE_BRIEF),
+)
+
+ROUTES = Schema(
+    Route,
+    joins=[(Driver, Driver.id == Route.driver_id), (Vehicle, Vehicle.id == Route.vehicle_id)],
+    id=Route.id,
+    start_location=Route.start_location,
+    end_location=Route.end_location,
+    stops=Field(Route.stops, convert=_list),
+    optimize_stops=Route.optimize_stops,
+    date=Route.date,
+    distance=Route.distance,
+    duration=Route.duration,
+    status=Route.status,
+    started_at=Field(Route.started_at, convert=iso_utc),
+    completed_at=Field(Route.completed_at, convert=iso_utc),
+    map_url=Route.map_url,
+    start_point=Field(Route.start_lat, Route.start_lon, convert=point),
+    end_point=Field(Route.end_lat, Route.end_lon, convert=point),
+    waypoints=Field(Route.waypoint_coords, convert=waypoints),
+    geometry=Route.geometry,
+    distance_text=Field(Route.distance, convert=format_distance),
+    duration_text=Field(Route.duration, convert=format_duration),
+    driver=Nested(Driver.id, id=Driver.id, **DRIVER_NAME),
+    vehicle=Nested(Vehicle.id, **VEHICLE_BRIEF),
+    vehicle_reg_number=Vehicle.reg_number,
+)
@@ -0,0 +1,159 @@
+"""Service-due ranking of the whole fleet.
+
+A vehicle is due for service after `service_interval_km` driven or
+`service_interval_days` passed since its last `service` maintenance (since
+it was added when it has none). Kilometres come from GPS
+(`vehicle_daily_distance`) from the vehicle's first tracked day on and from
+the planned distance of its routes before it (throughout for vehicles
+without telemetry), as on the driver's vehicle page.
+
+One query computes every vehicle's remaining km and days from per-vehicle
+index lookups and orders the fleet by urgency: the smaller of the remaining
+km and days as a share of their intervals, negative when overdue. Pages
+continue after the (urgency, id) of the previous page's last row.
+"""
+import base64
+from datetime import date
+import json
+
+from sqlalchemy import text
+
+from app import db
+from services.telemetry import fleet_today
+
+
+# remaining share of an interval below which service is "due soon"
+DUE_SOON_SHARE = 0.1
+
+SERVICE_DUE_SQL = text(
+    """
+    WITH base AS MATERIALIZED (
+        SELECT v.id, v.reg_number, v.brand, v.model,
+               v.service_interval_km, v.service_interval_days,
+               s.event_date AS last_service_date,
+               COALESCE(s.event_date, v.created_at::date) AS since,
+               (SELECT min(d.day) FROM vehicle_daily_distance d WHERE d.vehicle_id = v.id) AS first_tracked
+        FROM vehicle v
+        LEFT JOIN LATERAL (
+            SELECT m.event_date
+            FROM maintenance m
+            WHERE m.vehicle_id = v.id AND m.operation_type = 'service' AND m.event_date <= :today
+            ORDER BY m.event_date DESC
+            LIMIT 1
+        ) s ON true
+        WHERE CAST(:vehicle_id AS integer) IS NULL OR v.id = :vehicle_id
+    ),
+    measured AS (
+        SELECT b.*,
+               COALESCE(gps.km, 0) + COALESCE(planned.km, 0) AS km_since_service,
+               COALESCE(planned.km, 0) AS planned_km,
+               :today - b.since AS days_since_service
+        FROM base b
+        LEFT JOIN LATERAL (
+            SELECT sum(d.distance_km) AS km
+            FROM vehicle_daily_distance d
+            WHERE d.vehicle_id = b.id AND d.day >= b.since
+        ) gps ON true
+        LEFT JOIN LATERAL (
+            SELECT sum(r.distance) AS km
+            FROM route r
+            WHERE r.vehicle_id = b.id AND r.date >= b.since AND r.date <= :today
+              AND (b.first_tracked IS NULL OR r.date < b.first_tracked)
+        ) planned ON true
+    )
+    SELECT * FROM (
+        SELECT m.*,
+               LEAST(
+                   1 - m.km_since_service / GREATEST(m.service_interval_km, 1),
+                   1 - m.days_since_service::float / GREATEST(m.service_interval_days, 1)
+               ) AS urgency
+        FROM measured m
+    ) ranked
+    WHERE CAST(:after_urgency AS float) IS NULL OR (urgency, id) > (:after_urgency, :after_id)
+    ORDER BY urgency, id
+    LIMIT :limit
+    """
+)
+
+
+def encode_cursor(urgency: float, vehicle_id: int) -> str:
+    return base64.urlsafe_b64encode(json.dumps([urgency, vehicle_id]).encode()).decode()
+
+
+def decode_cursor(cursor: str):
+    """(urgency, vehicle_id) of a cursor, or raise ValueError."""
+
+    try:
+        urgency, vehicle_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return float(urgency), int(vehicle_id)
+    except (TypeError, ValueError, UnicodeDecodeError) as exc:
+        raise ValueError('invalid cursor') from exc
+
+
+def _status(row) -> str:
+    km_left = row.service_interval_km - row.km_since_service
+    days_left = row.service_interval_days - row.days_since_service
+    if km_left <= 0 or days_left <= 0:
+        return 'overdue'
+    if row.urgency <= DUE_SOON_SHARE:
+        return 'due_soon'
+    return 'ok'
+
+
+def _distance_source(row) -> str:
+    if row.first_tracked is None:
+        return 'routes'
+    return 'mixed' if row.planned_km else 'telemetry'
+
+
+def _serialize(row) -> dict:
+    return {
+        'vehicle_id': row.id,
+        'reg_number': row.reg_number,
+        'brand': row.brand,
+        'model': row.model,
+        'service_interval_km': row.service_interval_km,
+        'service_interval_days': row.service_interval_days,
+        'last_service_date': row.last_service_date.isoformat() if row.last_service_date else None,
+        'km_since_service': round(row.km_since_service, 1),
+        'days_since_service': row.days_since_service,
+        'km_left': round(row.service_interval_km - row.km_since_service, 1),
+        'days_left': row.service_interval_days - row.days_since_service,
+        'distance_source': _distance_source(row),
+        'urgency': round(row.urgency, 4),
+        'status': _status(row),
+    }
+
+
+def service_due(limit: int = 20, cursor: str = None, today: date = None):
+    """The fleet's most urgent vehicles: (items, next cursor or None)."""
+
+    after_urgency, after_id = decode_cursor(cursor) if cursor else (None, None)
+    rows = db.session.execute(
+        SERVICE_DUE_SQL,
+        {
+            'today': today or fleet_today(),
+            'vehicle_id': None,
+            'after_urgency': after_urgency,
+            'after_id': after_id,
+            'limit': limit + 1,
+        },
+    ).all()
+    next_cursor = encode_cursor(rows[limit - 1].urgency, rows[limit - 1].id) if len(rows) > limit else None
+    return [_serialize(row) for row in rows[:limit]], next_cursor
+
+
+def vehicle_service_status(vehicle_id: int, today: date = None):
+    """service_due() entry of a single vehicle, or None when it does not exist."""
+
+    row = db.session.execute(
+        SERVICE_DUE_SQL,
+        {
+            'today': today or fleet_today(),
+            'vehicle_id': vehicle_id,
+            'after_urgency': None,
+            'after_id': None,
+            'limit': 1,
+        },
+    ).first()
+    return _serialize(row) if row else None
@@ -0,0 +1,155 @@
+"""Container startup: migrations, partitions, seed data and static assets.
+
+`flask startup` replaces the separate `flask db upgrade`, `flask partitions
+maintain`, `psql -f db_seed.sql` and `flask assets build` steps of the
+entrypoint with one process, so the app is imported once, and skips the
+work that is already done:
+
+- migrations run only when the database revision differs from the
+  migration heads;
+- db_seed.sql runs only when its checksum or the schema revision differs
+  from the ones stored in `app_state` after the last successful run;
+- assets are rebuilt only when the sources differ from the digest in the
+  existing manifest (they live in the container, not in the database).
+
+The database steps run under an advisory lock: replicas starting together
+wait for the first one and then find nothing left to do. Every phase is
+reported with its duration.
+"""
+import hashlib
+import os
+import time
+
+import click
+from alembic.script import ScriptDirectory
+from flask import current_app
+from flask_migrate import upgrade
+from sqlalchemy import text
+
+from app import db
+from assets import build, is_built
+from models.app_state import AppState
+from services.database import session_engine
+from services.partitions import maintain_locked
+
+
+LOCK_KEY = 'startup.prepare'
+SEED_STATE_KEY = 'startup.seed'
+# auto: skip what is up to date; force: run everything; skip: leave the
+# database alone (another replica or a release job prepares it)
+MODES = ('auto', 'force', 'skip')
+
+
+def head_revisions() -> set:
+    config = current_app.extensions['migrate'].migrate.get_config()
+    return set(ScriptDirectory.from_config(config).get_heads())
+
+
+def current_revisions(connection) -> set:
+    if connection.execute(text("SELECT to_regclass('alembic_version')")).scalar() is None:
+        return set()
+    return set(connection.execute(text('SELECT version_num FROM alembic_version')).scalars())
+
+
+def seed_checksum(path: str) -> str:
+    with open(path, 'rb') as fh:
+        return hashlib.sha256(fh.read()).hexdigest()
+
+
+class Phases:
+    """Collects (phase, seconds, note) and reports each as it finishes."""
+
+    def __init__(self, log):
+        self.log = log
+        self.timings = []
+
+    def add(self, phase: str, started: float, note: str):
+        seconds = time.monotonic() - started
+        self.timings.append((phase, seconds, note))
+        self.log(f'startup: {phase} — {seconds:.2f} с ({note})')
+
+
+def _migrate(connection, force: bool) -> str:
+    heads = head_revisions()
+    current = current_revisions(connection)
+    connection.commit()
+    if current == heads and not force:
+        return 'пропущено: схема актуальна'
+    upgrade()
+    return f"выполнено: {', '.join(sorted(current)) or 'пустая БД'} -> {', '.join(sorted(heads))}"
+
+
+def _seed(path: str, force: bool) -> str:
+    expected = {'checksum': seed_checksum(path), 'revision': sorted(head_revisions())}
+    if AppState.get_value(SEED_STATE_KEY) == expected and not force:
+        db.session.rollback()
+        return 'пропущено: контрольная сумма совпадает'
+    with open(path, encoding='utf-8') as fh:
+        script = fh.read()
+    # the script has DO blocks and no parameters: hand it to the driver as is
+    connection = db.engine.raw_connection()
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute(script)
+        connection.commit()
+    finally:
+        connection.close()
+    AppState.set_value(SEED_STATE_KEY, expected)
+    db.session.commit()
+    return 'выполнено'
+
+
+def prepare(mode: str = 'auto', seed_path: str = None, log=print) -> list:
+    """Run the startup phases, return [(phase, seconds, note)]."""
+
+    phases = Phases(log)
+    force = mode == 'force'
+    seed_path = seed_path or os.path.join(current_app.root_path, 'db_seed.sql')
+
+    if mode != 'skip':
+        with session_engine().connect() as lock:
+            started = time.monotonic()
+            lock.execute(text('SELECT pg_advisory_lock(hashtext(:key))'), {'key': LOCK_KEY})
+            lock.commit()
+            phases.add('lock', started, 'получена')
+            try:
+                started = time.monotonic()
+                phases.add('migrate', started, _migrate(lock, force))
+
+                started = time.monotonic()
+                maintained = maintain_locked(log=lambda message: log(f'  {message}'))
+                phases.add('partitions', started, 'выполнено' if maintained else 'пропущено: выполняется другим процессом')
+
+                started = time.monotonic()
+                phases.add('seed', started, _seed(seed_path, force))
+            finally:
+                lock.execute(text('SELECT pg_advisory_unlock(hashtext(:key))'), {'key': LOCK_KEY})
+                lock.commit()
+
+    started = time.monotonic()
+    static_dir, dist_dir = current_app.static_folder, current_app.config['ASSETS_DIST_DIR']
+    if is_built(static_dir, dist_dir) and not force:
+        phases.add('assets', started, 'пропущено: сборка актуальна')
+    else:
+        current_app.extensions['assets_manifest'] = build(static_dir, dist_dir)
+        phases.add('assets', started, 'выполнено')
+    return phases.timings
+
+
+@click.command('startup')
+@click.option('--mode', type=click.Choice(MODES), default=lambda: os.environ.get('STARTUP_MODE', 'auto'),
+              show_default='STARTUP_MODE или auto', help='auto — пропускать актуальное, force — выполнить всё, '
+                                                         'skip — не трогать БД.')
+@click.option('--seed-file', type=click.Path(exists=True, dir_okay=False), help='SQL-скрипт начальных данных.')
+def startup_command(mode, seed_file):
+    """Подготовить БД и статические ресурсы к запуску приложения."""
+
+    timings = current_app.extensions.get('startup_timings', {})
+    if 'create_app' in timings:
+        click.echo(f"startup: create_app — {timings['create_app']:.2f} с")
+    phases = prepare(mode, seed_file, log=click.echo)
+    click.echo(f'startup: всего {sum(seconds for _, seconds, _ in phases):.2f} с')
+
+
+def init_startup(app):
+    app.cli.add_command(startup_command)
@@ -0,0 +1,419 @@
+"""Synthetic fleet data for load and performance testing.
+
+`flask synthetic generate` creates drivers (with user accounts), vehicles,
+routes and maintenance at any scale and loads them with COPY. Everything is
+drawn from NumPy generators seeded by `--seed` and a fixed chunk index, so
+the same seed and `--until` give the same rows on every run.
+
+The shape follows a real fleet rather than uniform noise:
+
+- addresses come from a fixed pool with Zipf popularity, each vehicle has a
+  home depot most of its routes start from;
+- vehicles differ in activity (log-normal weights), the volume grows over
+  the period and drops at weekends;
+- fuel fills follow each vehicle's odometer and own consumption, with a
+  small share of theft-like outliers; service visits come between fills.
+
+Generated rows are told apart by `--prefix` in registration numbers,
+licences and usernames; `flask synthetic drop` removes them again.
+"""
+from datetime import date, datetime, timedelta
+import io
+import itertools
+import time
+
+import click
+import numpy as np
+from flask.cli import AppGroup
+from sqlalchemy import text
+from werkzeug.security import generate_password_hash
+
+from app import db
+from services.geo import EARTH_RADIUS_KM
+from services.partitions import PARTITIONED_TABLES, add_months, create_partition, monthly_partitions
+from services.pgcopy import copy_expert
+
+
+# Rows are generated and committed in chunks of whole vehicles of about this
+# size; the chunking is part of the seed, so it is not an option.
+CHUNK_ROWS = 200_000
+DRIVER_PASSWORD = 'driver'
+
+# name, centre, radius in degrees of latitude, share of addresses
+CITIES = (
+    ('Москва', 55.7558, 37.6173, 0.12, 0.5),
+    ('Санкт-Петербург', 59.9343, 30.3351, 0.10, 0.2),
+    ('Казань', 55.7961, 49.1064, 0.06, 0.1),
+    ('Екатеринбург', 56.8389, 60.6057, 0.06, 0.1),
+    ('Новосибирск', 55.0084, 82.9357, 0.06, 0.1),
+)
+STREETS = (
+    'ул. Ленина', 'ул. Гагарина', 'ул. Мира', 'ул. Советская', 'ул. Садовая', 'пр. Победы',
+    'ул. Лесная', 'ул. Школьная', 'ул. Заводская', 'ул. Набережная', 'Складской пр.', 'ул. Строителей',
+    'ул. Промышленная', 'ул. Кирова', 'ул. Пушкина', 'Индустриальное ш.',
+)
+# brand, model, base consumption l/100 km
+MODELS = (
+    ('Ford', 'Transit', 11.5),
+    ('Mercedes', 'Sprinter', 10.5),
+    ('GAZ', 'Gazelle', 13.5),
+    ('Renault', 'Master', 10.0),
+    ('Volkswagen', 'Crafter', 10.0),
+    ('Iveco', 'Daily', 12.0),
+    ('KAMAZ', '4308', 22.0),
+)
+SERVICE_WORKS = ('ТО-1', 'ТО-2', 'Замена масла', 'Замена шин', 'Замена колодок', 'Диагностика')
+FIRST_NAMES = ('Иван', 'Сергей', 'Алексей', 'Дмитрий', 'Андрей', 'Михаил', 'Николай', 'Павел')
+LAST_NAMES = ('Петров', 'Ильин', 'Сидоров', 'Смирнов', 'Кузнецов', 'Попов', 'Волков', 'Фёдоров')
+
+ZIPF_EXPONENT = 1.1
+DEPOTS = 50
+DEPOT_SHARE = 0.6
+# route volume at the end of the period relative to its start
+GROWTH = 2.0
+WEEKDAY_FACTORS = (1.0, 1.0, 1.0, 1.0, 0.95, 0.5, 0.25)
+SERVICE_SHARE = 0.1
+THEFT_SHARE = 0.001
+FUEL_PRICE = 58.0
+
+ROUTE_COPY_SQL = (
+    'COPY route (start_location, end_location, date, distance, duration, resolved_at, '
+    'start_lat, start_lon, end_lat, end_lon, status, started_at, completed_at, '
+    'vehicle_id, driver_id, created_at, updated_at) FROM STDIN'
+)
+MAINTENANCE_COPY_SQL = (
+    'COPY maintenance (operation_type, type_of_work, cost, event_date, mileage_km, fuel_volume_l, '
+    'vehicle_id, created_at, updated_at) FROM STDIN'
+)
+
+synthetic_cli = AppGroup('synthetic', help='Синтетические данные для нагрузочных тестов.')
+
+
+def _rng(seed: int, *stream) -> np.random.Generator:
+    return np.random.default_rng([seed, *stream])
+
+
+def _copy(sql: str, columns):
+    """COPY equally long columns of strings (or repeated constants)."""
+
+    buffer = io.StringIO()
+    buffer.write('\n'.join(map('\t'.join, zip(*columns))))
+    buffer.write('\n')
+    buffer.seek(0)
+    copy_expert(sql, buffer)
+
+
+def _strings(values, decimals: int = None):
+    if decimals is not None:
+        values = np.round(values, decimals)
+    return values.astype(str).tolist()
+
+
+def _timestamps(values) -> list:
+    return np.datetime_as_string(values, unit='s').tolist()
+
+
+def _repeat(value: str):
+    return itertools.repeat(value)
+
+
+class AddressPool:
+    """Fixed set of addresses with coordinates and Zipf popularity."""
+
+    def __init__(self, size: int, seed: int):
+        rng = _rng(seed, 0)
+        city = rng.choice(len(CITIES), size, p=np.array([entry[4] for entry in CITIES]))
+        street = rng.integers(0, len(STREETS), size)
+        house = rng.integers(1, 200, size)
+        centres = np.array([entry[1:4] for entry in CITIES])[city]
+        angle = rng.uniform(0, 2 * np.pi, size)
+        distance = centres[:, 2] * np.sqrt(rng.uniform(0, 1, size))
+        self.lat = centres[:, 0] + distance * np.sin(angle)
+        self.lon = centres[:, 1] + distance * np.cos(angle) / np.cos(np.radians(centres[:, 0]))
+        self.names = np.array([
+            f'{CITIES[c][0]}, {STREETS[s]}, {h}' for c, s, h in zip(city.tolist(), street.tolist(), house.tolist())
+        ])
+        weights = 1.0 / np.arange(1, size + 1) ** ZIPF_EXPONENT
+        self.p = weights / weights.sum()
+
+    def sample(self, rng: np.random.Generator, size: int) -> np.ndarray:
+        return rng.choice(len(self.p), size, p=self.p)
+
+
+def _day_weights(days: int, until: date) -> np.ndarray:
+    offsets = np.arange(days)
+    first = until - timedelta(days=days - 1)
+    weekdays = (first.weekday() + offsets) % 7
+    weights = (1 + (GROWTH - 1) * offsets / max(days - 1, 1)) * np.array(WEEKDAY_FACTORS)[weekdays]
+    return weights / weights.sum()
+
+
+def _chunks(counts: np.ndarray):
+    """(first, last + 1) vehicle index ranges of about CHUNK_ROWS rows."""
+
+    ends = np.cumsum(counts)
+    start = 0
+    while start < len(counts):
+        base = ends[start - 1] if start else 0
+        stop = max(int(np.searchsorted(ends, base + CHUNK_ROWS, side='right')), start + 1)
+        yield start, stop
+        start = stop
+
+
+def _haversine_km(lat1, lon1, lat2, lon2):
+    lat1, lon1, lat2, lon2 = map(np.radians, (lat1, lon1, lat2, lon2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(a))
+
+
+def _ensure_partitions(first: date, last: date):
+    """Monthly partitions for the period, so COPY does not fill DEFAULT."""
+
+    connection = db.session.connection()
+    for name in ('route', 'maintenance'):
+        table = PARTITIONED_TABLES[name]
+        existing = monthly_partitions(connection, name)
+        month = first.replace(day=1)
+        while month <= last:
+            if month not in existing:
+                create_partition(connection, table, month)
+            month = add_months(month, 1)
+    db.session.commit()
+
+
+def _create_fleet(vehicles: int, prefix: str, seed: int, since: date, pool: AddressPool):
+    """Users, drivers and vehicles; returns (vehicle ids, driver ids, model index, depot)."""
+
+    rng = _rng(seed, 1)
+    created = datetime.combine(since, datetime.min.time()).isoformat()
+    numbers = [f'{index:06d}' for index in range(vehicles)]
+    usernames = [f'{prefix.lower()}-driver-{number}' for number in numbers]
+    password = generate_password_hash(DRIVER_PASSWORD)
+
+    _copy(
+        'COPY users (username, password, role, created_at, updated_at) FROM STDIN',
+        [usernames, _repeat(password), _repeat('driver'), _repeat(created), _repeat(created)],
+    )
+    user_ids = db.session.execute(
+        text('SELECT id FROM users WHERE username LIKE :pattern ORDER BY username'),
+        {'pattern': f'{prefix.lower()}-driver-%'},
+    ).scalars().all()
+
+    _copy(
+        'COPY driver (first_name, last_name, license_number, user_id, created_at, updated_at) FROM STDIN',
+        [
+            np.array(FIRST_NAMES)[rng.integers(0, len(FIRST_NAMES), vehicles)].tolist(),
+            np.array(LAST_NAMES)[rng.integers(0, len(LAST_NAMES), vehicles)].tolist(),
+            [f'{prefix}-L{number}' for number in numbers],
+            [str(user_id) for user_id in user_ids],
+            _repeat(created), _repeat(created),
+        ],
+    )
+    driver_ids = np.array(db.session.execute(
+        text('SELECT id FROM driver WHERE license_number LIKE :pattern ORDER BY license_number'),
+        {'pattern': f'{prefix}-L%'},
+    ).scalars().all())
+
+    model = rng.integers(0, len(MODELS), vehicles)
+    _copy(
+        'COPY vehicle (brand, model, reg_number, driver_id, created_at, updated_at) FROM STDIN',
+        [
+            [MODELS[index][0] for index in model.tolist()],
+            [MODELS[index][1] for index in model.tolist()],
+            [f'{prefix}{number}' for number in numbers],
+            _strings(driver_ids),
+            _repeat(created), _repeat(created),
+        ],
+    )
+    vehicle_ids = np.array(db.session.execute(
+        text('SELECT id FROM vehicle WHERE reg_number LIKE :pattern ORDER BY reg_number'),
+        {'pattern': f'{prefix}%'},
+    ).scalars().all())
+    db.session.commit()
+
+    depot = rng.integers(0, min(DEPOTS, len(pool.p)), vehicles)
+    return vehicle_ids, driver_ids, model, depot
+
+
+def _generate_routes(total: int, seed: int, fleet, pool: AddressPool, until: date, days: int, log):
+    vehicle_ids, driver_ids, _, depot = fleet
+    rng = _rng(seed, 2)
+    activity = rng.lognormal(0, 0.5, len(vehicle_ids))
+    counts = rng.multinomial(total, activity / activity.sum())
+    day_p = _day_weights(days, until)
+    first = np.datetime64(until - timedelta(days=days - 1), 'D')
+    today = np.datetime64(until, 'D')
+    now = np.datetime64(datetime.combine(until, datetime.min.time()), 's')
+
+    loaded = 0
+    for chunk, (start, stop) in enumerate(_chunks(counts)):
+        rng = _rng(seed, 2, chunk)
+        index = np.repeat(np.arange(start, stop), counts[start:stop])
+        size = len(index)
+        if not size:
+            continue
+        origin = np.where(rng.random(size) < DEPOT_SHARE, depot[index], pool.sample(rng, size))
+        destination = pool.sample(rng, size)
+        destination = np.where(destination == origin, (destination + 1) % len(pool.p), destination)
+
+        distance = _haversine_km(pool.lat[origin], pool.lon[origin], pool.lat[destination], pool.lon[destination])
+        distance = np.maximum(distance * rng.uniform(1.2, 1.5, size), 0.5)
+        duration = distance / rng.lognormal(np.log(35), 0.25, size) * 3600
+        day = first + rng.choice(days, size, p=day_p).astype('timedelta64[D]')
+        completed = day < today
+        departure = np.clip(rng.normal(10, 2.5, size), 5, 21) * 3600
+        started = day.astype('datetime64[s]') + departure.astype(np.int64).astype('timedelta64[s]')
+        finished = started + (duration * rng.lognormal(0, 0.15, size)).astype(np.int64).astype('timedelta64[s]')
+        created = np.minimum(day.astype('datetime64[s]') - np.timedelta64(1, 'D'), now)
+        null = np.full(size, '\\N', dtype=object)
+
+        _copy(ROUTE_COPY_SQL, [
+            pool.names[origin].tolist(), pool.names[destination].tolist(), _strings(day),
+            _strings(distance, 2), _strings(duration, 0), _timestamps(created),
+            _strings(pool.lat[origin], 6), _strings(pool.lon[origin], 6),
+            _strings(pool.lat[destination], 6), _strings(pool.lon[destination], 6),
+            np.where(completed, 'completed', 'planned').tolist(),
+            np.where(completed, np.array(_timestamps(started), dtype=object), null).tolist(),
+            np.where(completed, np.array(_timestamps(finished), dtype=object), null).tolist(),
+            _strings(vehicle_ids[index]), _strings(driver_ids[index]),
+            _timestamps(created), _timestamps(created),
+        ])
+        db.session.commit()
+        loaded += size
+        log(f'route: {loaded}/{total}')
+    return loaded
+
+
+def _generate_maintenance(total: int, seed: int, fleet, until: date, days: int, log):
+    vehicle_ids, _, model, _ = fleet
+    rng = _rng(seed, 3)
+    activity = rng.lognormal(0, 0.5, len(vehicle_ids))
+    counts = rng.multinomial(total, activity / activity.sum())
+    start_mileage = rng.integers(5_000, 150_000, len(vehicle_ids))
+    consumption = np.array([MODELS[index][2] for index in model.tolist()]) * rng.lognormal(0, 0.1, len(vehicle_ids))
+    day_p = _day_weights(days, until)
+    first = np.datetime64(until - timedelta(days=days - 1), 'D')
+
+    loaded = 0
+    for chunk, (start, stop) in enumerate(_chunks(counts)):
+        rng = _rng(seed, 3, chunk)
+        index = np.repeat(np.arange(start, stop), counts[start:stop])
+        size = len(index)
+        if not size:
+            continue
+        day = first + rng.choice(days, size, p=day_p).astype('timedelta64[D]')
+        # `index` is already grouped by vehicle: order each group by day, then
+        # odometers grow along each vehicle's events
+        day = day[np.lexsort((day, index))]
+        fuel = rng.random(size) >= SERVICE_SHARE
+        step = np.where(fuel, np.clip(rng.normal(450, 120, size), 80, None), rng.uniform(0, 20, size))
+        total_km = np.cumsum(step)
+        group_start = np.r_[0, np.flatnonzero(np.diff(index)) + 1]
+        offset = np.repeat(total_km[group_start] - step[group_start], np.diff(np.r_[group_start, size]))
+        mileage = start_mileage[index] + (total_km - offset).astype(np.int64)
+
+        volume = step * consumption[index] / 100 * rng.lognormal(0, 0.08, size)
+        volume = np.where(rng.random(size) < THEFT_SHARE, volume * rng.uniform(1.8, 3, size), volume)
+        cost = np.where(fuel, volume * FUEL_PRICE, rng.lognormal(np.log(12_000), 0.5, size))
+        work = np.array(SERVICE_WORKS)[rng.integers(0, len(SERVICE_WORKS), size)]
+        created = _timestamps(day.astype('datetime64[s]') + np.timedelta64(18, 'h'))
+
+        _copy(MAINTENANCE_COPY_SQL, [
+            np.where(fuel, 'fuel', 'service').tolist(),
+            np.where(fuel, 'Топливо', work).tolist(),
+            _strings(cost, 2), _strings(day), _strings(mileage),
+            np.where(fuel, np.array(_strings(volume, 2), dtype=object), '\\N').tolist(),
+            _strings(vehicle_ids[index]), created, created,
+        ])
+        db.session.commit()
+        loaded += size
+        log(f'maintenance: {loaded}/{total}')
+    return loaded
+
+
+def generate(vehicles: int, routes: int, maintenance: int, days: int, addresses: int, seed: int,
+             prefix: str, until: date = None, log=print) -> dict:
+    until = until or date.today()
+    since = until - timedelta(days=days - 1)
+    exists = db.session.execute(
+        text('SELECT 1 FROM vehicle WHERE reg_number LIKE :pattern LIMIT 1'), {'pattern': f'{prefix}%'}
+    ).first()
+    if exists:
+        raise ValueError(f'Машины с префиксом {prefix} уже есть, удалите их: flask synthetic drop --prefix {prefix}')
+
+    timings = {}
+    started = time.monotonic()
+    _ensure_partitions(since, until)
+    pool = AddressPool(addresses, seed)
+    fleet = _create_fleet(vehicles, prefix, seed, since, pool)
+    timings['fleet'] = time.monotonic() - started
+
+    started = time.monotonic()
+    _generate_routes(routes, seed, fleet, pool, until, days, log)
+    timings['route'] = time.monotonic() - started
+
+    started = time.monotonic()
+    _generate_maintenance(maintenance, seed, fleet, until, days, log)
+    timings['maintenance'] = time.monotonic() - started
+
+    started = time.monotonic()
+    for table in ('users', 'driver', 'vehicle', 'route', 'maintenance'):
+        db.session.execute(text(f'ANALYZE {table}'))
+    db.session.commit()
+    timings['analyze'] = time.monotonic() - started
+    return timings
+
+
+def drop(prefix: str) -> dict:
+    """Delete the rows generated with `prefix`; the caller commits."""
+
+    params = {'vehicles': f'{prefix}%', 'licences': f'{prefix}-L%', 'users': f'{prefix.lower()}-driver-%'}
+    vehicles = 'SELECT id FROM vehicle WHERE reg_number LIKE :vehicles'
+    removed = {}
+    for table, sql in (
+        ('route', f'DELETE FROM route WHERE vehicle_id IN ({vehicles})'),
+        ('maintenance', f'DELETE FROM maintenance WHERE vehicle_id IN ({vehicles})'),
+        ('vehicle', 'DELETE FROM vehicle WHERE reg_number LIKE :vehicles'),
+        ('driver', 'DELETE FROM driver WHERE license_number LIKE :licences'),
+        ('users', 'DELETE FROM users WHERE username LIKE :users'),
+    ):
+        removed[table] = db.session.execute(text(sql), params).rowcount
+    return removed
+
+
+@synthetic_cli.command('generate')
+@click.option('--vehicles', default=1000, show_default=True, help='Машин (и водителей).')
+@click.option('--routes', default=100_000, show_default=True, help='Маршрутов.')
+@click.option('--maintenance', default=50_000, show_default=True, help='Записей обслуживания и заправок.')
+@click.option('--days', default=365, show_default=True, help='Длина периода в днях.')
+@click.option('--addresses', default=5000, show_default=True, help='Размер пула адресов.')
+@click.option('--seed', default=1, show_default=True, help='Зерно генератора.')
+@click.option('--prefix', default='SYN', show_default=True, help='Префикс госномеров, прав и логинов.')
+@click.option('--until', type=click.DateTime(['%Y-%m-%d']), help='Последний день периода (по умолчанию сегодня).')
+def generate_command(vehicles, routes, maintenance, days, addresses, seed, prefix, until):
+    """Сгенерировать парк с маршрутами и обслуживанием."""
+
+    if vehicles < 1 or days < 1 or addresses < 2 or routes < 0 or maintenance < 0:
+        raise click.BadParameter('нужны хотя бы 1 машина, 1 день и 2 адреса')
+    try:
+        timings = generate(
+            vehicles, routes, maintenance, days, addresses, seed, prefix,
+            until.date() if until else None, log=click.echo,
+        )
+    except ValueError as exc:
+        raise click.ClickException(str(exc))
+    click.echo(', '.join(f'{stage}: {seconds:.1f} с' for stage, seconds in timings.items()))
+
+
+@synthetic_cli.command('drop')
+@click.option('--prefix', default='SYN', show_default=True, help='Префикс сгенерированных данных.')
+def drop_command(prefix):
+    """Удалить сгенерированные данные."""
+
+    removed = drop(prefix)
+    db.session.commit()
+    click.echo(', '.join(f'{table}: {rows}' for table, rows in removed.items()))
+
+
+def init_synthetic(app):
+    app.cli.add_command(synthetic_cli)
@@ -0,0 +1,223 @@
+"""Parsing, validation and bulk writing of GPS telemetry.
+
+Wire format (NDJSON, one vehicle batch per line):
+
+    {"vehicle_id": 12, "fixes": [[1767225600, 55.7512, 37.6184, 42.5, 18734.2], ...]}
+
+A fix is `[timestamp, lat, lon, speed_kmh, odometer_km]`; the timestamp is
+Unix seconds (UTC) or an ISO 8601 string, speed and odometer are optional.
+Valid fixes are written with a single COPY, invalid ones are reported back
+without failing the rest of the request.
+"""
+from dataclasses import dataclass, field
+from datetime import date, datetime, timedelta, timezone
+import io
+import threading
+import time
+from typing import List, Optional, Tuple
+from zoneinfo import ZoneInfo
+
+import orjson
+from flask import current_app
+
+from app import db
+from models.vehicle import Vehicle
+from services.pgcopy import copy_chunks
+
+
+# Fixes older than this or from the future are rejected as clock errors.
+MAX_FIX_AGE = timedelta(days=30)
+MAX_FIX_SKEW = timedelta(minutes=5)
+MAX_SPEED_KMH = 300.0
+MAX_REPORTED_ERRORS = 50
+# fixes per COPY; a gevent worker blocks for one COPY at a time (services/pgcopy.py)
+COPY_CHUNK_FIXES = 2000
+
+_EPOCH = datetime(1970, 1, 1)
+_NULL = '\\N'
+
+COPY_SQL = (
+    'COPY telemetry_fix (vehicle_id, recorded_at, lat, lon, speed_kmh, odometer_km) '
+    'FROM STDIN'
+)
+
+# (vehicle_id, recorded_at (unix seconds), lat, lon, speed_kmh, odometer_km)
+Fix = Tuple[int, float, float, float, Optional[float], Optional[float]]
+
+
+@dataclass
+class ParseResult:
+    fixes: List[Fix] = field(default_factory=list)
+    rejected: int = 0
+    errors: List[dict] = field(default_factory=list)
+
+    def reject(self, line: int, reason: str, index: int = None, count: int = 1):
+        self.rejected += count
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            error = {'line': line, 'reason': reason}
+            if index is not None:
+                error['index'] = index
+            self.errors.append(error)
+
+
+def _timestamp(value) -> float:
+    if isinstance(value, str):
+        parsed = datetime.fromisoformat(value.replace('Z', '+00:00'))
+        if parsed.tzinfo is None:
+            parsed = parsed.replace(tzinfo=timezone.utc)
+        return parsed.timestamp()
+    return float(value)
+
+
+def parse_ndjson(body: bytes, now: float = None) -> ParseResult:
+    now = time.time() if now is None else now
+    oldest = now - MAX_FIX_AGE.total_seconds()
+    newest = now + MAX_FIX_SKEW.total_seconds()
+
+    result = ParseResult()
+    append = result.fixes.append
+    for line_no, line in enumerate(body.splitlines(), 1):
+        if not line.strip():
+            continue
+        try:
+            batch = orjson.loads(line)
+        except orjson.JSONDecodeError:
+            result.reject(line_no, 'invalid json')
+            continue
+
+        vehicle_id = batch.get('vehicle_id') if isinstance(batch, dict) else None
+        fixes = batch.get('fixes') if isinstance(batch, dict) else None
+        if not isinstance(vehicle_id, int) or isinstance(vehicle_id, bool) or not isinstance(fixes, list):
+            result.reject(line_no, 'expected {"vehicle_id": int, "fixes": [...]}')
+            continue
+
+        for index, fix in enumerate(fixes):
+            try:
+                ts = _timestamp(fix[0])
+                lat = float(fix[1])
+                lon = float(fix[2])
+                speed = float(fix[3]) if len(fix) > 3 and fix[3] is not None else None
+                odometer = float(fix[4]) if len(fix) > 4 and fix[4] is not None else None
+            except (TypeError, ValueError, IndexError, KeyError):
+                result.reject(line_no, 'malformed fix', index)
+                continue
+
+            if not (oldest <= ts <= newest):
+                result.reject(line_no, 'timestamp out of range', index)
+            elif not (-90.0 <= lat <= 90.0 and -180.0 <= lon <= 180.0):
+                result.reject(line_no, 'coordinates out of range', index)
+            elif speed is not None and not (0.0 <= speed <= MAX_SPEED_KMH):
+                result.reject(line_no, 'speed out of range', index)
+            elif odometer is not None and odometer < 0:
+                result.reject(line_no, 'negative odometer', index)
+            else:
+                append((vehicle_id, ts, lat, lon, speed, odometer))
+
+    return result
+
+
+class _VehicleIds:
+    """Per-process cache of existing vehicle ids, refreshed on unknown ids."""
+
+    def __init__(self, ttl: float = 300.0):
+        self.ttl = ttl
+        self._ids = frozenset()
+        self._loaded_at = 0.0
+        self._lock = threading.Lock()
+
+    def unknown(self, vehicle_ids) -> set:
+        missing = set(vehicle_ids) - self._ids
+        if missing or time.monotonic() - self._loaded_at > self.ttl:
+            with self._lock:
+                self._ids = frozenset(vid for (vid,) in db.session.query(Vehicle.id))
+                self._loaded_at = time.monotonic()
+            missing = set(vehicle_ids) - self._ids
+        return missing
+
+
+known_vehicles = _VehicleIds()
+
+
+def _drop_vehicles(result: ParseResult, vehicle_ids: set, reason: str):
+    if not vehicle_ids:
+        return
+    kept = [fix for fix in result.fixes if fix[0] not in vehicle_ids]
+    for vehicle_id in sorted(vehicle_ids):
+        result.errors.append({'vehicle_id': vehicle_id, 'reason': reason})
+    result.rejected += len(result.fixes) - len(kept)
+    result.fixes = kept
+
+
+def drop_unknown_vehicles(result: ParseResult):
+    _drop_vehicles(result, known_vehicles.unknown({fix[0] for fix in result.fixes}), 'unknown vehicle')
+
+
+def drop_unassigned_vehicles(result: ParseResult, allowed: set):
+    """Drop fixes of vehicles outside `allowed` (the ones assigned to the driver)."""
+
+    _drop_vehicles(result, {fix[0] for fix in result.fixes} - allowed, 'vehicle not assigned')
+
+
+def fix_datetime(ts: float) -> datetime:
+    """Naive UTC datetime of a fix timestamp, as stored in the database."""
+
+    return _EPOCH + timedelta(seconds=ts)
+
+
+def fleet_zone() -> ZoneInfo:
+    return ZoneInfo(current_app.config['FLEET_TIMEZONE'])
+
+
+def fix_local_date(ts: float) -> date:
+    """Calendar day of a fix in the fleet's timezone (FLEET_TIMEZONE), as route.date is."""
+
+    return datetime.fromtimestamp(ts, fleet_zone()).date()
+
+
+def local_date(at: datetime) -> date:
+    """Fleet-local calendar day of a naive UTC datetime."""
+
+    return at.replace(tzinfo=timezone.utc).astimezone(fleet_zone()).date()
+
+
+def fleet_today() -> date:
+    """Today in the fleet's timezone."""
+
+    return datetime.now(fleet_zone()).date()
+
+
+def local_day_start(day: date) -> datetime:
+    """Naive UTC datetime of the fleet-local midnight that starts `day`."""
+
+    start = datetime(day.year, day.month, day.day, tzinfo=fleet_zone())
+    return start.astimezone(timezone.utc).replace(tzinfo=None)
+
+
+def fix_days(fixes: List[Fix]) -> set:
+    """Fleet-local dates the fixes were recorded on."""
+
+    # UTC offsets are whole quarter hours, so one fix per quarter hour decides its date
+    quarters = {int(fix[1] // 900) for fix in fixes}
+    return {fix_local_date(quarter * 900) for quarter in quarters}
+
+
+def _copy_buffer(fixes: List[Fix]) -> io.StringIO:
+    buffer = io.StringIO()
+    write = buffer.write
+    epoch = _EPOCH
+    for vehicle_id, ts, lat, lon, speed, odometer in fixes:
+        write(
+            f"{vehicle_id}\t{epoch + timedelta(seconds=ts)}\t{lat}\t{lon}\t"
+            f"{_NULL if speed is None else speed}\t{_NULL if odometer is None else odometer}\n"
+        )
+    buffer.seek(0)
+    return buffer
+
+
+def copy_fixes(fixes: List[Fix]):
+    """COPY fixes into telemetry_fix inside the current session transaction."""
+
+    copy_chunks(
+        COPY_SQL,
+        (_copy_buffer(fixes[start:start + COPY_CHUNK_FIXES]) for start in range(0, len(fixes), COPY_CHUNK_FIXES)),
+    )
@@ -0,0 +1,342 @@
+"""Trips and stops detected in the telemetry stream.
+
+The segmenter reads each vehicle's fixes in time order and keeps a small,
+fixed-size state per vehicle (`TrackState`), persisted in `trip_state`
+together with the time up to which the vehicle's fixes were processed. A run
+picks up from there, so reprocessing a day never loads the whole day: fixes
+are streamed from a server-side cursor in batches of vehicles.
+
+A vehicle is stopped while its fixes stay within `STOP_RADIUS_KM` of an
+anchor point. It starts a trip when it leaves the anchor; the trip ends once
+the vehicle stays near a new anchor for `STOP_MIN_SECONDS` (the end is the
+arrival at that anchor) or the data stops for longer than `MAX_GAP_SECONDS`.
+Time below `IDLE_SPEED_KMH` during a trip (traffic, short stops) is counted
+as idling. A stop is the time between two consecutive trips.
+
+Finished trips go to `trip` and are linked to the planned route of the same
+vehicle and fleet-local day whose geocoded start and end lie near the
+trip's ends.
+
+Fixes are processed only once they are `SETTLE_DELAY` old, so uploads that
+arrive a little out of order are still seen in order; fixes older than a
+vehicle's cursor when they arrive are not segmented.
+"""
+from dataclasses import asdict, dataclass
+from datetime import datetime, timedelta
+import time
+from typing import Optional
+
+import click
+from flask.cli import AppGroup
+from sqlalchemy import bindparam, text
+from sqlalchemy.dialects.postgresql import insert
+
+from app import db
+from models.route import Route
+from models.trip import Trip, TripState
+from models.vehicle import Vehicle
+from services.geo import haversine_km
+from services.jobs import enqueue, job_handler
+from services.telemetry import fix_datetime, local_date
+
+
+SEGMENT_JOB = 'trips.segment'
+SEGMENT_DELAY = timedelta(minutes=2)
+SETTLE_DELAY = timedelta(minutes=2)
+# where a vehicle without state starts
+INITIAL_LOOKBACK = timedelta(days=1)
+
+STOP_RADIUS_KM = 0.1
+STOP_MIN_SECONDS = 300
+IDLE_SPEED_KMH = 3.0
+MAX_GAP_SECONDS = 1800
+MAX_SPEED_KMH = 200.0
+MIN_TRIP_KM = 0.3
+LINK_RADIUS_KM = 1.0
+
+VEHICLES_PER_BATCH = 200
+FETCH_SIZE = 5000
+
+FIXES_SQL = text(
+    """
+    SELECT f.vehicle_id, extract(epoch FROM f.recorded_at), f.lat, f.lon, f.speed_kmh
+    FROM telemetry_fix f
+    JOIN unnest(CAST(:vehicle_ids AS integer[]), CAST(:cursors AS timestamp[])) AS c(vehicle_id, after)
+      ON f.vehicle_id = c.vehicle_id AND f.recorded_at > c.after
+    WHERE f.recorded_at > :since AND f.recorded_at <= :until
+    ORDER BY f.vehicle_id, f.recorded_at
+    """
+).bindparams(bindparam('vehicle_ids'), bindparam('cursors'))
+
+trips_cli = AppGroup('trips', help='Поездки и стоянки по данным GPS.')
+
+
+@dataclass
+class TrackState:
+    """Bounded segmentation state of one vehicle; times are unix seconds."""
+
+    last_t: Optional[float] = None
+    last_lat: float = 0.0
+    last_lon: float = 0.0
+
+    # where the vehicle is (or was last) standing
+    anchor_t: float = 0.0
+    anchor_lat: float = 0.0
+    anchor_lon: float = 0.0
+
+    moving: bool = False
+    trip_t: float = 0.0
+    trip_lat: float = 0.0
+    trip_lon: float = 0.0
+    distance_km: float = 0.0
+    idle_seconds: float = 0.0
+    max_speed_kmh: float = 0.0
+    fixes: int = 0
+    # trip totals at the moment the current anchor was set, i.e. the values
+    # the trip ends with if the vehicle turns out to have stopped there
+    anchor_distance_km: float = 0.0
+    anchor_idle_seconds: float = 0.0
+    anchor_fixes: int = 0
+
+    def feed(self, t: float, lat: float, lon: float, speed_kmh: Optional[float]) -> Optional[dict]:
+        """Advance by one fix; return a finished trip, if this fix ends one."""
+
+        if self.last_t is None:
+            self._set_anchor(t, lat, lon)
+            self._set_last(t, lat, lon)
+            return None
+
+        dt = t - self.last_t
+        if dt <= 0:
+            return None
+        step = haversine_km(self.last_lat, self.last_lon, lat, lon)
+        implied_speed = step / dt * 3600
+        if implied_speed > MAX_SPEED_KMH and dt <= MAX_GAP_SECONDS:
+            # GPS jump: skip the fix, the next one is compared with the last good one
+            return None
+
+        finished = None
+        if dt > MAX_GAP_SECONDS:
+            if self.moving:
+                finished = self._finish(self.last_t, self.last_lat, self.last_lon,
+                                        self.distance_km, self.idle_seconds, self.fixes)
+            self._set_anchor(t, lat, lon)
+            self._set_last(t, lat, lon)
+            return finished
+
+        if self.moving:
+            self.distance_km += step
+            self.fixes += 1
+            self.max_speed_kmh = max(self.max_speed_kmh, speed_kmh if speed_kmh is not None else implied_speed)
+            if speed_kmh is not None and speed_kmh < IDLE_SPEED_KMH:
+                self.idle_seconds += dt
+
+        if haversine_km(self.anchor_lat, self.anchor_lon, lat, lon) <= STOP_RADIUS_KM:
+            if self.moving and t - self.anchor_t >= STOP_MIN_SECONDS:
+                finished = self._finish(self.anchor_t, self.anchor_lat, self.anchor_lon,
+                                        self.anchor_distance_km, self.anchor_idle_seconds, self.anchor_fixes)
+        else:
+            if not self.moving:
+                # departure from the last fix near the anchor
+                self.moving = True
+                self.trip_t, self.trip_lat, self.trip_lon = self.last_t, self.last_lat, self.last_lon
+                self.distance_km, self.idle_seconds, self.fixes = step, 0.0, 2
+                self.max_speed_kmh = speed_kmh if speed_kmh is not None else implied_speed
+            self._set_anchor(t, lat, lon)
+
+        self._set_last(t, lat, lon)
+        return finished
+
+    def _set_anchor(self, t, lat, lon):
+        self.anchor_t, self.anchor_lat, self.anchor_lon = t, lat, lon
+        self.anchor_distance_km = self.distance_km
+        self.anchor_idle_seconds = self.idle_seconds
+        self.anchor_fixes = self.fixes
+
+    def _set_last(self, t, lat, lon):
+        self.last_t, self.last_lat, self.last_lon = t, lat, lon
+
+    def _finish(self, t, lat, lon, distance_km, idle_seconds, fixes) -> Optional[dict]:
+        trip = None
+        if distance_km >= MIN_TRIP_KM:
+            trip = {
+                'started_at': fix_datetime(self.trip_t),
+                'ended_at': fix_datetime(t),
+                'start_lat': self.trip_lat,
+                'start_lon': self.trip_lon,
+                'end_lat': lat,
+                'end_lon': lon,
+                'distance_km': round(distance_km, 3),
+                'idle_seconds': int(idle_seconds),
+                'max_speed_kmh': round(self.max_speed_kmh, 1),
+                'fixes': fixes,
+            }
+        self.moving = False
+        self.distance_km = self.idle_seconds = self.max_speed_kmh = 0.0
+        self.fixes = 0
+        return trip
+
+    @classmethod
+    def load(cls, data: dict) -> 'TrackState':
+        return cls(**data)
+
+    def dump(self) -> dict:
+        return asdict(self)
+
+
+def link_routes(vehicle_id: int, trips):
+    """Set `route_id` of new trips to the planned route they fulfil.
+
+    Candidates are the vehicle's geocoded routes on the trip's days (fleet
+    local, as route.date) that are not linked to a trip yet; a trip takes the
+    one whose start and end are both within `LINK_RADIUS_KM` of its own,
+    nearest first.
+    """
+
+    days = {local_date(trip.started_at) for trip in trips} | {local_date(trip.ended_at) for trip in trips}
+    linked = db.session.query(Trip.route_id).filter(Trip.route_id.isnot(None))
+    candidates = (
+        Route.query
+        .filter(
+            Route.vehicle_id == vehicle_id,
+            Route.date.in_(days),
+            Route.start_lat.isnot(None),
+            Route.end_lat.isnot(None),
+            Route.id.notin_(linked),
+        )
+        .all()
+    )
+    taken = set()
+    for trip in sorted(trips, key=lambda item: item.started_at):
+        best = None
+        for route in candidates:
+            if route.id in taken or route.date not in (local_date(trip.started_at), local_date(trip.ended_at)):
+                continue
+            start = haversine_km(trip.start_lat, trip.start_lon, route.start_lat, route.start_lon)
+            end = haversine_km(trip.end_lat, trip.end_lon, route.end_lat, route.end_lon)
+            if start <= LINK_RADIUS_KM and end <= LINK_RADIUS_KM and (best is None or start + end < best[0]):
+                best = (start + end, route.id)
+        if best:
+            trip.route_id = best[1]
+            taken.add(best[1])
+
+
+def _save_states(states: dict, cursors: dict, now: datetime):
+    statement = insert(TripState.__table__).values([
+        {'vehicle_id': vehicle_id, 'cursor': cursors[vehicle_id], 'state': state.dump(), 'updated_at': now}
+        for vehicle_id, state in states.items()
+    ])
+    db.session.execute(statement.on_conflict_do_update(
+        index_elements=['vehicle_id'],
+        set_={'cursor': statement.excluded.cursor, 'state': statement.excluded.state,
+              'updated_at': statement.excluded.updated_at},
+    ))
+
+
+def segment_vehicles(vehicle_ids, until: datetime, now: datetime = None) -> dict:
+    """Feed the vehicles' unprocessed fixes up to `until` and store new trips; the caller commits."""
+
+    now = now or datetime.utcnow()
+    rows = TripState.query.filter(TripState.vehicle_id.in_(vehicle_ids)).all()
+    known = {row.vehicle_id: row for row in rows}
+    states, cursors = {}, {}
+    for vehicle_id in vehicle_ids:
+        row = known.get(vehicle_id)
+        states[vehicle_id] = TrackState.load(row.state) if row else TrackState()
+        cursors[vehicle_id] = row.cursor if row else now - INITIAL_LOOKBACK
+
+    summary = {'fixes': 0, 'trips': 0, 'linked': 0}
+    finished = {}
+    result = db.session.execute(
+        FIXES_SQL,
+        {
+            'vehicle_ids': list(vehicle_ids),
+            'cursors': [cursors[vehicle_id] for vehicle_id in vehicle_ids],
+            'since': min(cursors.values()),
+            'until': until,
+        },
+        execution_options={'yield_per': FETCH_SIZE},
+    )
+    for vehicle_id, ts, lat, lon, speed_kmh in result:
+        trip = states[vehicle_id].feed(float(ts), lat, lon, speed_kmh)
+        if trip:
+            finished.setdefault(vehicle_id, []).append(Trip(vehicle_id=vehicle_id, **trip))
+        summary['fixes'] += 1
+    result.close()
+
+    # every fix up to `until` has been fed
+    for vehicle_id in cursors:
+        cursors[vehicle_id] = max(cursors[vehicle_id], until)
+    for vehicle_id, trips in finished.items():
+        link_routes(vehicle_id, trips)
+        db.session.add_all(trips)
+        summary['trips'] += len(trips)
+        summary['linked'] += sum(1 for trip in trips if trip.route_id)
+
+    _save_states(states, cursors, now)
+    return summary
+
+
+def segment(vehicles_per_batch: int = VEHICLES_PER_BATCH, now: datetime = None, log=None) -> dict:
+    """Process all vehicles up to `SETTLE_DELAY` ago, committing per batch."""
+
+    now = now or datetime.utcnow()
+    until = now - SETTLE_DELAY
+    vehicle_ids = [vehicle_id for (vehicle_id,) in db.session.query(Vehicle.id).order_by(Vehicle.id)]
+    total = {'fixes': 0, 'trips': 0, 'linked': 0}
+    for offset in range(0, len(vehicle_ids), vehicles_per_batch):
+        batch = vehicle_ids[offset:offset + vehicles_per_batch]
+        summary = segment_vehicles(batch, until, now)
+        db.session.commit()
+        for key in total:
+            total[key] += summary[key]
+        if log:
+            log(f"машины {batch[0]}–{batch[-1]}: точек {summary['fixes']}, поездок {summary['trips']}")
+    return total
+
+
+@job_handler(SEGMENT_JOB, concurrency=1)
+def segment_job(payload: dict):
+    segment()
+
+
+def enqueue_segmentation():
+    """Queue a segmentation run in the current transaction."""
+
+    enqueue(SEGMENT_JOB, run_at=datetime.utcnow() + SEGMENT_DELAY, dedupe_key=SEGMENT_JOB)
+
+
+@trips_cli.command('segment')
+@click.option('--vehicles-per-batch', default=VEHICLES_PER_BATCH, show_default=True)
+def segment_command(vehicles_per_batch):
+    """Обработать новые GPS-точки: найти поездки и стоянки."""
+
+    started = time.monotonic()
+    total = segment(vehicles_per_batch, log=click.echo)
+    elapsed = time.monotonic() - started
+    click.echo(
+        f"Точек {total['fixes']}, поездок {total['trips']} (привязано к маршрутам {total['linked']}), "
+        f"{total['fixes'] / elapsed if elapsed else 0:.0f} точек/с"
+    )
+
+
+@trips_cli.command('reset')
+@click.option('--vehicle-id', type=int, default=None, help='Только эта машина.')
+@click.option('--since', type=click.DateTime(['%Y-%m-%d']), required=True, help='С какого дня (UTC) пересчитать.')
+def reset_command(vehicle_id, since):
+    """Удалить поездки начиная с дня и пересчитать их при следующем запуске."""
+
+    trips = Trip.query.filter(Trip.started_at >= since)
+    states = TripState.query
+    if vehicle_id:
+        trips = trips.filter(Trip.vehicle_id == vehicle_id)
+        states = states.filter(TripState.vehicle_id == vehicle_id)
+    deleted = trips.delete(synchronize_session=False)
+    # the state in the middle of the day is not stored, start from a clean one
+    states.update({'cursor': since, 'state': TrackState().dump()}, synchronize_session=False)
+    db.session.commit()
+    click.echo(f'Удалено поездок: {deleted}')
+
+
+def init_trips(app):
+    app.cli.add_command(trips_cli)